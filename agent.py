@@ -0,0 +1,191 @@
+#-----------------#
+# Imported modules
+import argparse                             # Import argparse for the agent options
+import gzip                                 # Import gzip for compressing host batches
+import json                                 # Import json for the batch and heartbeat payloads
+import random                               # Import random for the jitter of the retry delays
+import signal                               # Import signal for stopping the agent on SIGTERM
+import socket                               # Import socket for the default agent name
+import threading                            # Import threading for the heartbeat thread and the batch lock
+import time                                 # Import time for the scan interval and the retry delays
+import urllib.error                         # Import urllib.error for telling rejected batches from network errors
+import urllib.request                       # Import urllib.request for posting to the collector
+from concurrent.futures import ThreadPoolExecutor   # Import ThreadPoolExecutor for scanning shards in parallel
+from colorama import Fore                   # Import Fore from colorama for colored terminal text
+from config import SCAN_CONFIG              # Import the default scan settings used when no agent network is configured
+import config                               # Import config to read the optional AGENT_CONFIG section
+import network_monitor                      # Import network_monitor for the scan pipeline
+import tuning                               # Import tuning for the nmap timing per subnet
+from logger import log                      # Import log for leveled, rate-limited console output
+
+#-----------------#
+# Agent settings with defaults for installations whose config.py has no AGENT_CONFIG yet
+AGENT_CONFIG = {
+    'COLLECTOR_URL': 'http://127.0.0.1:5000',   # REST API with COLLECTOR_CONFIG['ENABLED'] set
+    'NAME': socket.gethostname(),               # Unique per agent, hosts are deduplicated by it
+    'TOKEN': '',                                # Must match COLLECTOR_CONFIG['TOKEN']
+    'NETWORK': SCAN_CONFIG['DEFAULT_NETWORK'],  # Space separated networks scanned by this agent
+    'PORTS': SCAN_CONFIG['DEFAULT_PORTS'],
+    'INTERVAL': SCAN_CONFIG['DEFAULT_INTERVAL'],    # Minutes between the starts of two cycles
+    'BATCH_SIZE': 500,                          # Hosts per compressed push
+    'HEARTBEAT_INTERVAL': 30,                   # Seconds between heartbeats, keep below COLLECTOR_CONFIG['OFFLINE_AFTER']
+    'RETRIES': 5,                               # Attempts per push after the first one
+    'BACKOFF': 1,                               # Delay before the first retry in seconds, doubled after every failure
+    'MAX_BACKOFF': 60,
+    'TIMEOUT': 30                               # Seconds per request
+}
+AGENT_CONFIG.update(getattr(config, 'AGENT_CONFIG', {}))
+
+#-----------------#
+# Posts gzip compressed JSON to the collector, retrying network errors and server errors with exponential backoff.
+class CollectorClient:
+
+    def __init__(self, url, token='', timeout=30, retries=5, backoff=1, max_backoff=60):
+        self.url = url.rstrip('/')
+        self.token = token
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def post(self, path, payload, retries=None):
+        body = gzip.compress(json.dumps(payload).encode(), 6)
+        headers = {'Content-Type': 'application/json', 'Content-Encoding': 'gzip', 'X-Agent-Token': self.token}
+        retries = self.retries if retries is None else retries
+        delay = self.backoff
+        for attempt in range(retries + 1):
+            try:
+                request = urllib.request.Request(self.url + path, data=body, headers=headers, method='POST')
+                with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                    return json.loads(response.read())
+            except OSError as e:
+                # A rejected batch stays rejected, only unreachable or failing collectors are retried
+                if isinstance(e, urllib.error.HTTPError) and e.code < 500 or attempt == retries:
+                    raise
+                log.warning('agent', f"Push to {self.url}{path} failed ({e}), retrying in {delay:.1f}s.")
+                time.sleep(delay * random.uniform(0.5, 1.0))
+                delay = min(delay * 2, self.max_backoff)
+
+#-----------------#
+# Scans its networks with the scanner's pipeline and pushes the hosts to the collector in numbered batches.
+class ScanAgent:
+
+    def __init__(self, name, network, ports, client, batch_size=500):
+        self.name = name
+        self.network = network
+        self.ports = ports
+        self.client = client
+        self.batch_size = batch_size
+        self.state = 'idle'
+        self.cycle = None                   # Id of the running cycle, batches are numbered within it
+        self.seq = 0
+        self.batch = []
+        self.reported = 0                   # Hosts pushed during the running cycle
+        self.lock = threading.Lock()        # Shards store concurrently, batches leave one at a time and in order
+        self.stop_event = threading.Event()
+
+    def payload(self, **fields):
+        return dict(agent=self.name, networks=self.network.split(), ports=self.ports, **fields)
+
+    def push(self, final=False, failed=()):
+        # Sends the waiting hosts as the next batch of the cycle; the collector skips a batch it already wrote
+        response = self.client.post('/api/collector/hosts', self.payload(cycle=self.cycle, seq=self.seq, hosts=self.batch, final=final,
+                                                                         scope=self.network.split(), failed=list(failed)))
+        self.seq += 1
+        self.reported += len(self.batch)
+        self.batch = []
+        return response
+
+    def store(self, records, lookups):
+        # Store callback of network_monitor.stream_shard: queues the hosts and pushes full batches
+        with self.lock:
+            for record in records:
+                self.batch.append([record.ip, record.state, record.hostname, lookups[record.ip].result(), [list(port) for port in record.ports]])
+            if len(self.batch) >= self.batch_size:
+                self.push()
+        return {record.ip for record in records}
+
+    def scan_shard(self, shard):
+        # Scans one shard, retrying it SHARD_RETRIES times with the timing adapted to the failure; returns False if it failed
+        for attempt in range(SCAN_CONFIG.get('SHARD_RETRIES', 1) + 1):
+            result = network_monitor.stream_shard(shard, self.ports, self.store, tuning.tuner.arguments(shard))
+            if result is not None:
+                if result[2]:
+                    tuning.tuner.record(shard, result[2])
+                return True
+            tuning.tuner.record(shard, None)
+        return False
+
+    def run_cycle(self):
+        # One scan of every network; the last batch tells the collector which shards failed so their hosts keep their status
+        shards = network_monitor.split_targets(self.network, SCAN_CONFIG.get('SHARD_PREFIX', 24))
+        workers = max(1, min(SCAN_CONFIG.get('SCAN_WORKERS', 4), len(shards)))
+        self.cycle, self.seq, self.batch, self.reported, self.state = int(time.time() * 1000), 0, [], 0, 'scanning'
+        log.info('agent', f"Scanning {Fore.GREEN}{self.network}{Fore.WHITE} ({len(shards)} shard(s)) for {self.client.url}...")
+        try:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='nmap') as pool:
+                results = list(pool.map(self.scan_shard, shards))
+            failed = [shard for shard, ok in zip(shards, results) if not ok]
+            if len(failed) == len(shards):
+                log.error('agent', "All shards failed, nothing was reported.")
+                return 1
+            with self.lock:
+                self.push(final=True, failed=failed)
+        except OSError as e:
+            # The collector marks nothing down for a cycle that never finished; the next cycle starts a new one
+            log.error('agent', f"Unable to reach the collector, cycle abandoned: {e}")
+            return 1
+        finally:
+            self.state = 'idle'
+        log.info('agent', f"Cycle finished: {self.reported} hosts in {self.seq} batch(es), {len(failed)} failed shard(s).")
+        return 0
+
+    def send_heartbeats(self, interval):
+        while not self.stop_event.wait(interval):
+            try:
+                self.client.post('/api/collector/heartbeat', self.payload(state=self.state), retries=0)
+            except OSError as e:
+                log.warning('agent', f"Heartbeat failed: {e}")
+
+    def run_forever(self, interval, heartbeat_interval=30):
+        # Scans at a fixed rate and sends heartbeats in between until stop() is called
+        try:
+            self.client.post('/api/collector/heartbeat', self.payload(state='idle'), retries=0)
+        except OSError as e:
+            log.warning('agent', f"Collector {self.client.url} is not reachable yet: {e}")
+        threading.Thread(target=self.send_heartbeats, args=(heartbeat_interval,), name='heartbeat', daemon=True).start()
+        while not self.stop_event.is_set():
+            started = time.monotonic()
+            self.run_cycle()
+            self.stop_event.wait(max(0.0, interval * 60 - (time.monotonic() - started)))
+
+    def stop(self):
+        self.stop_event.set()
+
+#-----------------#
+# Creates an agent from the agent settings.
+def create_agent(**overrides):
+    settings = dict(AGENT_CONFIG, **{name: value for name, value in overrides.items() if value is not None})
+    client = CollectorClient(settings['COLLECTOR_URL'], settings['TOKEN'], settings['TIMEOUT'], settings['RETRIES'],
+                             settings['BACKOFF'], settings['MAX_BACKOFF'])
+    return ScanAgent(settings['NAME'], settings['NETWORK'], settings['PORTS'], client, settings['BATCH_SIZE'])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Network monitor scanning agent")
+    parser.add_argument('--collector', help="URL of the REST API that collects the hosts")
+    parser.add_argument('--name', help="agent name, unique per agent")
+    parser.add_argument('--network', help="space separated networks to scan")
+    parser.add_argument('--ports', help="ports to scan")
+    parser.add_argument('--interval', type=float, help="minutes between the starts of two cycles")
+    parser.add_argument('--once', action='store_true', help="scan once and exit")
+    args = parser.parse_args()
+
+    tuning.tuner.persist = False            # Agents have no database, adaptive timing is kept in memory
+    agent = create_agent(COLLECTOR_URL=args.collector, NAME=args.name, NETWORK=args.network, PORTS=args.ports)
+    if args.once:
+        raise SystemExit(agent.run_cycle())
+    signal.signal(signal.SIGTERM, lambda signum, frame: agent.stop())
+    try:
+        agent.run_forever(args.interval or AGENT_CONFIG['INTERVAL'], AGENT_CONFIG['HEARTBEAT_INTERVAL'])
+    except KeyboardInterrupt:
+        print(Fore.YELLOW + "\nAgent interrupted by user. Exiting...")
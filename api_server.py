@@ -0,0 +1,96 @@
+#-----------------#
+# Imported modules
+import sys                                  # Import sys for the exit code when no server can be started
+import signal                               # Import signal for the graceful shutdown of the threaded servers
+import threading                            # Import threading for the stop flag set by the signal handlers
+import time                                 # Import time for the graceful shutdown deadline
+from config import FLASK_CONFIG             # Import Flask configuration settings from the config module
+from rest_api import app                    # Import the Flask application served by this module
+from logger import log                      # Import log for leveled, rate-limited console output
+
+#-----------------#
+# Production servers in order of preference; one that is not installed falls back to the next
+SERVERS = ('gunicorn', 'waitress', 'flask')
+
+#-----------------#
+# Serves the REST API with gunicorn: WORKERS processes with THREADS threads each. Not available on Windows.
+# The master reloads its workers gracefully on SIGHUP and adds or removes workers on SIGTTIN/SIGTTOU.
+def run_gunicorn(host, port):
+    from gunicorn.app.base import BaseApplication
+
+    class Application(BaseApplication):
+
+        def load_config(self):
+            options = {
+                'bind': f"{host}:{port}",
+                'workers': FLASK_CONFIG.get('WORKERS', 2),
+                'threads': FLASK_CONFIG.get('THREADS', 8),
+                'worker_class': 'gthread',
+                'keepalive': FLASK_CONFIG.get('KEEP_ALIVE', 5),
+                'graceful_timeout': FLASK_CONFIG.get('GRACEFUL_TIMEOUT', 30),
+            }
+            for name, value in options.items():
+                self.cfg.set(name, value)
+
+        def load(self):
+            return app                      # Each worker opens its own connection pool on the first request
+
+    Application().run()
+
+#-----------------#
+# Serves the REST API with waitress: one process with THREADS threads, works on every platform.
+# On SIGTERM or Ctrl+C it stops accepting connections and finishes the requests in progress for up to GRACEFUL_TIMEOUT seconds.
+# Reloading without dropping connections needs gunicorn.
+def run_waitress(host, port):
+    import waitress
+    server = waitress.create_server(app, host=host, port=port, threads=FLASK_CONFIG.get('THREADS', 8),
+                                    channel_timeout=FLASK_CONFIG.get('KEEP_ALIVE', 5))      # Idle keep-alive connections are closed after this
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.set())
+    log.info('API', f"Serving on http://{host}:{server.effective_port} with waitress ({FLASK_CONFIG.get('THREADS', 8)} threads).")
+
+    # The same loop as server.run(), one poll at a time so the stop flag is checked in between.
+    # Uses waitress internals (the socket map, the task queue and the channels' requests and buffers), see the pin in requirements.txt
+    loop = lambda timeout: server.asyncore.loop(timeout=timeout, map=server._map, use_poll=server.adj.asyncore_use_poll, count=1)
+    while not stopping.is_set():
+        loop(server.adj.asyncore_loop_timeout)
+
+    # Close only the listening socket; the trigger stays open so finished requests still wake the loop to send their responses
+    waitress.wasyncore.dispatcher.close(server)
+    deadline = time.monotonic() + FLASK_CONFIG.get('GRACEFUL_TIMEOUT', 30)
+    while time.monotonic() < deadline and waitress_busy(server):
+        loop(0.1)
+    if waitress_busy(server):
+        log.warning('API', "Requests still running after the graceful timeout are dropped.")
+    server.task_dispatcher.shutdown(timeout=max(0.0, deadline - time.monotonic()))
+    log.info('API', "Stopped.")
+
+def waitress_busy(server):
+    # Requests are queued, being served, or their responses are not sent completely yet
+    channels = [channel for channel in server._map.values() if hasattr(channel, 'requests')]
+    return bool(server.task_dispatcher.queue) or any(channel.requests or channel.total_outbufs_len for channel in channels)
+
+#-----------------#
+# Serves the REST API with Flask's development server, for debugging only.
+def run_flask(host, port):
+    app.run(debug=FLASK_CONFIG['DEBUG'], host=host, port=port, threaded=True, use_reloader=False)
+
+#-----------------#
+# Starts the configured server, falling back to the next one in SERVERS when it is not installed; exits with 1 if none can run.
+def serve(server=None):
+    server = server or FLASK_CONFIG.get('SERVER', 'waitress')
+    runners = {'gunicorn': run_gunicorn, 'waitress': run_waitress, 'flask': run_flask}
+    if server not in runners:
+        log.error('API', f"Unknown server {server}, choose from {', '.join(SERVERS)}.")
+        sys.exit(1)
+    for name in SERVERS[SERVERS.index(server):]:
+        try:
+            return runners[name](FLASK_CONFIG['HOST'], FLASK_CONFIG['PORT'])
+        except ImportError as e:            # Not installed, or gunicorn on Windows
+            log.warning('API', f"{name} is not available ({e}), trying the next server.")
+    log.error('API', f"None of {', '.join(SERVERS[SERVERS.index(server):])} can be started.")
+    sys.exit(1)
+
+if __name__ == '__main__':
+    serve(sys.argv[1] if len(sys.argv) > 1 else None)
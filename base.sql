@@ -3,9 +3,135 @@ USE network_monitoring;
 
 CREATE TABLE scans (
     id INT AUTO_INCREMENT PRIMARY KEY,
-    ip VARCHAR(15),
+    ip VARCHAR(15) NOT NULL,
     status VARCHAR(10),
     device_info JSON,
     timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP() ON UPDATE CURRENT_TIMESTAMP(),
-    domain VARCHAR(100) DEFAULT 'None'
+    domain VARCHAR(100) DEFAULT 'None',
+    ip_num INT UNSIGNED AS (INET_ATON(ip)) STORED,
+    fingerprint CHAR(16) NULL,
+    UNIQUE KEY uq_scans_ip (ip),
+    KEY idx_scans_ip_num (ip_num),
+    KEY idx_scans_timestamp (timestamp),
+    KEY idx_scans_status (status),                  -- InnoDB appends id, so /api/scans?status= pages in id order from it
+    KEY idx_scans_ports ((CAST(device_info->'$.ports[*].port' AS UNSIGNED ARRAY))),
+    KEY idx_scans_services ((CAST(device_info->'$.ports[*].name' AS CHAR(64) ARRAY)))
 );
+
+-- Normalized copy of the port data in scans.device_info, kept in sync by the scanner for the /api/ports and /api/services queries
+-- The secondary indexes contain every selected column (InnoDB appends the primary key), so those queries never read the table rows
+CREATE TABLE host_ports (
+    ip VARCHAR(15) NOT NULL,
+    proto VARCHAR(4) NOT NULL,
+    port SMALLINT UNSIGNED NOT NULL,
+    state VARCHAR(16) NOT NULL,
+    service VARCHAR(64) NOT NULL DEFAULT '',
+    product VARCHAR(128) NOT NULL DEFAULT '',
+    version VARCHAR(128) NOT NULL DEFAULT '',
+    last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP(),
+    ip_num INT UNSIGNED AS (INET_ATON(ip)) STORED,
+    PRIMARY KEY (ip, proto, port),
+    KEY idx_host_ports_port (port, state, proto, ip_num, service, product, version, last_seen),
+    KEY idx_host_ports_service (service, product, version, state, ip_num, port, last_seen),
+    KEY idx_host_ports_product (product, version, state, ip_num, service, port, last_seen)
+);
+
+-- Commit generation of the scanner, used by the API to invalidate its response cache
+CREATE TABLE scan_meta (
+    id TINYINT PRIMARY KEY,
+    generation BIGINT UNSIGNED NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP() ON UPDATE CURRENT_TIMESTAMP()
+);
+INSERT INTO scan_meta (id) VALUES (1);
+
+-- Change history: one compact row per host or port transition instead of full snapshots
+-- event: 1 = host_up, 2 = host_down, 3 = port_opened, 4 = port_closed, 5 = version_changed
+CREATE TABLE scan_events (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    ip VARCHAR(15) NOT NULL,
+    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP(),
+    event TINYINT UNSIGNED NOT NULL,
+    port SMALLINT UNSIGNED NULL,
+    detail VARCHAR(255) NULL,
+    KEY idx_scan_events_ip_timestamp (ip, timestamp),
+    KEY idx_scan_events_timestamp (timestamp)
+);
+
+-- Scan jobs of the scheduler daemon; run_requested is set by POST /api/jobs/<name>/run
+CREATE TABLE scan_jobs (
+    name VARCHAR(64) PRIMARY KEY,
+    network VARCHAR(1024) NOT NULL,
+    ports VARCHAR(255) NOT NULL,
+    interval_minutes DECIMAL(10, 2) NOT NULL,
+    priority INT NOT NULL DEFAULT 0,
+    state VARCHAR(10) NOT NULL DEFAULT 'idle',
+    last_started DATETIME NULL,
+    last_finished DATETIME NULL,
+    last_duration DOUBLE NULL,
+    last_result VARCHAR(10) NULL,
+    next_run DATETIME NULL,
+    skipped INT UNSIGNED NOT NULL DEFAULT 0,
+    run_requested TINYINT(1) NOT NULL DEFAULT 0
+);
+
+-- Adaptive nmap timing: one row per scan of a subnet with the timing it used, what it observed and the decision for the next scan
+CREATE TABLE scan_tuning (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    subnet VARCHAR(64) NOT NULL,
+    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP(),
+    min_rate INT UNSIGNED NOT NULL,
+    max_rate INT UNSIGNED NOT NULL,
+    max_retries TINYINT UNSIGNED NOT NULL,
+    host_timeout INT UNSIGNED NOT NULL,
+    parallelism SMALLINT UNSIGNED NOT NULL,
+    duration DOUBLE NULL,
+    hosts INT UNSIGNED NOT NULL,
+    timeouts INT UNSIGNED NOT NULL,
+    probes INT UNSIGNED NOT NULL,
+    no_response INT UNSIGNED NOT NULL,
+    slowest_host DOUBLE NOT NULL,
+    decision VARCHAR(16) NOT NULL,
+    KEY idx_scan_tuning_subnet (subnet, id)
+);
+
+-- Latest metrics snapshot of the scanner, merged into the API's /metrics output
+CREATE TABLE scan_metrics (
+    process VARCHAR(32) PRIMARY KEY,
+    snapshot MEDIUMTEXT NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP() ON UPDATE CURRENT_TIMESTAMP()
+);
+
+-- Scanning agents reporting to the collector: last heartbeat, the cycle being received and the last batch written of it
+CREATE TABLE scan_agents (
+    name VARCHAR(64) PRIMARY KEY,
+    address VARCHAR(45) NULL,
+    networks VARCHAR(1024) NOT NULL DEFAULT '',
+    ports VARCHAR(255) NOT NULL DEFAULT '',
+    state VARCHAR(10) NOT NULL DEFAULT 'idle',
+    cycle BIGINT NULL,
+    last_seq INT NULL,
+    cycle_started TIMESTAMP NULL,
+    hosts_reported INT UNSIGNED NOT NULL DEFAULT 0,
+    last_batch TIMESTAMP NULL,
+    last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP()
+);
+
+-- Agent each host was last accepted from; a host reported by several agents stays with the one that is online and saw it recently
+CREATE TABLE host_agents (
+    ip VARCHAR(15) PRIMARY KEY,
+    agent VARCHAR(64) NOT NULL,
+    last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP(),
+    KEY idx_host_agents_agent (agent, last_seen)
+);
+
+-- Existing installations: remove duplicate rows per ip, then add the unique index used by the batched upsert
+-- ALTER TABLE scans MODIFY ip VARCHAR(15) NOT NULL, ADD UNIQUE KEY uq_scans_ip (ip);
+-- Fingerprint of the stored port data; rows without one are rewritten once by the next scan
+-- ALTER TABLE scans ADD COLUMN fingerprint CHAR(16) NULL;
+-- After creating host_ports from above, clear the fingerprints so the next scan rewrites every device once and fills it
+-- UPDATE scans SET fingerprint = NULL;
+-- Indexes used by the /api/scans filters (multi-valued indexes need MySQL 8.0.17 or newer), then create scan_events, scan_meta, scan_jobs, scan_metrics, scan_tuning, scan_agents and host_agents from above
+-- ALTER TABLE scans ADD COLUMN ip_num INT UNSIGNED AS (INET_ATON(ip)) STORED, ADD KEY idx_scans_ip_num (ip_num), ADD KEY idx_scans_timestamp (timestamp), ADD KEY idx_scans_status (status),
+--     ADD KEY idx_scans_ports ((CAST(device_info->'$.ports[*].port' AS UNSIGNED ARRAY))), ADD KEY idx_scans_services ((CAST(device_info->'$.ports[*].name' AS CHAR(64) ARRAY)));
+-- /api/scans pages on id instead of timestamp; installations with the earlier status index replace it
+-- ALTER TABLE scans DROP KEY idx_scans_status_timestamp, ADD KEY idx_scans_status (status);
@@ -0,0 +1,491 @@
+#-----------------#
+# Imported modules
+import argparse                                     # Import argparse for the benchmark options
+import ipaddress                                    # Import ipaddress for generating synthetic host addresses
+import json                                         # Import json for the baseline file and the child process results
+import math                                         # Import math for the nearest-rank percentile
+import random                                       # Import random for reproducible synthetic port sets
+import socket                                       # Import socket to keep reverse DNS lookups off the network
+import subprocess                                   # Import subprocess for running every size in a fresh process
+import sys                                          # Import sys for the interpreter path and the exit code
+import time                                         # Import time for the stage timers
+from concurrent.futures import ThreadPoolExecutor   # Import ThreadPoolExecutor for the concurrent API clients
+from contextlib import contextmanager               # Import contextmanager for the stand-in pool
+from datetime import datetime                       # Import datetime for the stand-in timestamps
+from unittest import mock                           # Import mock for swapping in timed functions and the stand-in database
+from colorama import Fore                           # Import Fore from colorama for colored terminal text
+import nmap                                         # Import nmap for the PortScannerHostDict used by the fake scanner
+import network_monitor                              # Import network_monitor for the persistence path under test
+import nmap_stream                                  # Import nmap_stream for the PortScanner to record conversion
+import history                                      # Import history for timing the change diff
+import db_pool                                      # Import db_pool for serving the API from the stand-in database
+import rest_api                                     # Import rest_api for the API load test
+
+try:
+    import resource                                 # Peak RSS on Linux and macOS
+except ImportError:
+    resource = None                                 # Not available on Windows
+
+#-----------------#
+# Benchmark settings
+BASELINE_FILE = 'benchmark_baseline.json'    # Query counts per size, the same on every machine and kept in the repository
+LOCAL_BASELINE_FILE = 'benchmark_local.json'  # Timings and memory of this machine, written by --save-baseline and not shared
+DEFAULT_SIZES = (1000, 10000)           # Add 65536 for a full /16 sweep
+TOLERANCE = 0.5                         # Timings and memory may grow by 50% before the run fails
+MIN_DELTA = 0.01                        # Timing differences below 10 ms are noise, not regressions
+
+# (port, service) pairs the synthetic hosts are built from
+COMMON_PORTS = ((22, 'ssh'), (53, 'domain'), (80, 'http'), (139, 'netbios-ssn'), (443, 'https'), (445, 'microsoft-ds'),
+                (3306, 'mysql'), (3389, 'ms-wbt-server'), (5432, 'postgresql'), (8080, 'http-proxy'))
+
+# Requests issued by every API client, in turn
+API_REQUESTS = ('/api/scans', '/api/scans?limit=1000', '/api/scans?status=up&limit=500',
+                '/api/scans?fields=ip,status&limit=1000', '/api/scans?stream=ndjson&fields=ip,status')
+
+#-----------------#
+# Behaves like a finished nmap.PortScanner for synthetic hosts.
+class FakePortScanner:
+
+    def __init__(self, hosts):
+        self.hosts = hosts                  # ip -> PortScannerHostDict
+
+    def all_hosts(self):
+        return list(self.hosts)
+
+    def __getitem__(self, host):
+        return self.hosts[host]
+
+#-----------------#
+# Builds a fake scanner with count hosts and varied, reproducible port sets; changed hosts get one port flipped.
+def make_scan(count, seed=1, changed=0.0, gone=0.0):
+    rng = random.Random(seed)
+    change_rng = random.Random(seed + 1)
+    first = int(ipaddress.IPv4Address('10.0.0.1'))
+    hosts = {}
+    for index in range(count):
+        ports = {}
+        for port, name in rng.sample(COMMON_PORTS, rng.randint(1, 5)):
+            state = rng.choice(('open', 'open', 'closed', 'filtered'))
+            ports[port] = {'state': state, 'reason': 'syn-ack', 'name': name, 'product': '', 'version': '', 'extrainfo': '', 'conf': '3', 'cpe': ''}
+        roll = change_rng.random()
+        if roll < gone:
+            continue                        # The host disappeared since the previous cycle
+        if roll < gone + changed:
+            port = min(ports)
+            ports[port]['state'] = 'closed' if ports[port]['state'] == 'open' else 'open'
+        ip = str(ipaddress.IPv4Address(first + index))
+        hosts[ip] = nmap.PortScannerHostDict({
+            'hostnames': [{'name': f'host{index}.lan' if index % 3 == 0 else '', 'type': 'PTR'}],
+            'addresses': {'ipv4': ip},
+            'vendor': {},
+            'status': {'state': 'up', 'reason': 'syn-ack'},
+            'tcp': ports
+        })
+    return FakePortScanner(hosts)
+
+#-----------------#
+# In-memory stand-in for the MySQL database that understands the statements of the scan and API paths.
+# It measures the Python side of both paths; MySQL's own query cost is only measured with --mysql.
+class StandInDatabase:
+
+    def __init__(self):
+        self.scans = {}                     # ip -> [id, ip, status, device_info, timestamp, domain, fingerprint]
+        self.host_ports = {}                # (ip, proto, port) -> (state, service, product, version)
+        self.events = 0
+        self.generation = 0
+        self.next_id = 1
+
+    def connect(self):
+        return StandInConnection(self)
+
+class StandInConnection:
+
+    def __init__(self, database):
+        self.database = database
+
+    def cursor(self, cursor_class=None):
+        return StandInCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def ping(self, reconnect=False):
+        pass
+
+    def close(self):
+        pass
+
+class StandInCursor:
+
+    COLUMNS = ('id', 'ip', 'status', 'device_info', 'timestamp', 'domain', 'fingerprint')
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.database = connection.database
+        self.rows = []
+        self.rowcount = 0
+
+    def execute(self, query, params=()):
+        database = self.database
+        query = ' '.join(query.split())
+        params = list(params or ())
+        self.rows, self.rowcount = [], 0
+        if query.startswith("SELECT ip, status, fingerprint, domain FROM scans"):
+            self.rows = [(row[1], row[2], row[6], row[5]) for row in database.scans.values()]
+        elif query.startswith("SELECT ip, status, device_info FROM scans WHERE ip IN"):
+            self.rows = [(ip, database.scans[ip][2], database.scans[ip][3]) for ip in params if ip in database.scans]
+        elif query.startswith("UPDATE scans SET status = 'down' WHERE ip IN"):
+            for ip in params:
+                database.scans[ip][2] = 'down'
+            self.rowcount = len(params)
+        elif query.startswith("DELETE FROM host_ports WHERE ip IN"):
+            removed = set(params)
+            for key in [key for key in database.host_ports if key[0] in removed]:
+                del database.host_ports[key]
+        elif query.startswith("UPDATE scan_meta SET generation"):
+            database.generation += 1
+        elif query.startswith("SELECT generation, updated_at FROM scan_meta"):
+            self.rows = [(database.generation, None)]
+        elif query.startswith("SELECT") and " FROM scans" in query:
+            self.rows = self.select_scans(query, params)
+        self.rows_iter = iter(self.rows)
+        return self.rowcount or len(self.rows)
+
+    def select_scans(self, query, params):
+        # Projection, status filter and LIMIT of /api/scans; the ip, port, service and cursor filters are not evaluated
+        columns = [self.COLUMNS.index(column) for column in query[len("SELECT "):query.index(" FROM scans")].split(', ')]
+        rows = sorted(self.database.scans.values(), key=lambda row: row[0], reverse=True)
+        if "status = %s" in query:
+            rows = [row for row in rows if row[2] == params[0]]
+        if query.endswith("LIMIT %s"):
+            rows = rows[:params[-1]]
+        return [tuple(row[column] for column in columns) for row in rows]
+
+    def executemany(self, query, rows):
+        database = self.database
+        query = ' '.join(query.split())
+        if query.startswith("INSERT INTO scans"):
+            now = datetime.now()
+            for ip, status, device_info, domain, fingerprint in rows:
+                row = database.scans.get(ip)
+                if row is None:
+                    database.scans[ip] = [database.next_id, ip, status, device_info, now, domain, fingerprint]
+                    database.next_id += 1
+                else:
+                    row[2:7] = [status, device_info, now, domain, fingerprint]
+        elif query.startswith("INSERT INTO host_ports"):
+            for ip, proto, port, state, service, product, version in rows:
+                database.host_ports[(ip, proto, port)] = (state, service, product, version)
+        elif query.startswith("INSERT INTO scan_events"):
+            database.events += len(rows)
+        self.rowcount = len(rows)
+
+    def fetchall(self):
+        return list(self.rows_iter)
+
+    def fetchone(self):
+        return next(self.rows_iter, None)
+
+    def fetchmany(self, size):
+        return [row for _, row in zip(range(size), self.rows_iter)]
+
+    def close(self):
+        pass
+
+#-----------------#
+# Minimal stand-in for db_pool.ConnectionPool serving StandInConnections.
+class StandInPool:
+
+    def __init__(self, database):
+        self.database = database
+
+    def acquire(self):
+        return self.database.connect()
+
+    def release(self, connection, broken=False):
+        pass
+
+    stream = db_pool.ConnectionPool.stream      # Server-side cursor streaming on top of acquire() and release()
+
+    @contextmanager
+    def connection(self):
+        yield self.database.connect()
+
+    def stats(self):
+        return {'size': 1, 'idle': 1, 'in_use': 0, 'waits': 0, 'avg_checkout_seconds': 0.0}
+
+#-----------------#
+# Wraps a cursor and counts the statements and rows sent through it.
+class CountingCursor:
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.queries = 0
+        self.rows = 0
+
+    def execute(self, query, params=None):
+        self.queries += 1
+        return self.cursor.execute(query, params)
+
+    def executemany(self, query, rows):
+        self.queries += 1
+        self.rows += len(rows)
+        return self.cursor.executemany(query, rows)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+#-----------------#
+# Stand-in for socket.gethostbyaddr: synthetic hosts have no PTR records.
+def no_reverse_dns(ip):
+    raise socket.herror(1, "Unknown host")
+
+#-----------------#
+# Returns a wrapper around function that adds its run time to stage_times[name].
+def timed(stage_times, name, function):
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            stage_times[name] = stage_times.get(name, 0.0) + time.perf_counter() - started
+    return wrapper
+
+#-----------------#
+# Runs one cycle through the scanner's write path: batches of STREAM_BATCH hosts are stored like streamed shards against the warm
+# device state, then missing hosts are marked down. Returns the cycle's per-stage timings and query counts.
+def run_cycle(nm, cursor, scope):
+    stage_times = {}
+    counting = CountingCursor(cursor)
+    records = nmap_stream.records_from_scanner(nm)      # Stands in for the parsed nmap output, which is not part of the write path
+    batch_size = network_monitor.SCAN_CONFIG.get('STREAM_BATCH', 64)
+    stats = {name: 0 for name in network_monitor.cycle_stats}
+    patches = [
+        mock.patch.object(network_monitor, 'load_existing_devices', timed(stage_times, 'load', network_monitor.load_existing_devices)),
+        mock.patch.object(network_monitor, 'get_fingerprint', timed(stage_times, 'fingerprint', network_monitor.get_fingerprint)),
+        mock.patch.object(network_monitor, 'get_device_info_json', timed(stage_times, 'json', network_monitor.get_device_info_json)),
+        mock.patch.object(history, 'diff_device_info', timed(stage_times, 'history', history.diff_device_info)),
+        mock.patch.object(network_monitor, 'sync_host_ports', timed(stage_times, 'ports', network_monitor.sync_host_ports)),
+        mock.patch.object(network_monitor, 'upsert_device_info', timed(stage_times, 'upsert', network_monitor.upsert_device_info)),
+        mock.patch.object(network_monitor, 'update_device_status', timed(stage_times, 'status', network_monitor.update_device_status)),
+    ]
+    for patch in patches:
+        patch.start()
+    try:
+        started = time.perf_counter()
+        existing = network_monitor.get_device_state(counting)     # Read from the database in the first cycle only, like the daemon
+        resolver = network_monitor.get_dns_resolver()
+        found_hosts = set()
+        for position in range(0, len(records), batch_size):
+            batch = records[position:position + batch_size]
+            lookups = resolver.start([record.ip for record in batch])
+            found_hosts |= network_monitor.store_shard_results(batch, counting, existing, {}, lookups, stats)
+        with network_monitor.device_state_lock:
+            network_monitor.update_device_status(counting, found_hosts, existing, (), scope, stats)
+            counting.connection.commit()
+        total = time.perf_counter() - started
+    finally:
+        for patch in patches:
+            patch.stop()
+    return {'seconds': total, 'stages': stage_times, 'queries': counting.queries, 'rows': counting.rows, 'hosts': stats}
+
+#-----------------#
+# Issues requests_per_client requests from each of clients concurrent clients and returns latency percentiles.
+def load_test_api(clients, requests_per_client, cached):
+    def client_run(client_id):
+        client = rest_api.app.test_client()
+        latencies = []
+        for index in range(requests_per_client):
+            url = API_REQUESTS[index % len(API_REQUESTS)]
+            if not cached:
+                url += ('&' if '?' in url else '?') + f'nocache={client_id}-{index}'    # Unknown parameters only change the cache key
+            started = time.perf_counter()
+            response = client.get(url)
+            response.get_data()             # Read streamed bodies completely
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                raise RuntimeError(f"{url} returned {response.status_code}")
+        return latencies
+
+    rest_api.response_cache.clear()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        latencies = sorted(latency for result in pool.map(client_run, range(clients)) for latency in result)
+    elapsed = time.perf_counter() - started
+    return {'requests': len(latencies), 'rps': len(latencies) / elapsed,
+            'p50': percentile(latencies, 50), 'p99': percentile(latencies, 99)}
+
+#-----------------#
+# Returns the p-th percentile of sorted values (nearest rank).
+def percentile(values, p):
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+#-----------------#
+# Returns the peak resident set size of this process in megabytes, or None where it cannot be measured.
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024     # Bytes on macOS, kilobytes on Linux
+
+#-----------------#
+# Benchmarks one size: an initial, an unchanged and a partly changed cycle, then the API under load.
+def run_benchmark(hosts, clients=8, requests_per_client=50, use_mysql=False):
+    results = {'hosts': hosts, 'cycles': {}}
+    scans = {
+        'initial': make_scan(hosts),
+        'unchanged': make_scan(hosts),
+        'changed': make_scan(hosts, changed=0.05, gone=0.01)
+    }
+
+    if use_mysql:
+        database = None
+        pool = db_pool.get_pool()           # The configured database; use a scratch one, rows of 10.0.0.0/8 are written to it
+    else:
+        database = StandInDatabase()
+        pool = StandInPool(database)
+
+    scope = [network_monitor.parse_network('10.0.0.0/8')]
+
+    # A fresh device state, so the first cycle loads it from the database and the later ones find it warm
+    with mock.patch.object(db_pool, 'get_pool', return_value=pool), \
+         mock.patch('socket.gethostbyaddr', no_reverse_dns), \
+         mock.patch.object(network_monitor, 'dns_resolver', None), \
+         mock.patch.object(network_monitor, 'device_state', {}), \
+         mock.patch.object(network_monitor, 'device_state_loaded', False):
+        for name, nm in scans.items():
+            connection = pool.acquire()
+            cursor = connection.cursor()
+            try:
+                results['cycles'][name] = run_cycle(nm, cursor, scope)
+            finally:
+                cursor.close()
+                pool.release(connection)
+        scans.clear()                       # Only the API state is needed from here on
+
+        results['api_cached'] = load_test_api(clients, requests_per_client, cached=True)
+        results['api_uncached'] = load_test_api(clients, requests_per_client, cached=False)
+
+    results['peak_rss_mb'] = peak_rss_mb()
+    return results
+
+#-----------------#
+# Flattens the results of one size into the {metric: value} form compared against the baseline.
+def flatten(results):
+    metrics = {'peak_rss_mb': results['peak_rss_mb']}
+    for name, cycle in results['cycles'].items():
+        metrics[f'{name}.seconds'] = cycle['seconds']
+        metrics[f'{name}.queries'] = cycle['queries']
+        for stage, seconds in cycle['stages'].items():
+            metrics[f'{name}.{stage}'] = seconds
+    for name in ('api_cached', 'api_uncached'):
+        metrics[f'{name}.p50'] = results[name]['p50']
+        metrics[f'{name}.p99'] = results[name]['p99']
+    return {metric: value for metric, value in metrics.items() if value is not None}
+
+#-----------------#
+# Returns the metrics that are worse than the baseline; query counts may not grow at all.
+def find_regressions(metrics, baseline, tolerance):
+    regressions = []
+    for metric, base in baseline.items():
+        value = metrics.get(metric)
+        if value is None:
+            continue
+        if metric.endswith('.queries'):
+            allowed = base
+        elif metric == 'peak_rss_mb':
+            allowed = base * (1 + tolerance)
+        else:
+            allowed = max(base * (1 + tolerance), base + MIN_DELTA)
+        if value > allowed:
+            regressions.append((metric, base, value))
+    return regressions
+
+#-----------------#
+# Splits metrics into the query counts, which are machine independent, and the timings and memory of this machine.
+def split_metrics(metrics):
+    queries = {metric: value for metric, value in metrics.items() if metric.endswith('.queries')}
+    return queries, {metric: value for metric, value in metrics.items() if metric not in queries}
+
+#-----------------#
+# Reads a baseline file, or returns an empty baseline if it does not exist yet.
+def load_baseline(path):
+    try:
+        with open(path) as baseline_file:
+            return json.load(baseline_file)
+    except FileNotFoundError:
+        return {}
+
+#-----------------#
+# Prints the results of one size.
+def report(results):
+    print(Fore.YELLOW + "[bench]" + Fore.WHITE + f" {Fore.GREEN}{results['hosts']}{Fore.WHITE} hosts, peak RSS {results['peak_rss_mb'] or 0:.0f} MB")
+    for name, cycle in results['cycles'].items():
+        stages = ', '.join(f"{stage} {seconds * 1000:.0f} ms" for stage, seconds in cycle['stages'].items())
+        hosts = ', '.join(f"{count} {state}" for state, count in cycle['hosts'].items())
+        print(f"  {name:<10} {cycle['seconds'] * 1000:8.0f} ms, {cycle['queries']} queries, {cycle['rows']} rows ({hosts}): {stages}")
+    for name in ('api_cached', 'api_uncached'):
+        api = results[name]
+        print(f"  {name:<12} {api['requests']} requests, {api['rps']:.0f} req/s, p50 {api['p50'] * 1000:.1f} ms, p99 {api['p99'] * 1000:.1f} ms")
+
+#-----------------#
+# Runs the benchmark for every size in a fresh process so peak RSS is measured per size.
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of the scan persistence and API paths")
+    parser.add_argument('--hosts', type=int, nargs='+', default=list(DEFAULT_SIZES), help="synthetic hosts per scan (e.g. 1000 10000 65536)")
+    parser.add_argument('--clients', type=int, default=8, help="concurrent API clients")
+    parser.add_argument('--requests', type=int, default=50, help="requests per API client")
+    parser.add_argument('--mysql', action='store_true', help="use the database from config.py instead of the in-memory stand-in (use a scratch database)")
+    parser.add_argument('--baseline', default=BASELINE_FILE, help="query count baseline to compare against")
+    parser.add_argument('--local-baseline', default=LOCAL_BASELINE_FILE, help="timing and memory baseline of this machine")
+    parser.add_argument('--save-baseline', action='store_true', help="store the results as the new baselines")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per size, the best value of each metric is compared")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help="allowed slowdown of timings and memory, as a fraction")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Child process: one size, results as JSON on the last line of stdout
+    if args.child:
+        with mock.patch('builtins.print', lambda *args, **kwargs: None):  # Keep the per-host scan output out of the measurement
+            results = run_benchmark(args.hosts[0], args.clients, args.requests, args.mysql)
+        sys.stdout.write(json.dumps(results) + '\n')
+        sys.exit(0)
+
+    # Timings are only compared against numbers measured on this machine; without them only query counts are checked
+    baseline = load_baseline(args.baseline)
+    local_baseline = load_baseline(args.local_baseline)
+    if not local_baseline and not args.save_baseline:
+        print(Fore.YELLOW + "[bench]" + Fore.WHITE + f" No {args.local_baseline} yet, only query counts are compared (run with --save-baseline first).")
+
+    failed = False
+    for hosts in args.hosts:
+        command = [sys.executable, __file__, '--child', '--hosts', str(hosts), '--clients', str(args.clients), '--requests', str(args.requests)]
+        if args.mysql:
+            command.append('--mysql')
+        # Every metric keeps its best value over the repeats, which filters out scheduling noise
+        metrics = {}
+        for _ in range(args.repeat):
+            output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+            results = json.loads(output.strip().splitlines()[-1])
+            report(results)
+            for metric, value in flatten(results).items():
+                metrics[metric] = min(value, metrics.get(metric, value))
+        if args.save_baseline:
+            baseline[str(hosts)], local_baseline[str(hosts)] = split_metrics(metrics)
+            continue
+        expected = dict(baseline.get(str(hosts), {}), **local_baseline.get(str(hosts), {}))
+        for metric, base, value in find_regressions(metrics, expected, args.tolerance):
+            print(Fore.RED + "[bench]" + Fore.WHITE + f" Regression in {metric}: {value:.4g} (baseline {base:.4g})")
+            failed = True
+
+    if args.save_baseline:
+        for path, data in ((args.baseline, baseline), (args.local_baseline, local_baseline)):
+            with open(path, 'w') as baseline_file:
+                json.dump(data, baseline_file, indent=4, sort_keys=True)
+        print(Fore.GREEN + "[bench]" + Fore.WHITE + f" Baselines saved to {args.baseline} and {args.local_baseline}.")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,203 @@
+#-----------------#
+# Imported modules
+import gzip                                 # Import gzip for decompressing agent batches
+import hmac                                 # Import hmac for comparing agent tokens in constant time
+import io                                   # Import io for reading compressed batches from memory
+import json                                 # Import json for decoding agent batches
+from concurrent.futures import Future       # Import Future for handing the agents' reverse DNS names to the persistence code
+import config                               # Import config to read the optional COLLECTOR_CONFIG section
+import db_pool                              # Import db_pool for the connection pool shared with the rest of the API
+import network_monitor                      # Import network_monitor for the batched persistence path of the scanner
+import nmap_stream                          # Import nmap_stream for the host records
+import notifications                        # Import notifications for sending committed change events to webhooks
+from logger import log                      # Import log for leveled, rate-limited console output
+
+#-----------------#
+# Collector settings with defaults for installations whose config.py has no COLLECTOR_CONFIG yet
+COLLECTOR_CONFIG = {
+    'ENABLED': False,           # Accept host batches and heartbeats from scanning agents on /api/collector
+    'TOKEN': '',                # Shared secret the agents send as X-Agent-Token; empty accepts every agent
+    'OFFLINE_AFTER': 90,        # Seconds without heartbeat after which an agent is offline and its hosts may be taken over
+    'OWNER_TTL': 3600,          # Seconds a host stays with the agent that reported it while other agents report it too
+    'MAX_BODY': 64 * 1024 * 1024,   # Largest decompressed batch in bytes
+    'MAX_HOSTS': 5000           # Largest batch in hosts
+}
+COLLECTOR_CONFIG.update(getattr(config, 'COLLECTOR_CONFIG', {}))
+
+# Columns of the scan_agents table returned by /api/agents
+AGENT_FIELDS = ('name', 'address', 'networks', 'ports', 'state', 'cycle', 'last_seq', 'cycle_started',
+                'hosts_reported', 'last_batch', 'last_seen', 'online')
+
+#-----------------#
+# Raised for batches that are malformed, too large or not authorized; carries the HTTP status for the API.
+class CollectorError(Exception):
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+#-----------------#
+# Checks the agent token and returns the decoded JSON body of a gzip compressed or plain request.
+def decode_request(body, encoding, token):
+    if COLLECTOR_CONFIG['TOKEN'] and not hmac.compare_digest((token or '').encode(), COLLECTOR_CONFIG['TOKEN'].encode()):
+        raise CollectorError("Invalid agent token", 401)
+    if encoding == 'gzip':
+        try:
+            # Reading one byte past the limit tells an oversized batch apart without decompressing all of it
+            body = gzip.GzipFile(fileobj=io.BytesIO(body)).read(COLLECTOR_CONFIG['MAX_BODY'] + 1)
+        except (OSError, EOFError) as e:
+            raise CollectorError(f"Invalid gzip body: {e}")
+    elif encoding not in (None, '', 'identity'):
+        raise CollectorError(f"Unsupported Content-Encoding {encoding}", 415)
+    if len(body) > COLLECTOR_CONFIG['MAX_BODY']:
+        raise CollectorError("Batch too large", 413)
+    try:
+        payload = json.loads(body)
+    except ValueError as e:
+        raise CollectorError(f"Invalid JSON body: {e}")
+    if not isinstance(payload, dict) or not payload.get('agent'):
+        raise CollectorError("agent is required")
+    return payload
+
+#-----------------#
+# Builds the host records of a batch; hosts are [ip, state, hostname, domain, [[proto, port, state, name, product, version], ...]].
+def parse_hosts(hosts):
+    if len(hosts) > COLLECTOR_CONFIG['MAX_HOSTS']:
+        raise CollectorError("Batch too large", 413)
+    records = {}
+    try:
+        for ip, state, hostname, domain, ports in hosts:
+            ports = tuple(sorted((str(proto), int(port), str(port_state), str(name), str(product), str(version))
+                                 for proto, port, port_state, name, product, version in ports))
+            records[str(ip)] = (nmap_stream.HostRecord(str(ip), str(state), str(hostname), ports), domain or None)  # The last report of an address wins
+    except (TypeError, ValueError) as e:
+        raise CollectorError(f"Invalid host record: {e}")
+    return list(records.values())
+
+#-----------------#
+# Stores an agent's heartbeat.
+def record_heartbeat(cursor, payload, address):
+    cursor.execute(
+        """
+        INSERT INTO scan_agents (name, address, networks, ports, state) VALUES (%s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE address = VALUES(address), networks = VALUES(networks), ports = VALUES(ports),
+                                state = VALUES(state), last_seen = CURRENT_TIMESTAMP
+        """,
+        (payload['agent'], address, ' '.join(payload.get('networks', [])), payload.get('ports', ''), payload.get('state', 'idle'))
+    )
+
+def heartbeat(payload, address):
+    with db_pool.get_pool().connection() as conn:
+        cursor = conn.cursor()
+        record_heartbeat(cursor, payload, address)
+        cursor.close()
+        conn.commit()
+
+#-----------------#
+# Returns the addresses of the batch that belong to another agent which is online and reported them recently.
+def owned_elsewhere(cursor, agent, ips):
+    if not ips:
+        return set()
+    placeholders = ', '.join(['%s'] * len(ips))
+    cursor.execute(
+        f"SELECT h.ip FROM host_agents h JOIN scan_agents a ON a.name = h.agent "
+        f"WHERE h.ip IN ({placeholders}) AND h.agent != %s "
+        f"AND h.last_seen >= NOW() - INTERVAL %s SECOND AND a.last_seen >= NOW() - INTERVAL %s SECOND",
+        list(ips) + [agent, COLLECTOR_CONFIG['OWNER_TTL'], COLLECTOR_CONFIG['OFFLINE_AFTER']]
+    )
+    return {row[0] for row in cursor.fetchall()}
+
+#-----------------#
+# Reads the stored (status, fingerprint, domain) of the given addresses, so every API worker compares against the database.
+def load_device_states(cursor, ips):
+    if not ips:
+        return {}
+    placeholders = ', '.join(['%s'] * len(ips))
+    cursor.execute(f"SELECT ip, status, fingerprint, domain FROM scans WHERE ip IN ({placeholders})", list(ips))
+    return {ip: (status, fingerprint, domain) for ip, status, fingerprint, domain in cursor.fetchall()}
+
+#-----------------#
+# Marks the agent's hosts inside its scanned networks that it did not report during the finished cycle as down.
+def mark_missing_down(cursor, agent, cycle_started, scope, failed, stats):
+    cursor.execute(
+        "SELECT s.ip, s.status, s.fingerprint, s.domain FROM host_agents h JOIN scans s ON s.ip = h.ip "
+        "WHERE h.agent = %s AND h.last_seen < %s AND s.status != 'down'",
+        (agent, cycle_started)
+    )
+    existing = {ip: (status, fingerprint, domain) for ip, status, fingerprint, domain in cursor.fetchall()}
+    scope = [network_monitor.parse_network(target) for target in scope]
+    network_monitor.update_device_status(cursor, set(), existing, failed, scope, stats)
+
+#-----------------#
+# Writes one batch of an agent in a single transaction and returns what happened to its hosts.
+# Batches are numbered per cycle; a batch the agent resends after a lost response is acknowledged without writing it again.
+def receive_batch(payload, address):
+    agent, cycle, seq = payload['agent'], payload.get('cycle'), payload.get('seq')
+    if not isinstance(cycle, int) or not isinstance(seq, int):
+        raise CollectorError("cycle and seq are required")
+    hosts = parse_hosts(payload.get('hosts', []))
+    stats = {'unchanged': 0, 'changed': 0, 'new': 0, 'gone': 0}
+
+    with db_pool.get_pool().connection() as conn:
+        cursor = conn.cursor()
+        try:
+            # Serializes the batches of one agent across API workers
+            record_heartbeat(cursor, dict(payload, state='scanning'), address)
+            cursor.execute("SELECT cycle, last_seq, cycle_started FROM scan_agents WHERE name = %s FOR UPDATE", (agent,))
+            stored_cycle, last_seq, cycle_started = cursor.fetchone() or (None, None, None)
+            if stored_cycle == cycle and last_seq is not None and seq <= last_seq:
+                conn.commit()
+                return {'accepted': 0, 'duplicate': True}
+            if stored_cycle != cycle:
+                cursor.execute("UPDATE scan_agents SET cycle = %s, cycle_started = NOW(), hosts_reported = 0 WHERE name = %s", (cycle, agent))
+                cursor.execute("SELECT cycle_started FROM scan_agents WHERE name = %s", (agent,))
+                (cycle_started,) = cursor.fetchone()
+
+            # Overlapping ranges: a host stays with the agent that reported it while that agent is online
+            skipped = owned_elsewhere(cursor, agent, [record.ip for record, _ in hosts])
+            hosts = [(record, domain) for record, domain in hosts if record.ip not in skipped]
+            records = [record for record, _ in hosts]
+            lookups = {}
+            for record, domain in hosts:
+                lookups[record.ip] = Future()
+                lookups[record.ip].set_result(domain)       # Names were resolved by the agent, inside its own network
+            network_monitor.persist_scan_results(records, cursor, load_device_states(cursor, lookups), lookups, stats)
+            if records:
+                cursor.executemany(
+                    "INSERT INTO host_agents (ip, agent) VALUES (%s, %s) "
+                    "ON DUPLICATE KEY UPDATE agent = VALUES(agent), last_seen = CURRENT_TIMESTAMP",
+                    [(record.ip, agent) for record in records]
+                )
+            if payload.get('final'):
+                mark_missing_down(cursor, agent, cycle_started, payload.get('scope', []), payload.get('failed', []), stats)
+            cursor.execute(
+                "UPDATE scan_agents SET last_seq = %s, hosts_reported = hosts_reported + %s, last_batch = CURRENT_TIMESTAMP, "
+                "state = %s WHERE name = %s",
+                (seq, len(records), 'idle' if payload.get('final') else 'scanning', agent)
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            notifications.discard()         # Events of the rolled back write are not sent
+            raise
+        finally:
+            cursor.close()
+    notifications.flush()
+    if payload.get('final'):
+        log.info('collector', f"Agent {agent} finished cycle {cycle}: " + ', '.join(f"{count} {name}" for name, count in stats.items()))
+    return {'accepted': len(records), 'skipped': len(skipped), **stats}
+
+#-----------------#
+# Returns the registered agents with their last heartbeat and whether they are online.
+def get_agents():
+    with db_pool.get_pool().connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"SELECT {', '.join(AGENT_FIELDS[:-1])}, last_seen >= NOW() - INTERVAL %s SECOND FROM scan_agents ORDER BY name",
+            (COLLECTOR_CONFIG['OFFLINE_AFTER'],)
+        )
+        agents = [dict(zip(AGENT_FIELDS, row)) for row in cursor.fetchall()]
+        cursor.close()
+    for agent in agents:
+        agent['online'] = bool(agent['online'])
+    return agents
@@ -12,11 +12,117 @@ VENV = {
 FLASK_CONFIG = {
     'HOST': '0.0.0.0',
     'PORT': 5000,
-    'DEBUG': True
+    'DEBUG': False,
+    'CACHE_TTL': 2,
+    'PAGE_SIZE': 100,
+    'MAX_PAGE_SIZE': 1000,
+    'SERVER': 'waitress',
+    'WORKERS': 2,
+    'THREADS': 8,
+    'KEEP_ALIVE': 5,
+    'GRACEFUL_TIMEOUT': 30,
+    'STARTUP_TIMEOUT': 15
 }
 
 SCAN_CONFIG = {
     "DEFAULT_NETWORK": "192.168.1.0/24",
     "DEFAULT_PORTS": "22,80,443",
-    "DEFAULT_INTERVAL": 1.0
-}
\ No newline at end of file
+    "DEFAULT_INTERVAL": 1.0,
+    "SHARD_PREFIX": 24,
+    "SCAN_WORKERS": 4,
+    "SHARD_RETRIES": 1,
+    "SCAN_TIMEOUT": 1200,
+    "TWO_PHASE": True,
+    "VERSION_TTL": 60,
+    "DNS_WORKERS": 32,
+    "DNS_TTL": 60,
+    "DNS_NEGATIVE_TTL": 10,
+    "DNS_CACHE_SIZE": 65536,
+    "HISTORY_RETENTION_DAYS": 90,
+    "SCAN_BACKEND": "stream",
+    "STREAM_BATCH": 64
+}
+POOL_CONFIG = {
+    "MIN_SIZE": 1,
+    "MAX_SIZE": 10,
+    "TIMEOUT": 10,
+    "HEALTH_CHECK_IDLE": 5
+}
+
+SCHEDULER_CONFIG = {
+    "JOBS": [],
+    "MAX_CONCURRENT_SCANS": 1,
+    "MAX_NMAP_PROCESSES": 4,
+    "JITTER": 0.05,
+    "OVERLAP": "skip",
+    "POLL_INTERVAL": 5
+}
+
+LOG_CONFIG = {
+    "LEVEL": "INFO",
+    "RATE": 20,
+    "BURST": 100
+}
+
+TUNING_CONFIG = {
+    "ADAPTIVE": False,
+    "ARGUMENTS": "-T5 --unprivileged",
+    "BASE_ARGUMENTS": "-T4 --unprivileged",
+    "INITIAL_RATE": 300,
+    "RATE_BOUNDS": [10, 5000],
+    "RETRY_BOUNDS": [1, 6],
+    "HOST_TIMEOUT_BOUNDS": [30, 1200],
+    "PARALLELISM_BOUNDS": [8, 256],
+    "TIMEOUT_THRESHOLD": 0.02,
+    "LOSS_THRESHOLD": 0.05,
+    "HISTORY": 10
+}
+
+NOTIFY_CONFIG = {
+    "WEBHOOKS": [],
+    "BATCH_SIZE": 100,
+    "BATCH_INTERVAL": 2,
+    "RETRIES": 5,
+    "BACKOFF": 1,
+    "MAX_BACKOFF": 60,
+    "QUEUE_SIZE": 10000,
+    "TIMEOUT": 5,
+    "POLL_INTERVAL": 1,
+    "STREAM_QUEUE_SIZE": 1000,
+    "KEEPALIVE": 15,
+    "MAX_STREAMS": 4
+}
+
+INVENTORY_CONFIG = {
+    "ENABLED": True,
+    "SNAPSHOT": "inventory.snapshot",
+    "SNAPSHOT_INTERVAL": 300,
+    "SYNC_OVERLAP": 60
+}
+
+EXPORT_CONFIG = {
+    "CHUNK_ROWS": 5000,
+    "IMPORT_BATCH": 1000,
+    "GZIP_LEVEL": 6,
+    "ZSTD_LEVEL": 3
+}
+
+COLLECTOR_CONFIG = {
+    "ENABLED": False,
+    "TOKEN": "",
+    "OFFLINE_AFTER": 90,
+    "OWNER_TTL": 3600,
+    "MAX_BODY": 67108864,
+    "MAX_HOSTS": 5000
+}
+
+AGENT_CONFIG = {
+    "COLLECTOR_URL": "http://127.0.0.1:5000",
+    "TOKEN": "",
+    "BATCH_SIZE": 500,
+    "HEARTBEAT_INTERVAL": 30,
+    "RETRIES": 5,
+    "BACKOFF": 1,
+    "MAX_BACKOFF": 60,
+    "TIMEOUT": 30
+}
@@ -0,0 +1,9 @@
+import db_pool
+import pytest
+
+@pytest.fixture(autouse=True)
+def fresh_pool():
+    # Every test starts with an empty connection pool so mocked connections do not leak between tests
+    db_pool.reset_pool()
+    yield
+    db_pool.reset_pool()
@@ -0,0 +1,210 @@
+#-----------------#
+# Imported modules
+import pymysql                              # Import pymysql for connecting to MySQL databases
+import threading                            # Import threading for the lock and condition guarding the pool
+import time                                 # Import time for idle tracking and checkout latency
+from collections import deque               # Import deque for the idle connection stack
+from contextlib import contextmanager       # Import contextmanager for the connection() helper
+from config import DB_CONFIG, POOL_CONFIG   # Import database and pool configuration settings from the config module
+import metrics                              # Import metrics for the query count and latency histogram
+
+#-----------------#
+# Global pool shared by all users in this process
+shared_pool = None
+shared_pool_lock = threading.Lock()
+
+#-----------------#
+# Raised when no connection becomes available within the checkout timeout.
+class PoolTimeoutError(Exception):
+    pass
+
+#-----------------#
+# Times every round trip to the server; executemany batches are counted per statement actually sent.
+class QueryTimingMixin:
+
+    def _query(self, q):
+        started = time.perf_counter()
+        try:
+            return super()._query(q)
+        finally:
+            metrics.DB_QUERY_SECONDS.observe(time.perf_counter() - started, statement=q.split(None, 1)[0].upper() if q.strip() else '')
+
+# Default cursor of pooled connections
+class InstrumentedCursor(QueryTimingMixin, pymysql.cursors.Cursor):
+    pass
+
+# Unbuffered cursor for streaming large results; only the query itself is timed, not reading the rows
+class InstrumentedSSCursor(QueryTimingMixin, pymysql.cursors.SSCursor):
+    pass
+
+#-----------------#
+# Thread-safe pool of pymysql connections with health checks and usage metrics.
+class ConnectionPool:
+
+    def __init__(self, min_size, max_size, timeout, health_check_idle, **connect_args):
+        self.min_size = min_size                        # Connections opened up front and kept open
+        self.max_size = max_size                        # Upper bound of open connections
+        self.timeout = timeout                          # Seconds a checkout may wait for a free connection
+        self.health_check_idle = health_check_idle      # Connections idle longer than this are pinged on checkout
+        self.connect_args = connect_args                # Arguments passed to pymysql.connect
+        self.idle = deque()                             # (connection, released_at) pairs, most recently used last
+        self.size = 0                                   # Open connections, idle and in use
+        self.condition = threading.Condition()          # Signals waiting checkouts when a connection is released
+        self.metrics = {'checkouts': 0, 'waits': 0, 'timeouts': 0, 'reconnects': 0, 'discarded': 0, 'checkout_seconds': 0.0, 'max_checkout_seconds': 0.0}
+
+        # Open the minimum number of connections up front
+        for _ in range(min_size):
+            self.idle.append((self.connect(), time.monotonic()))
+            self.size += 1
+
+    def connect(self):
+        # Opens a new database connection
+        return pymysql.connect(**self.connect_args)
+
+    def acquire(self):
+        # Checks out a healthy connection, opening a new one or waiting for a release when needed
+        started = time.monotonic()
+        deadline = started + self.timeout
+        with self.condition:
+            if not self.idle and self.size >= self.max_size:
+                self.metrics['waits'] += 1              # Every checkout that had to queue counts, including timeouts
+            while not self.idle and self.size >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.metrics['timeouts'] += 1
+                    raise PoolTimeoutError(f"No database connection available within {self.timeout} seconds")
+                self.condition.wait(remaining)
+
+            if self.idle:
+                connection, released_at = self.idle.pop()
+            else:
+                connection, released_at = None, None
+                self.size += 1                          # Reserve the slot before connecting outside the lock
+
+        try:
+            if connection is None:
+                connection = self.connect()
+            elif time.monotonic() - released_at > self.health_check_idle:
+                self.check_health(connection)
+        except Exception:
+            # The slot is free again if the connection could not be opened or repaired
+            with self.condition:
+                self.size -= 1
+                self.condition.notify()
+            raise
+
+        # Record checkout metrics
+        elapsed = time.monotonic() - started
+        with self.condition:
+            self.metrics['checkouts'] += 1
+            self.metrics['checkout_seconds'] += elapsed
+            self.metrics['max_checkout_seconds'] = max(self.metrics['max_checkout_seconds'], elapsed)
+        return connection
+
+    def check_health(self, connection):
+        # Pings an idle connection and reconnects it if the server closed it
+        try:
+            connection.ping(reconnect=False)
+        except pymysql.err.Error:
+            connection.ping(reconnect=True)             # Raises if the database is still unreachable
+            with self.condition:
+                self.metrics['reconnects'] += 1
+
+    def release(self, connection, broken=False):
+        # Returns a connection to the pool; broken connections are closed and their slot is freed
+        with self.condition:
+            if broken:
+                self.size -= 1
+                self.metrics['discarded'] += 1
+            else:
+                self.idle.append((connection, time.monotonic()))
+            self.condition.notify()
+        if broken:
+            try:
+                connection.close()
+            except pymysql.err.Error:
+                pass                                    # The connection is already unusable
+
+    @contextmanager
+    def connection(self):
+        # Checks out a connection for the duration of a with block
+        connection = self.acquire()
+        broken = False
+        try:
+            yield connection
+        except (pymysql.err.OperationalError, pymysql.err.InterfaceError):
+            broken = True                               # Do not hand out a connection that lost its server
+            raise
+        finally:
+            self.release(connection, broken)
+
+    def stream(self, query, params, chunk_rows=500):
+        # Yields lists of rows from an unbuffered server-side cursor so only one chunk is held in memory
+        connection = self.acquire()
+        finished = False
+        try:
+            cursor = connection.cursor(InstrumentedSSCursor)
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(chunk_rows)
+                if not rows:
+                    break
+                yield rows
+            cursor.close()
+            finished = True
+        finally:
+            # A consumer that stops mid-stream leaves unread rows behind; drop that connection instead of draining it
+            self.release(connection, broken=not finished)
+
+    def stats(self):
+        # Returns a snapshot of the pool usage metrics
+        with self.condition:
+            checkouts = self.metrics['checkouts']
+            return {
+                'size': self.size,
+                'idle': len(self.idle),
+                'in_use': self.size - len(self.idle),
+                'max_size': self.max_size,
+                **self.metrics,
+                'avg_checkout_seconds': self.metrics['checkout_seconds'] / checkouts if checkouts else 0.0
+            }
+
+    def close(self):
+        # Closes every idle connection
+        with self.condition:
+            idle, self.idle = list(self.idle), deque()
+            self.size -= len(idle)
+        for connection, _ in idle:
+            try:
+                connection.close()
+            except pymysql.err.Error:
+                pass
+
+#-----------------#
+# Returns the process-wide connection pool, creating it from the configuration on first use.
+def get_pool():
+    global shared_pool
+    with shared_pool_lock:
+        if shared_pool is None:
+            shared_pool = ConnectionPool(
+                min_size=POOL_CONFIG.get('MIN_SIZE', 1),
+                max_size=POOL_CONFIG.get('MAX_SIZE', 10),
+                timeout=POOL_CONFIG.get('TIMEOUT', 10),
+                health_check_idle=POOL_CONFIG.get('HEALTH_CHECK_IDLE', 5),
+                host=DB_CONFIG['host'],
+                user=DB_CONFIG['user'],
+                password=DB_CONFIG['password'],
+                database=DB_CONFIG['database'],
+                charset='utf8mb4',
+                cursorclass=InstrumentedCursor
+            )
+        return shared_pool
+
+#-----------------#
+# Closes the process-wide pool so the next get_pool() call creates a fresh one.
+def reset_pool():
+    global shared_pool
+    with shared_pool_lock:
+        if shared_pool is not None:
+            shared_pool.close()
+        shared_pool = None
@@ -0,0 +1,278 @@
+#-----------------#
+# Imported modules
+import csv                                  # Import csv for the CSV export and import
+import gzip                                 # Import gzip for reading gzip compressed files
+import io                                   # Import io for the text layers and the CSV buffer
+import json                                 # Import json for NDJSON rows and the stored device information
+import os                                   # Import os for renaming finished export files
+import zlib                                 # Import zlib for streaming gzip compression
+from datetime import datetime               # Import datetime for the since filter and the Parquet timestamps
+import config                               # Import config to read the optional EXPORT_CONFIG section
+import db_pool                              # Import db_pool for reading the exported tables with a server-side cursor
+import history                              # Import history for the event names
+import nmap_stream                          # Import nmap_stream for reading saved nmap XML reports and the host records
+
+#-----------------#
+# Export settings with defaults for installations whose config.py has no EXPORT_CONFIG yet
+EXPORT_CONFIG = {
+    'CHUNK_ROWS': 5000,         # Rows read, encoded and compressed at a time; also the Parquet row group size
+    'IMPORT_BATCH': 1000,       # Hosts written per transaction by an import
+    'GZIP_LEVEL': 6,
+    'ZSTD_LEVEL': 3
+}
+EXPORT_CONFIG.update(getattr(config, 'EXPORT_CONFIG', {}))
+
+# Columns of each dataset in export order; device_info is the stored JSON document as text, like in /api/scans
+DATASETS = {
+    'scans': ('id', 'ip', 'status', 'domain', 'timestamp', 'device_info'),
+    'events': ('id', 'ip', 'timestamp', 'event', 'port', 'detail')
+}
+DATASET_TABLES = {'scans': 'scans', 'events': 'scan_events'}
+FORMATS = ('ndjson', 'csv', 'parquet')
+COMPRESSIONS = ('none', 'gzip', 'zstd')     # Parquet compresses its column chunks itself with the chosen codec
+
+# File name suffixes and the content types of the API downloads
+FORMAT_SUFFIXES = {'ndjson': '.ndjson', 'csv': '.csv', 'parquet': '.parquet'}
+COMPRESSION_SUFFIXES = {'none': '', 'gzip': '.gz', 'zstd': '.zst'}
+CONTENT_TYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv', 'parquet': 'application/vnd.apache.parquet',
+                 'gzip': 'application/gzip', 'zstd': 'application/zstd'}
+
+#-----------------#
+# Raised for unknown formats, unreadable files and formats whose optional package is not installed.
+class ExportError(Exception):
+    pass
+
+#-----------------#
+# Imports the optional packages of the zstd and Parquet formats, with an install hint when they are missing.
+def require(package):
+    try:
+        if package == 'zstandard':
+            import zstandard
+            return zstandard
+        import pyarrow
+        import pyarrow.parquet
+        return pyarrow
+    except ImportError:
+        raise ExportError(f"This format needs the {package} package (pip install {package})")
+
+def check_format(dataset, file_format, compression):
+    # Validates an export request before any data is read
+    if dataset not in DATASETS:
+        raise ExportError(f"Unknown dataset, choose from {', '.join(DATASETS)}")
+    if file_format not in FORMATS:
+        raise ExportError(f"Unknown format, choose from {', '.join(FORMATS)}")
+    if compression not in COMPRESSIONS:
+        raise ExportError(f"Unknown compression, choose from {', '.join(COMPRESSIONS)}")
+    if file_format == 'parquet':
+        pa = require('pyarrow')
+        if compression != 'none' and not pa.Codec.is_available(compression):
+            raise ExportError(f"This pyarrow build cannot write {compression} compressed Parquet, choose another compression")
+    elif compression == 'zstd':
+        require('zstandard')
+
+def file_name(dataset, file_format, compression):
+    suffix = COMPRESSION_SUFFIXES[compression] if file_format != 'parquet' else ''
+    return dataset + FORMAT_SUFFIXES[file_format] + suffix
+
+def detect_format(path):
+    # Returns (format, compression) from a file name such as scans.ndjson.zst or scans.parquet
+    name = path.lower()
+    compression = 'none'
+    for candidate, suffix in COMPRESSION_SUFFIXES.items():
+        if suffix and name.endswith(suffix):
+            compression, name = candidate, name[:-len(suffix)]
+    for file_format, suffix in list(FORMAT_SUFFIXES.items()) + [('ndjson', '.jsonl'), ('xml', '.xml')]:
+        if name.endswith(suffix):
+            return file_format, compression
+    raise ExportError(f"Unknown file type of {path}, use .ndjson, .jsonl, .csv or .parquet (optionally .gz or .zst), or .xml")
+
+#-----------------#
+# Builds the query of an export; since limits it to rows written at or after that time.
+def build_export_query(dataset, since=None):
+    query = f"SELECT {', '.join(DATASETS[dataset])} FROM {DATASET_TABLES[dataset]}"
+    params = []
+    if since is not None:
+        query += " WHERE timestamp >= %s"   # Served by the timestamp index of both tables
+        params.append(since)
+    return query + " ORDER BY id", params
+
+def parse_since(value):
+    # Accepts an ISO date or date and time; raises ValueError on invalid input
+    return datetime.fromisoformat(value) if value else None
+
+#-----------------#
+# Converts database rows into plain values: event names instead of codes and ISO timestamps in the text formats.
+def convert_rows(dataset, rows, iso_timestamps=True):
+    position = DATASETS[dataset].index('timestamp')
+    converted = []
+    for row in rows:
+        row = list(row)
+        if iso_timestamps and row[position] is not None:
+            row[position] = row[position].isoformat()
+        if dataset == 'events':
+            row[3] = history.EVENT_NAMES.get(row[3], row[3])
+        converted.append(row)
+    return converted
+
+#-----------------#
+# Encoders: each takes an iterable of row chunks and yields the encoded bytes of one chunk at a time.
+def encode_ndjson(dataset, chunks):
+    fields = DATASETS[dataset]
+    for rows in chunks:
+        yield ''.join(json.dumps(dict(zip(fields, row))) + '\n' for row in convert_rows(dataset, rows)).encode()
+
+def encode_csv(dataset, chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(DATASETS[dataset])
+    for rows in chunks:
+        writer.writerows(convert_rows(dataset, rows))
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()    # Header of an empty export
+
+def parquet_schema(dataset):
+    pa = require('pyarrow')
+    types = {'id': pa.int64(), 'timestamp': pa.timestamp('s'), 'port': pa.int32()}
+    return pa.schema([(field, types.get(field, pa.string())) for field in DATASETS[dataset]])
+
+# Write-only file for pyarrow that hands out what was written since the last call of take()
+class ChunkSink:
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data, self.parts = b''.join(self.parts), []
+        return data
+
+def encode_parquet(dataset, chunks, compression='zstd'):
+    # One row group per chunk, written out as soon as it is encoded; the footer follows the last chunk
+    pa = require('pyarrow')
+    schema = parquet_schema(dataset)
+    sink = ChunkSink()
+    writer = pa.parquet.ParquetWriter(pa.PythonFile(sink, mode='w'), schema, compression=compression)
+    for rows in chunks:
+        columns = list(zip(*convert_rows(dataset, rows, iso_timestamps=False)))
+        writer.write_table(pa.table([pa.array(column, type=schema.field(i).type) for i, column in enumerate(columns)], schema=schema))
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+#-----------------#
+# Compresses a stream of byte chunks without holding more than one chunk.
+def compress(chunks, compression):
+    if compression == 'gzip':
+        compressor = zlib.compressobj(EXPORT_CONFIG['GZIP_LEVEL'], zlib.DEFLATED, 31)   # wbits 31 writes the gzip container
+    elif compression == 'zstd':
+        compressor = require('zstandard').ZstdCompressor(level=EXPORT_CONFIG['ZSTD_LEVEL']).compressobj()
+    else:
+        yield from chunks
+        return
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+#-----------------#
+# Returns the encoded and compressed bytes of an export, one chunk at a time.
+def export_chunks(dataset, file_format, compression, chunks):
+    if file_format == 'parquet':
+        return encode_parquet(dataset, chunks, 'none' if compression == 'none' else compression)
+    encoder = encode_ndjson if file_format == 'ndjson' else encode_csv
+    return compress(encoder(dataset, chunks), compression)
+
+#-----------------#
+# Writes an export to a file named like scans.ndjson.gz or events.parquet and returns the number of rows written.
+def export_file(path, dataset, since=None):
+    file_format, compression = detect_format(path)
+    if file_format == 'xml':
+        raise ExportError("Exports are written as .ndjson, .csv or .parquet")
+    check_format(dataset, file_format, compression)
+    counted = {'rows': 0}
+
+    def chunks():
+        for rows in db_pool.get_pool().stream(*build_export_query(dataset, since), EXPORT_CONFIG['CHUNK_ROWS']):
+            counted['rows'] += len(rows)
+            yield rows
+
+    # Written under a temporary name so a failed export never leaves a truncated file behind
+    with open(path + '.part', 'wb') as output:
+        for data in export_chunks(dataset, file_format, compression, chunks()):
+            output.write(data)
+    os.replace(path + '.part', path)
+    return counted['rows']
+
+#-----------------#
+# Opens an export for reading as a binary stream, decompressing gzip and zstd files on the fly.
+def open_binary(path, compression):
+    if compression == 'gzip':
+        return gzip.open(path, 'rb')
+    if compression == 'zstd':
+        return require('zstandard').ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    return open(path, 'rb')
+
+#-----------------#
+# Yields the rows of a scans export as dictionaries.
+def read_rows(path, file_format, compression):
+    if file_format == 'parquet':
+        parquet_file = require('pyarrow').parquet.ParquetFile(path)
+        if 'device_info' not in parquet_file.schema_arrow.names:
+            raise ExportError("Only exports of the scans dataset can be imported")
+        for batch in parquet_file.iter_batches(batch_size=EXPORT_CONFIG['CHUNK_ROWS'], columns=['ip', 'status', 'domain', 'device_info']):
+            yield from batch.to_pylist()
+        return
+    with open_binary(path, compression) as binary, io.TextIOWrapper(binary, encoding='utf-8', newline='') as text:
+        if file_format == 'csv':
+            yield from csv.DictReader(text)
+        else:
+            for line in text:
+                if line.strip():
+                    yield json.loads(line)
+
+#-----------------#
+# Builds the host record of an exported scans row; ports written before the protocol was stored default to TCP.
+def record_from_row(row):
+    if 'device_info' not in row or not row.get('ip'):
+        raise ExportError("Only exports of the scans dataset can be imported")
+    try:
+        device_info = row['device_info'] or {}
+        if isinstance(device_info, str):
+            device_info = json.loads(device_info)
+        ports = tuple(sorted((port.get('proto') or 'tcp', int(port['port']), port.get('state', ''), port.get('name', ''), port.get('product', ''), port.get('version', ''))
+                             for port in device_info.get('ports', [])))
+        return nmap_stream.HostRecord(row['ip'], row.get('status') or 'up', device_info.get('hostname', ''), ports)
+    except (KeyError, TypeError, ValueError, AttributeError) as e:     # Hand-edited or truncated rows; JSONDecodeError is a ValueError
+        raise ExportError(f"Invalid row for {row['ip']}: {e!r}")
+
+#-----------------#
+# Yields (host record, domain) pairs from a previous scans export or a saved nmap XML report (-oX).
+def read_records(path):
+    file_format, compression = detect_format(path)
+    if file_format == 'xml':
+        with open_binary(path, compression) as source:
+            for record in nmap_stream.iter_hosts(source):
+                yield record, record.hostname or None       # nmap's PTR name stands in for the reverse DNS lookup
+        return
+    for row in read_rows(path, file_format, compression):
+        domain = row.get('domain')
+        yield record_from_row(row), domain if domain and domain != 'None' else None
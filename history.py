@@ -0,0 +1,109 @@
+#-----------------#
+# Imported modules
+import json                     # Import json for reading the stored device information
+from colorama import Fore       # Import Fore from colorama for colored terminal text
+from logger import log          # Import log for leveled, rate-limited console output
+import metrics                  # Import metrics for counting recorded events
+from collections import Counter # Import Counter for aggregating events by type
+
+#-----------------#
+# Compact event codes stored in scan_events.event
+EVENT_TYPES = {
+    'host_up': 1,               # Host appeared or came back up
+    'host_down': 2,             # Host was not found by a scan
+    'port_opened': 3,           # Port became open
+    'port_closed': 4,           # Port is no longer open
+    'version_changed': 5        # Service, product or version on an open port changed
+}
+EVENT_NAMES = {code: name for name, code in EVENT_TYPES.items()}    # Reverse mapping used when reading the history
+
+#-----------------#
+# Compares the stored state of a device with its new state and returns the resulting events.
+def diff_device_info(host, previous, status, device_info_json):
+    # previous is the stored (status, device_info, domain) tuple, or None for a new device
+    old_status, old_info = (previous[0], previous[1]) if previous else (None, None)
+    events = []
+
+    # Host state transitions
+    if status == 'up' and old_status != 'up':
+        events.append((host, EVENT_TYPES['host_up'], None, None))
+    elif status != 'up' and old_status == 'up':
+        events.append((host, EVENT_TYPES['host_down'], None, None))
+
+    # Port transitions between the previous and the current set of open ports
+    old_ports = get_open_ports(old_info)
+    new_ports = get_open_ports(device_info_json)
+    for port in sorted(new_ports.keys() - old_ports.keys()):
+        events.append((host, EVENT_TYPES['port_opened'], port, new_ports[port]))
+    for port in sorted(old_ports.keys() - new_ports.keys()):
+        events.append((host, EVENT_TYPES['port_closed'], port, old_ports[port]))
+    for port in sorted(old_ports.keys() & new_ports.keys()):
+        if old_ports[port] != new_ports[port]:
+            events.append((host, EVENT_TYPES['version_changed'], port, new_ports[port]))
+    return events
+
+#-----------------#
+# Maps every open port of a device to a short 'name product version' description.
+def get_open_ports(device_info):
+    if not device_info:
+        return {}
+    # The database returns JSON columns as text
+    if isinstance(device_info, (str, bytes)):
+        device_info = json.loads(device_info)
+    return {
+        port_info['port']: ' '.join(filter(None, (port_info.get('name'), port_info.get('product'), port_info.get('version'))))[:255]
+        for port_info in device_info.get('ports', [])
+        if port_info.get('state') == 'open'
+    }
+
+#-----------------#
+# Writes events to the history table with one batched INSERT.
+def record_events(cursor, events):
+    if not events:
+        return
+    cursor.executemany(
+        "INSERT INTO scan_events (ip, event, port, detail) VALUES (%s, %s, %s, %s)",
+        events
+    )
+    for event, count in Counter(event for _, event, _, _ in events).items():
+        metrics.HOST_EVENTS.inc(count, event=EVENT_NAMES[event])    # One increment per event type, not per event
+    log.info('db', "Recorded " + Fore.GREEN + f"{len(events)}" + Fore.WHITE + " history events.")
+
+#-----------------#
+# Deletes history events older than the retention period in small batches to avoid long locks.
+def compact_history(cursor, retention_days, batch_size=10000):
+    deleted = 0
+    while True:
+        cursor.execute(
+            "DELETE FROM scan_events WHERE timestamp < NOW() - INTERVAL %s DAY LIMIT %s",
+            (retention_days, batch_size)
+        )
+        cursor.connection.commit()          # Release locks after every batch
+        deleted += cursor.rowcount
+        if cursor.rowcount < batch_size:
+            break
+    if deleted:
+        log.info('db', f"Removed {deleted} history events older than {retention_days} days.")
+    return deleted
+
+#-----------------#
+# Reads the newest events of one host using the (ip, timestamp) index.
+def get_host_timeline(cursor, ip, since=None, before_id=None, limit=100):
+    query = "SELECT id, timestamp, event, port, detail FROM scan_events WHERE ip = %s"
+    params = [ip]
+    # Optional lower time bound
+    if since:
+        query += " AND timestamp >= %s"
+        params.append(since)
+    # Keyset pagination: continue below the last event id of the previous page
+    if before_id:
+        query += " AND id < %s"
+        params.append(before_id)
+    query += " ORDER BY timestamp DESC, id DESC LIMIT %s"
+    params.append(limit)
+
+    cursor.execute(query, params)
+    return [
+        {'id': event_id, 'timestamp': timestamp, 'event': EVENT_NAMES.get(event, event), 'port': port, 'detail': detail}
+        for event_id, timestamp, event, port, detail in cursor.fetchall()
+    ]
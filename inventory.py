@@ -0,0 +1,250 @@
+#-----------------#
+# Imported modules
+import gzip                                 # Import gzip for compressing the startup snapshot
+import json                                 # Import json for the open ports of the stored device information and the snapshot
+import os                                   # Import os for replacing the snapshot file atomically
+import threading                            # Import threading for the lock shared by readers and the refresh
+import ipaddress                            # Import ipaddress for converting between addresses and integers
+import time                                 # Import time for spacing the snapshots
+from array import array                     # Import array for the compact sorted list of integer addresses
+from bisect import bisect_left, bisect_right    # Import bisect for range lookups in the sorted addresses
+from datetime import datetime, timedelta    # Import datetime for the snapshot timestamps and timedelta for the overlap of incremental refreshes
+import config                               # Import config to read the optional INVENTORY_CONFIG section
+import db_pool                              # Import db_pool for reading the scans table
+from logger import log                      # Import log for leveled, rate-limited console output
+
+#-----------------#
+# Inventory settings with defaults for installations whose config.py has no INVENTORY_CONFIG yet
+INVENTORY_CONFIG = {
+    'ENABLED': True,                        # Serve /api/inventory from memory; each API process keeps its own copy
+    'SNAPSHOT': 'inventory.snapshot',       # File the inventory is restored from at start-up, relative to the program directory; '' disables it
+    'SNAPSHOT_INTERVAL': 300,               # Minimum seconds between two snapshot writes
+    'SYNC_OVERLAP': 60                      # Seconds re-read before the newest applied row, catches rows committed late by concurrent shards
+}
+INVENTORY_CONFIG.update(getattr(config, 'INVENTORY_CONFIG', {}))
+
+# Version of the snapshot layout; snapshots with another version are ignored
+SNAPSHOT_VERSION = 2
+
+#-----------------#
+# One host of the inventory; open ports are a bitmap with bit p set for open port p.
+class Host:
+
+    __slots__ = ('ip_num', 'status', 'domain', 'timestamp', 'ports')
+
+    def __init__(self, ip_num, status, domain, timestamp, ports):
+        self.ip_num = ip_num
+        self.status = status
+        self.domain = domain
+        self.timestamp = timestamp
+        self.ports = ports
+
+    def to_dict(self):
+        return {'ip': str(ipaddress.IPv4Address(self.ip_num)), 'status': self.status, 'domain': self.domain,
+                'timestamp': self.timestamp, 'open_ports': bitmap_ports(self.ports)}
+
+#-----------------#
+# Converts between port lists and port bitmaps.
+def ports_bitmap(ports):
+    bitmap = 0
+    for port in ports:
+        bitmap |= 1 << port
+    return bitmap
+
+def bitmap_ports(bitmap):
+    ports = []
+    while bitmap:
+        lowest = bitmap & -bitmap           # Lowest set bit
+        ports.append(lowest.bit_length() - 1)
+        bitmap ^= lowest
+    return ports
+
+#-----------------#
+# Returns the bitmap of the open ports in a device_info JSON document.
+def open_ports_bitmap(device_info):
+    if not device_info:
+        return 0
+    if isinstance(device_info, (str, bytes)):
+        device_info = json.loads(device_info)
+    return ports_bitmap(port_info['port'] for port_info in device_info.get('ports', []) if port_info.get('state') == 'open')
+
+#-----------------#
+# Read-optimized copy of the scans table: hosts sorted by integer address plus an index of hosts per open port.
+class Inventory:
+
+    def __init__(self):
+        self.ip_nums = array('I')           # Sorted integer addresses
+        self.hosts = []                     # Host records in the same order as ip_nums
+        self.port_index = {}                # port -> set of integer addresses with the port open
+        self.generation = None              # Scanner commit generation the inventory reflects
+        self.synced_at = None               # Newest scans.timestamp applied, incremental refreshes start there
+        self.lock = threading.RLock()       # Held by readers and while applying changes
+        self.refresh_lock = threading.Lock()    # One refresh at a time per process
+        self.saved_at = None                # Monotonic time of the last snapshot write
+
+    def __len__(self):
+        return len(self.hosts)
+
+    def apply(self, ip_num, status, domain, timestamp, ports):
+        # Inserts or replaces one host and keeps the port index in sync
+        with self.lock:
+            position = bisect_left(self.ip_nums, ip_num)
+            if position < len(self.ip_nums) and self.ip_nums[position] == ip_num:
+                host = self.hosts[position]
+                old_ports = host.ports
+                host.status, host.domain, host.timestamp, host.ports = status, domain, timestamp, ports
+            else:
+                self.ip_nums.insert(position, ip_num)
+                self.hosts.insert(position, Host(ip_num, status, domain, timestamp, ports))
+                old_ports = 0
+            for port in bitmap_ports(old_ports & ~ports):
+                self.port_index[port].discard(ip_num)
+            for port in bitmap_ports(ports & ~old_ports):
+                self.port_index.setdefault(port, set()).add(ip_num)
+
+    def load_rows(self, rows):
+        # Replaces the whole inventory with (ip_num, status, domain, timestamp, ports bitmap) rows in one pass
+        rows = sorted(rows)
+        port_index = {}
+        for ip_num, _, _, _, ports in rows:
+            for port in bitmap_ports(ports):
+                port_index.setdefault(port, set()).add(ip_num)
+        with self.lock:
+            self.ip_nums = array('I', (row[0] for row in rows))
+            self.hosts = [Host(*row) for row in rows]
+            self.port_index = port_index
+
+    def refresh(self, cursor, generation, overlap=60):
+        # Applies the scans rows written since the last refresh, or loads the whole table the first time
+        with self.refresh_lock:
+            if self.generation == generation:
+                return 0
+            query = "SELECT ip_num, status, domain, timestamp, device_info FROM scans"
+            if self.synced_at is not None:
+                # Rows are stamped when written but visible once committed, so re-read a window; re-applying a row is harmless
+                cursor.execute(query + " WHERE timestamp >= %s", (self.synced_at - timedelta(seconds=overlap),))
+            else:
+                cursor.execute(query)
+            # The rows are read and parsed without blocking the readers
+            rows = [(ip_num, status, domain, timestamp, open_ports_bitmap(device_info))
+                    for ip_num, status, domain, timestamp, device_info in cursor.fetchall() if ip_num is not None]
+            if self.synced_at is None:
+                self.load_rows(rows)
+            else:
+                for row in rows:
+                    self.apply(*row)
+            timestamps = [row[3] for row in rows if row[3] is not None] + ([self.synced_at] if self.synced_at else [])
+            self.synced_at = max(timestamps, default=None)
+            self.generation = generation
+            return len(rows)
+
+    def range_bounds(self, network=None, after=None):
+        # Positions of the hosts inside the network and after the given address
+        low, high = 0, len(self.ip_nums)
+        if network is not None:
+            low = bisect_left(self.ip_nums, int(network.network_address))
+            high = bisect_right(self.ip_nums, int(network.broadcast_address))
+        if after is not None:
+            low = max(low, bisect_right(self.ip_nums, after))
+        return low, high
+
+    def matching(self, network=None, port=None, status=None, after=None):
+        # Yields the matching hosts in address order
+        low, high = self.range_bounds(network, after)
+        if port is not None:
+            with_port = self.port_index.get(port, ())
+            # Walk the port's hosts when the port is rare, otherwise walk the range and test the bitmaps, which stops at the page limit
+            if len(with_port) * 8 < high - low:
+                low_num = self.ip_nums[low] if low < high else 0
+                high_num = self.ip_nums[high - 1] if low < high else -1
+                for ip_num in sorted(ip_num for ip_num in with_port if low_num <= ip_num <= high_num):
+                    host = self.hosts[bisect_left(self.ip_nums, ip_num)]
+                    if status is None or host.status == status:
+                        yield host
+                return
+        bit = 1 << port if port is not None else 0
+        for position in range(low, high):
+            host = self.hosts[position]
+            if (not bit or host.ports & bit) and (status is None or host.status == status):
+                yield host
+
+    def select(self, network=None, port=None, status=None, after=None, limit=100):
+        with self.lock:
+            hosts = []
+            for host in self.matching(network, port, status, after):
+                hosts.append(host.to_dict())
+                if len(hosts) == limit:
+                    break
+            return hosts
+
+    def count(self, network=None, port=None, status=None):
+        with self.lock:
+            if status is None and port is None:
+                low, high = self.range_bounds(network)
+                return high - low
+            if status is None and network is None:
+                return len(self.port_index.get(port, ()))
+            return sum(1 for _ in self.matching(network, port, status))
+
+    def save(self, path):
+        # Writes a gzip compressed JSON snapshot next to the target and renames it, so readers never see a partial file.
+        # JSON instead of pickle: loading a snapshot can never run code, whoever wrote the file
+        with self.lock:
+            rows = [[host.ip_num, host.status, host.domain, host.timestamp.isoformat() if host.timestamp else None, bitmap_ports(host.ports)]
+                    for host in self.hosts]
+            synced_at = self.synced_at.isoformat() if self.synced_at else None
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with gzip.open(temporary, 'wt', encoding='utf-8', compresslevel=6) as snapshot:
+            json.dump({'version': SNAPSHOT_VERSION, 'synced_at': synced_at, 'rows': rows}, snapshot, separators=(',', ':'))
+        os.replace(temporary, path)
+
+    def load(self, path):
+        # Restores a snapshot written by save(); the next refresh only reads the rows written since
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as snapshot:
+                data = json.load(snapshot)
+            if data.get('version') != SNAPSHOT_VERSION:
+                return False
+            rows = [(int(ip_num), status, domain, datetime.fromisoformat(timestamp) if timestamp else None, ports_bitmap(ports))
+                    for ip_num, status, domain, timestamp, ports in data['rows']]
+            synced_at = datetime.fromisoformat(data['synced_at']) if data['synced_at'] else None
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            log.warning('inventory', f"Ignoring unreadable snapshot {path}: {e}")
+            return False
+        self.load_rows(rows)
+        with self.lock:
+            self.synced_at = synced_at
+            self.generation = None          # Always catch up with the database after loading
+        return True
+
+#-----------------#
+# Shared inventory of this process, restored from the snapshot on first use and brought up to date whenever the scanner committed.
+inventory = Inventory()
+inventory_state = {'loaded': False}
+
+def snapshot_path():
+    path = INVENTORY_CONFIG['SNAPSHOT']
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), path) if path else None
+
+def get_inventory(generation):
+    path = snapshot_path()
+    if not inventory_state['loaded']:
+        with inventory.refresh_lock:
+            if not inventory_state['loaded']:
+                if path and inventory.load(path):
+                    log.info('inventory', f"Restored {len(inventory)} hosts from {path}.")
+                inventory_state['loaded'] = True
+    if inventory.generation != generation:
+        with db_pool.get_pool().connection() as conn:
+            cursor = conn.cursor()
+            inventory.refresh(cursor, generation, INVENTORY_CONFIG['SYNC_OVERLAP'])
+            cursor.close()
+        if path and (inventory.saved_at is None or time.monotonic() - inventory.saved_at >= INVENTORY_CONFIG['SNAPSHOT_INTERVAL']):
+            inventory.saved_at = time.monotonic()
+            try:
+                inventory.save(path)
+            except OSError as e:
+                log.warning('inventory', f"Unable to write the snapshot {path}: {e}")
+    return inventory
@@ -0,0 +1,69 @@
+#-----------------#
+# Imported modules
+import threading                            # Import threading for the lock guarding the rate limit buckets
+import time                                 # Import time for refilling the rate limit buckets
+from colorama import Fore                   # Import Fore from colorama for colored terminal text
+import config                               # Import config to read the optional LOG_CONFIG section
+
+#-----------------#
+# Logger settings with defaults for installations whose config.py has no LOG_CONFIG yet
+LOG_CONFIG = {
+    'LEVEL': 'INFO',            # DEBUG, INFO, WARNING, ERROR or OFF
+    'RATE': 20,                 # Lines per second per tag once the burst is used up; 0 disables rate limiting
+    'BURST': 100                # Lines per tag that may be printed at once
+}
+LOG_CONFIG.update(getattr(config, 'LOG_CONFIG', {}))
+
+LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40, 'OFF': 100}
+COLORS = {10: Fore.CYAN, 20: Fore.YELLOW, 30: Fore.YELLOW, 40: Fore.RED}
+
+#-----------------#
+# Console logger with levels and a token bucket per tag, so large scans cannot flood the terminal.
+class RateLimitedLogger:
+
+    def __init__(self, level='INFO', rate=20, burst=100):
+        self.level = LEVELS[level.upper()]
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}                   # tag -> [tokens, refilled_at, suppressed lines]
+        self.lock = threading.Lock()
+
+    def enabled(self, level):
+        # Lets callers skip building messages that would be dropped anyway
+        return LEVELS[level] >= self.level
+
+    def log(self, level, tag, message):
+        level = LEVELS[level]
+        if level < self.level:
+            return
+        suppressed = 0
+        if self.rate and level < LEVELS['ERROR']:          # Errors are never dropped
+            with self.lock:
+                now = time.monotonic()
+                bucket = self.buckets.setdefault(tag, [self.burst, now, 0])
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+                if bucket[0] < 1:
+                    bucket[2] += 1
+                    return
+                bucket[0] -= 1
+                suppressed, bucket[2] = bucket[2], 0
+        if suppressed:
+            print(COLORS[LEVELS['WARNING']] + f"[{tag}]" + Fore.WHITE + f" {suppressed} lines suppressed by the rate limit.")
+        print(COLORS[level] + f"[{tag}]" + Fore.WHITE + f" {message}")
+
+    def debug(self, tag, message):
+        self.log('DEBUG', tag, message)
+
+    def info(self, tag, message):
+        self.log('INFO', tag, message)
+
+    def warning(self, tag, message):
+        self.log('WARNING', tag, message)
+
+    def error(self, tag, message):
+        self.log('ERROR', tag, message)
+
+#-----------------#
+# Shared logger of this process
+log = RateLimitedLogger(LOG_CONFIG['LEVEL'], LOG_CONFIG['RATE'], LOG_CONFIG['BURST'])
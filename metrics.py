@@ -0,0 +1,178 @@
+#-----------------#
+# Imported modules
+import threading                            # Import threading for the lock guarding the metric values
+import time                                 # Import time for timing blocks of code
+import json                                 # Import json for the snapshots shared between the scanner and the API
+from contextlib import contextmanager       # Import contextmanager for the timer helper
+
+#-----------------#
+# Upper bounds of the default latency buckets in seconds
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1200)
+
+# Every metric created in this process, in creation order
+registry = []
+registry_lock = threading.Lock()
+
+#-----------------#
+# Base class of all metrics: a name, a help text and values per label combination.
+class Metric:
+
+    kind = 'untyped'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.values = {}                    # label values tuple -> value
+        self.lock = threading.Lock()
+        with registry_lock:
+            registry.append(self)
+
+    def key(self, labels):
+        return tuple(str(labels.get(label, '')) for label in self.labels)
+
+#-----------------#
+# Monotonically increasing count, e.g. queries or hosts seen.
+class Counter(Metric):
+
+    kind = 'counter'
+
+    def inc(self, value=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def samples(self):
+        with self.lock:
+            return [(self.name + '_total', dict(zip(self.labels, key)), value) for key, value in self.values.items()]
+
+#-----------------#
+# Value that can go up and down, e.g. connections in use.
+class Gauge(Metric):
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, dict(zip(self.labels, key)), value) for key, value in self.values.items()]
+
+#-----------------#
+# Distribution of observed values in cumulative buckets, e.g. latencies.
+class Histogram(Metric):
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * len(self.buckets) + [0, 0.0]     # Bucket counts, total count, sum
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            counts[-2] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, counts in self.values.items():
+                labels = dict(zip(self.labels, key))
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    samples.append((self.name + '_bucket', {**labels, 'le': format_value(bound)}, cumulative))
+                samples.append((self.name + '_bucket', {**labels, 'le': '+Inf'}, counts[-2]))
+                samples.append((self.name + '_count', labels, counts[-2]))
+                samples.append((self.name + '_sum', labels, counts[-1]))
+        return samples
+
+#-----------------#
+# Returns every metric family of this process as [name, kind, help, samples], with extra labels added to each sample.
+def collect(extra_labels=None):
+    with registry_lock:
+        metrics = list(registry)
+    families = []
+    for metric in metrics:
+        samples = [[name, {**(extra_labels or {}), **labels}, value] for name, labels, value in metric.samples()]
+        if samples:
+            # In the 0.0.4 text format a counter's HELP/TYPE lines name its samples, which carry the _total suffix
+            name = metric.name + '_total' if metric.kind == 'counter' else metric.name
+            families.append([name, metric.kind, metric.help_text, samples])
+    return families
+
+#-----------------#
+# Serializes the metrics of this process so another process can expose them.
+def snapshot(process):
+    return json.dumps(collect({'process': process}))
+
+#-----------------#
+# Renders metric families in the Prometheus text exposition format, merging families with the same name.
+def render(families):
+    merged = {}
+    for name, kind, help_text, samples in families:
+        family = merged.setdefault(name, [kind, help_text, []])
+        family[2].extend(samples)
+
+    lines = []
+    for name, (kind, help_text, samples) in merged.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for sample_name, labels, value in samples:
+            label_text = ','.join(f'{label}="{escape(value)}"' for label, value in labels.items())
+            lines.append(f"{sample_name}{{{label_text}}} {format_value(value)}" if label_text else f"{sample_name} {format_value(value)}")
+    return '\n'.join(lines) + '\n'
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+#-----------------#
+# Stores the snapshot of this process in the scan_metrics table, where the API picks it up for /metrics.
+def publish(cursor, process):
+    cursor.execute(
+        "INSERT INTO scan_metrics (process, snapshot) VALUES (%s, %s) "
+        "ON DUPLICATE KEY UPDATE snapshot = VALUES(snapshot), updated_at = CURRENT_TIMESTAMP",
+        (process, snapshot(process))
+    )
+
+#-----------------#
+# Reads the snapshots published by other processes.
+def load_published(cursor):
+    cursor.execute("SELECT snapshot FROM scan_metrics")
+    families = []
+    for (data,) in cursor.fetchall():
+        families.extend(json.loads(data))
+    return families
+
+#-----------------#
+# Metrics shared by the scanner and the API
+SCAN_PHASE_SECONDS = Histogram('networkmonitor_scan_phase_seconds', "Time spent per scan phase and shard.", ('phase',))
+SCAN_CYCLE_SECONDS = Histogram('networkmonitor_scan_cycle_seconds', "Wall time of a scan cycle.")
+SCAN_HOSTS = Counter('networkmonitor_scan_hosts', "Hosts per scan outcome (new, changed, unchanged, gone).", ('state',))
+HOST_EVENTS = Counter('networkmonitor_host_events', "Recorded host and port changes by event type.", ('event',))
+DNS_LOOKUP_SECONDS = Histogram('networkmonitor_dns_lookup_seconds', "Reverse DNS lookup latency, cache misses only.", ('result',))
+DNS_CACHE_HITS = Counter('networkmonitor_dns_cache_hits', "Reverse DNS lookups answered from the cache.")
+DB_QUERY_SECONDS = Histogram('networkmonitor_db_query_seconds', "Database round trip latency by statement type.", ('statement',))
+API_REQUEST_SECONDS = Histogram('networkmonitor_api_request_seconds', "REST API request latency until the response headers.", ('endpoint', 'method', 'status'))
+POOL_CONNECTIONS = Gauge('networkmonitor_db_pool_connections', "Open pooled database connections by state.", ('state',))
@@ -8,14 +8,54 @@ from colorama import Fore                                           # Import For
 from config import DB_CONFIG, VENV, FLASK_CONFIG, SCAN_CONFIG       # Import configuration settings from the config module
 import subprocess                                                   # Import subprocess for executing shell commands
 import os                                                           # Import os for operating system dependent functionality
+import sys                                                          # Import sys for starting the API with the running interpreter
+import urllib.request                                               # Import urllib.request for polling the API's health endpoint
 import getpass                                                      # Import getpass for securely getting user passwords without echoing
-import socket
+import pprint                                                       # Import pprint for writing configuration dictionaries as Python literals
+import socket                                                       # Import socket for reverse DNS lookups
+import history                                                      # Import history for recording port and host changes
+import hashlib                                                      # Import hashlib for compact per-host fingerprints
+import db_pool                                                      # Import db_pool for the shared database connection pool
+import nmap_stream                                                  # Import nmap_stream for parsing nmap's XML output while it runs
+import metrics                                                      # Import metrics for the scan, DNS and database instrumentation
+from logger import log                                              # Import log for leveled, rate-limited console output
+import config                                                       # Import config to carry over settings sections that are not prompted for
+import ipaddress                                                    # Import ipaddress for splitting networks into scan shards
+import threading                                                    # Import threading for the locks shared by DNS lookups and concurrent scan jobs
+import scheduler                                                    # Import scheduler for running scan jobs in daemon mode
+import tuning                                                       # Import tuning for the adaptive nmap timing per subnet
+import notifications                                                # Import notifications for sending committed change events to webhooks
+import export                                                       # Import export for exporting the inventory and importing earlier exports
+import argparse                                                     # Import argparse for the headless daemon options
+import signal                                                       # Import signal for stopping the daemon on SIGTERM
+from collections import OrderedDict                                 # Import OrderedDict for the LRU DNS cache
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, Future, wait, FIRST_COMPLETED   # Import the pools used for scan shards and DNS lookups
 
 #-----------------#
 # Global variables to manage the API process state
 process = None          # Global variable to hold the reference to the API process
 api_started = False     # Global flag to indicate whether the API has been started
 
+# Service fingerprints from the last version detection, {ip: {port: (probed_at, name, product, version)}}
+service_fingerprints = {}
+
+# Shared reverse DNS resolver, created on first use
+dns_resolver = None
+
+# Time of the last history retention run
+last_history_compaction = 0.0
+
+# Known devices {ip: (status, fingerprint, domain)}, warmed from the database on the first cycle and kept in sync afterwards
+device_state = {}
+device_state_loaded = False
+device_state_lock = threading.RLock()     # Serializes writes of concurrent scan jobs to the database and the device state
+
+# Process-wide cap on concurrently running nmap processes across all scan jobs
+nmap_slots = threading.BoundedSemaphore(scheduler.SCHEDULER_CONFIG['MAX_NMAP_PROCESSES'])
+
+# Counters of the current or last finished cycle
+cycle_stats = {'unchanged': 0, 'changed': 0, 'new': 0, 'gone': 0}
+
 #-----------------#
 # Context manager for managing database connections.
 class DatabaseConnection:
@@ -26,53 +66,127 @@ class DatabaseConnection:
         self.cursor = None
 
     def __enter__(self):
-        # Establishes a database connection and returns the cursor for executing queries.
+        # Checks a connection out of the shared pool and returns the cursor for executing queries.
         try:
-            # Create a new database connection using pymysql
-            self.connection = pymysql.connect(
-                host=DB_CONFIG['host'],
-                user=DB_CONFIG['user'],
-                password=DB_CONFIG['password'],
-                database=DB_CONFIG['database'],
-                charset='utf8mb4'
-            )
+            # Take a pooled connection instead of opening a new one for every scan cycle
+            self.connection = db_pool.get_pool().acquire()
             # Create a cursor object to interact with the database
             self.cursor = self.connection.cursor()
-            print(Fore.YELLOW + "[db]" + Fore.WHITE + " Database connection established.")
+            log.debug('db', "Database connection established.")
             return self.cursor      # Return the cursor for use in the with statement
         except UnicodeEncodeError:
             # Handle the case where the password cannot be encoded
-            print(Fore.RED + "[db]" + Fore.WHITE + " Error: unable to encode password")
+            log.error('db', "Error: unable to encode password")
 
     def __exit__(self, exc_type, exc_value, traceback):
-        # Closes the database connection and cursor when exiting the context.
+        # Closes the cursor and returns the connection to the pool when exiting the context.
         if self.cursor:
             self.cursor.close()         # Close the cursor if it exists
         if self.connection:
-            self.connection.close()     # Close the database connection if it exists
-        print(Fore.YELLOW + "[db]" + Fore.WHITE + " Connection closed.")
+            broken = exc_type is not None and issubclass(exc_type, (pymysql.err.OperationalError, pymysql.err.InterfaceError))
+            if exc_type is not None and not broken:
+                self.connection.rollback()  # Do not leave a half-written cycle on a connection that is reused
+            db_pool.get_pool().release(self.connection, broken)     # Return the connection, or drop it if the server went away
+        log.debug('db', "Connection returned to the pool.")
 
 #-----------------#
-# Starts the REST API as a subprocess.
+# Resolves reverse DNS names concurrently and caches positive and negative results.
+class DnsResolver:
+
+    def __init__(self, workers, ttl, negative_ttl, max_size):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='dns')    # Bounded pool of resolver threads
+        self.ttl = ttl                          # Seconds a found name stays cached
+        self.negative_ttl = negative_ttl        # Seconds a missing PTR record stays cached
+        self.max_size = max_size                # Maximum number of cached addresses before LRU eviction
+        self.cache = OrderedDict()              # ip -> (expires_at, name or None), least recently used first
+        self.lock = threading.Lock()            # Protects the cache against concurrent resolver threads
+
+    def start(self, hosts):
+        # Starts lookups for all hosts and returns a future per host; cache hits are returned as finished futures
+        futures = {}
+        for host in hosts:
+            cached = self.get_cached(host)
+            if cached is None:
+                futures[host] = self.executor.submit(self.lookup, host)
+            else:
+                metrics.DNS_CACHE_HITS.inc()
+                futures[host] = Future()
+                futures[host].set_result(cached[1])
+        return futures
+
+    def get_cached(self, host):
+        # Returns the cached (expires_at, name) entry for the host if it has not expired
+        with self.lock:
+            entry = self.cache.get(host)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self.cache[host]            # Drop the expired entry
+                return None
+            self.cache.move_to_end(host)        # Mark the entry as recently used
+            return entry
+
+    def lookup(self, host):
+        # Resolves one address and stores the result, including failures, in the cache
+        started = time.perf_counter()
+        try:
+            name = socket.gethostbyaddr(host)[0]
+            expires_at = time.monotonic() + self.ttl
+        except (OSError, UnicodeError):
+            name = None                         # No PTR record or the resolver failed
+            expires_at = time.monotonic() + self.negative_ttl
+        metrics.DNS_LOOKUP_SECONDS.observe(time.perf_counter() - started, result='found' if name else 'missing')
+        with self.lock:
+            self.cache[host] = (expires_at, name)
+            self.cache.move_to_end(host)
+            while len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)  # Evict the least recently used address
+        return name
+
+#-----------------#
+# Starts the REST API on the configured production server as a subprocess and waits until it answers.
 def start_api():
     # Declare global variables to be used in the function
     global process, api_started
 
     try:
-        # Construct the path to the Python executable in the virtual environment
-        python_executable = os.path.join(VENV['PATH'], 'Scripts', 'python.exe')
-        
+        # The interpreter running the monitor (the virtual environment's when it is activated) works on every platform
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+
         # Open a null device to suppress output
         with open(os.devnull, 'w') as devnull:
-            # Start the REST API as a subprocess, redirecting stdout and stderr to devnull
-            process = subprocess.Popen([python_executable, 'rest_api.py'], stdout=devnull, stderr=devnull)
-            print(Fore.YELLOW + "[API]" + Fore.WHITE + " REST API started at " + Fore.CYAN + f"http://{FLASK_CONFIG['HOST']}:{FLASK_CONFIG['PORT']}/api/scans" + Fore.WHITE)
+            # Start the API server as a subprocess, redirecting stdout and stderr to devnull
+            process = subprocess.Popen([sys.executable, os.path.join(base_dir, 'api_server.py')], cwd=base_dir, stdout=devnull, stderr=devnull)
+        if not wait_for_api(process, FLASK_CONFIG.get('STARTUP_TIMEOUT', 15)):
+            process.kill()
+            process.wait()
+            raise RuntimeError("the API did not answer its health check")
+        print(Fore.YELLOW + "[API]" + Fore.WHITE + " REST API started at " + Fore.CYAN + f"http://{FLASK_CONFIG['HOST']}:{FLASK_CONFIG['PORT']}/api/scans" + Fore.WHITE)
         api_started = True      # Set the api_started flag to True indicating the API has started
         return 0
     except Exception as e:
-        print(Fore.RED + "[ERR]" + Fore.WHITE + f" Failed to start 'rest_api.py'. {e}")
+        print(Fore.RED + "[ERR]" + Fore.WHITE + f" Failed to start 'api_server.py'. {e}")
         api_started = False     # Set the api_started flag to False indicating the API did not start
         return 1
+
+#-----------------#
+# Polls the API's health endpoint until the started process answers, the process exits or the timeout expires.
+def wait_for_api(api_process, timeout):
+    host = '127.0.0.1' if FLASK_CONFIG['HOST'] in ('0.0.0.0', '', '::') else FLASK_CONFIG['HOST']    # Wildcard binds are reachable on loopback
+    url = f"http://{host}:{FLASK_CONFIG['PORT']}/health"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and api_process.poll() is None:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                health = json.loads(response.read())
+            # Another server already listening on the port answers too; only the started process (or its gunicorn workers) counts
+            if api_process.pid in (health.get('pid'), health.get('ppid')):
+                return api_process.poll() is None
+            log.warning('API', f"Port {FLASK_CONFIG['PORT']} is answered by another process (pid {health.get('pid')}).")
+        except (OSError, ValueError, AttributeError):
+            pass                # Not listening yet
+        time.sleep(0.1)
+    return False
 #-----------------#
 # Helper function to prompt the user for input with exception handling.
 def get_user_input(prompt, default_value=None):
@@ -97,9 +211,12 @@ def terminate_api():
     # Check if the API is currently running
     if api_started:
         try:
-            process.terminate()     # Terminate the API process
-            process.wait()          # Wait for the process to terminate completely
-            time.sleep(5)           # Sleep for a short duration to ensure the process has fully terminated
+            process.terminate()     # Ask the API server to finish its requests and exit
+            try:
+                process.wait(timeout=FLASK_CONFIG.get('GRACEFUL_TIMEOUT', 30))
+            except subprocess.TimeoutExpired:
+                process.kill()      # Requests are still running after the grace period
+                process.wait()
             print(Fore.YELLOW + "[API]" + Fore.WHITE + " REST API process terminated.")
             api_started = False     # Set the api_started flag to False to indicate the API is no longer running
             return 0
@@ -109,21 +226,356 @@ def terminate_api():
             return 1
 #-----------------#
 # Scans the specified network for devices and updates the database with the results.
-def scan_network(network, ports):
-    nm = initialize_nmap()      # Initialize the Nmap scanner
-
-    # Check if the Nmap scanner was initialized successfully
-    if not nm:
+def scan_network(network, ports, stats=None):
+    # Check that Nmap is available before starting any worker processes
+    if not initialize_nmap():
         return                  # Exit the function if initialization failed
-    
-    # Perform the network scan with the specified parameters
-    if not perform_scan(nm, network, ports):
-        return                  # Exit the function if the scan was not successful
-    
+
+    # Split the target into shards that are scanned independently
+    shards = split_targets(network, SCAN_CONFIG.get('SHARD_PREFIX', 24))
+    if not shards:
+        return
+    retries = SCAN_CONFIG.get('SHARD_RETRIES', 1)                       # Number of times a failed shard is scanned again
+    workers = max(1, min(SCAN_CONFIG.get('SCAN_WORKERS', 4), len(shards)))
+    two_phase = SCAN_CONFIG.get('TWO_PHASE', True)                      # Discover live hosts first, then probe versions only where needed
+    streaming = SCAN_CONFIG.get('SCAN_BACKEND', 'stream') == 'stream'   # Parse nmap's XML while it runs instead of buffering it with python-nmap
+    scope = [parse_network(target) for target in network.split()]      # Only devices inside the scanned networks can go down
+
+    found_hosts = set()         # Hosts found across all shards of this cycle
+    failed_shards = []          # Shards that still failed after all retries
+    phase_times = {}            # Accumulated worker time per scan phase
+    lookups = {}                # Reverse DNS futures per shard, started as soon as the shard's hosts are known
+    stats = {name: 0 for name in cycle_stats} if stats is None else stats   # Host counters of this cycle
+    cycle_started = time.perf_counter()
+
     # Use a database connection to process the scan results
     with DatabaseConnection() as cursor:
-        process_scan_results(nm, cursor)    # Process and store the scan results in the database
+        existing = get_device_state(cursor)                             # Warm per-host fingerprints, loaded from the database only once
+        store = lambda records, lookups: store_shard_results(records, cursor, existing, phase_times, lookups, stats)
+        log.info('nmap', f"Scanning {len(shards)} shard(s) with {workers} worker(s)...")
+
+        # nmap always runs in its own process; streamed output is parsed in threads, python-nmap results in worker processes
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='nmap') if streaming else ProcessPoolExecutor(max_workers=workers)
+        with executor as pool:
+            def submit_shard(shard):
+                timing = tuning.tuner.arguments(shard)      # Fixed timing, or adapted to the shard's past scans
+                if streaming:
+                    return submit_nmap_task(pool, stream_shard, shard, ports, store, timing)
+                return submit_nmap_task(pool, scan_shard, shard, ports, timing)
+
+            # Map each running future to its shard, attempt number and the port scan records waiting for version detection
+            pending = {submit_shard(shard): (shard, 0, None) for shard in shards}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    shard, attempt, records = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        log.error('nmap', f"Worker failed on shard {shard}: {e}")
+                        result = None
+
+                    # Version detection finished, merge it into the shard's port scan and store the shard
+                    if records is not None:
+                        if result:
+                            records = merge_version_results(records, result[0])
+                            add_phase_times(phase_times, result[1])
+                        else:
+                            log.error('nmap', f"Version detection failed on shard {shard}, keeping cached fingerprints.")
+                        found_hosts |= store(records, lookups.pop(shard))
+                        continue
+
+                    # Retry a failed shard on its own instead of aborting the whole cycle, with backed off timing in adaptive mode
+                    if result is None:
+                        tuning.tuner.record(shard, None)
+                        if attempt < retries:
+                            log.info('nmap', f"Retrying shard {Fore.GREEN}{shard}{Fore.WHITE} ({attempt + 1}/{retries})...")
+                            pending[submit_shard(shard)] = (shard, attempt + 1, None)
+                        else:
+                            failed_shards.append(shard)
+                        continue
+
+                    output, timings, observation = result
+                    add_phase_times(phase_times, timings)
+                    if observation:
+                        tuning.tuner.record(shard, observation)     # Adapt the shard's timing for its next scan
+
+                    # Streamed shards stored their hosts, including version detection, while nmap was running
+                    if streaming:
+                        found_hosts |= output
+                        continue
+                    records = output
+
+                    # Resolve names in the background while versions are probed and other shards are written
+                    lookups[shard] = get_dns_resolver().start([record.ip for record in records])
+
+                    # Run version detection only on hosts with newly open ports or expired fingerprints
+                    if two_phase:
+                        records, probe_hosts, probe_ports = plan_version_probe(records)
+                        if probe_hosts:
+                            pending[submit_nmap_task(pool, probe_versions, probe_hosts, probe_ports, tuning.tuner.arguments(shard))] = (shard, attempt, records)
+                            continue
+
+                    # Write the shard's results into the database as soon as it finishes
+                    found_hosts |= store(records, lookups.pop(shard))
+
+        # All shards failed, keep the previous state untouched
+        if len(failed_shards) == len(shards):
+            log.error('nmap', "All shards failed, database left unchanged.")
+            return
+
+        # Mark devices missing from this cycle as down
+        with device_state_lock:
+            try:
+                update_device_status(cursor, found_hosts, existing, failed_shards, scope, stats)
+                cursor.connection.commit()
+                notifications.flush()                                   # Send the events of the committed write
+            except Exception:
+                recover_device_state(cursor)
+                raise
+        cycle_stats.update(stats)                                       # Publish the counters of the last finished cycle
+        log.info('db', "Database updated successfully.")
+        log.info('db', "Hosts: " + ', '.join(f"{count} {name}" for name, count in stats.items()))
+        maybe_compact_history(cursor)                                   # Apply the history retention period
+
+        # Record the cycle and share this process' metrics with the API's /metrics endpoint
+        metrics.SCAN_CYCLE_SECONDS.observe(time.perf_counter() - cycle_started)
+        for name, count in stats.items():
+            metrics.SCAN_HOSTS.inc(count, state=name)
+        publish_metrics(cursor)
+
+    # Report where the time of this cycle went
+    timings = ', '.join(f"{phase} {seconds:.1f}s" for phase, seconds in phase_times.items())
+    log.info('nmap', f"Phase timings: {timings} (wall {time.perf_counter() - cycle_started:.1f}s)")
+    pool_stats = db_pool.get_pool().stats()
+    log.info('db', f"Pool: {pool_stats['in_use']} in use, {pool_stats['idle']} idle, {pool_stats['waits']} waits, avg checkout {pool_stats['avg_checkout_seconds'] * 1000:.1f} ms")
     return 0
+
+#-----------------#
+# Submits an nmap task once one of the process-wide nmap slots is free; the slot is released when the task finishes.
+def submit_nmap_task(pool, function, *args):
+    nmap_slots.acquire()        # Released from the executor's callback thread, so waiting here cannot deadlock
+    future = pool.submit(function, *args)
+    future.add_done_callback(lambda _: nmap_slots.release())
+    return future
+
+#-----------------#
+# Writes the host records of a shard, or of a streamed batch, to the database and returns the hosts they contained.
+def store_shard_results(records, cursor, existing, phase_times, lookups, stats=None):
+    # Wait for the reverse DNS names before taking the lock, so a slow resolver only delays this shard and not the writes of the others
+    for record in records:
+        lookups[record.ip].result()
+    # Concurrent shards and scan jobs share the cursor and the device state, so their writes are serialized
+    with device_state_lock:
+        started = time.perf_counter()
+        try:
+            found_hosts = persist_scan_results(records, cursor, existing, lookups, stats)
+            cursor.connection.commit()
+            notifications.flush()           # Send the events of the committed write
+        except Exception:
+            recover_device_state(cursor)
+            raise
+        add_phase_times(phase_times, {'db': time.perf_counter() - started})
+    return found_hosts
+
+#-----------------#
+# Adds the durations of one worker run to the per-phase totals of the cycle.
+def add_phase_times(phase_times, timings):
+    for phase, seconds in timings.items():
+        phase_times[phase] = phase_times.get(phase, 0.0) + seconds
+        metrics.SCAN_PHASE_SECONDS.observe(seconds, phase=phase)       # Per worker run, so slow shards show up in the histogram
+
+#-----------------#
+# Splits space-separated scan targets into IPv4 sub-networks of the given prefix length.
+def split_targets(network, prefix):
+    shards = []
+    for target in network.split():
+        net = parse_network(target)
+        # Hostnames, nmap ranges and networks that are already small enough are scanned as they are
+        if net is None or net.version != 4 or net.prefixlen >= prefix:
+            shards.append(target)
+        else:
+            shards.extend(str(subnet) for subnet in net.subnets(new_prefix=prefix))
+    return shards
+
+#-----------------#
+# Scans a single shard in a worker process and returns its host records with phase timings and the observed timing behaviour,
+# or None if the scan failed.
+def scan_shard(shard, ports, timing=None):
+    nm = initialize_nmap()      # Each worker process uses its own Nmap scanner
+    if not nm:
+        return None
+    observation = tuning.new_observation()
+
+    # Single-phase mode: one version detection scan over the whole shard
+    if not SCAN_CONFIG.get('TWO_PHASE', True):
+        started = time.perf_counter()
+        if not perform_scan(nm, shard, ports, timing=timing):
+            return None
+        observation['duration'] = time.perf_counter() - started
+        nmap_stream.observe_scanner(nm, observation)
+        return nmap_stream.records_from_scanner(nm), {'scan': observation['duration']}, observation
+
+    # Discovery phase: find the live hosts with a ping sweep
+    started = time.perf_counter()
+    live_hosts = discover_hosts(nm, shard, timing)
+    timings = {'discovery': time.perf_counter() - started}
+    if live_hosts is None:
+        return None
+    if not live_hosts:
+        return [], timings, None    # Nothing alive in this shard, nothing to learn from
+
+    # Port phase: check the requested ports on live hosts only, without version detection
+    started = time.perf_counter()
+    if not perform_scan(nm, ' '.join(live_hosts), ports, options='-Pn', label=f"{shard} ({len(live_hosts)} live)", timing=timing):
+        return None
+    timings['ports'] = time.perf_counter() - started
+    observation['duration'] = sum(timings.values())
+    nmap_stream.observe_scanner(nm, observation, len(live_hosts))
+    return nmap_stream.records_from_scanner(nm), timings, observation
+
+#-----------------#
+# Runs version detection on the given hosts and ports in a worker process.
+def probe_versions(hosts, ports, timing=None):
+    nm = initialize_nmap()
+    if not nm:
+        return None
+    started = time.perf_counter()
+    port_list = ','.join(str(port) for port in sorted(ports))
+    if not perform_scan(nm, ' '.join(hosts), port_list, options='-sV -Pn', label=f"{len(hosts)} host(s) for versions", timing=timing):
+        return None
+    return nmap_stream.records_from_scanner(nm), {'version': time.perf_counter() - started}
+
+#-----------------#
+# Scans a single shard in a worker thread, storing hosts in batches while nmap is still running.
+# Returns the stored hosts with phase timings (streamed phases include the interleaved writes) and the observed timing behaviour,
+# or None if the scan failed.
+def stream_shard(shard, ports, store, timing=None):
+    timing = timing or tuning.TUNING_CONFIG['ARGUMENTS']
+    observation = tuning.new_observation()          # Filled in by the port phase while nmap reports hosts
+    timeout = SCAN_CONFIG.get('SCAN_TIMEOUT', 1200)
+    batch_size = SCAN_CONFIG.get('STREAM_BATCH', 64)                    # Hosts written per database round trip
+    two_phase = SCAN_CONFIG.get('TWO_PHASE', True)
+    resolver = get_dns_resolver()
+    found_hosts = set()
+    timings = {}
+    batch = []                  # Records waiting for the next write
+    lookups = {}                # Reverse DNS futures, started as soon as nmap reports a host
+    probe_records, probe_hosts, probe_ports = [], [], set()
+
+    try:
+        targets, options, phase = shard, '-sV', 'scan'
+        if two_phase:
+            # Discovery phase: only the addresses of live hosts are kept
+            log.info('nmap', f"Discovering live hosts on {Fore.GREEN}{shard}{Fore.WHITE}...")
+            started = time.perf_counter()
+            live_hosts = [record.ip for record in nmap_stream.stream_scan(shard, f'-sn {timing}', timeout) if record.state == 'up']
+            timings['discovery'] = time.perf_counter() - started
+            if not live_hosts:
+                return found_hosts, timings, None   # Nothing alive in this shard, nothing to learn from
+            targets, options, phase = ' '.join(live_hosts), '-Pn', 'ports'
+
+        # Port phase: each host is handled as soon as nmap reports it
+        log.info('nmap', f"Starting scan on network {Fore.GREEN}{shard}{Fore.WHITE} with ports {Fore.GREEN}{ports}...")
+        started = time.perf_counter()
+        for record in nmap_stream.stream_scan(targets, f'{options} -p {ports} {timing}', timeout, observation):
+            lookups.update(resolver.start([record.ip]))
+            # Hosts with newly open ports or expired fingerprints wait for version detection, the others are written right away
+            if two_phase:
+                (record,), hosts, record_ports = plan_version_probe([record])
+                if hosts:
+                    probe_records.append(record)
+                    probe_hosts.extend(hosts)
+                    probe_ports |= record_ports
+                    continue
+            batch.append(record)
+            if len(batch) >= batch_size:
+                # Write the hosts whose names are resolved and keep reading nmap's output; wait for the others only once too many are pending
+                ready = batch if len(batch) >= batch_size * 4 else [waiting for waiting in batch if lookups[waiting.ip].done()]
+                if len(ready) >= batch_size:
+                    written = store(ready, lookups)
+                    found_hosts |= written
+                    batch = [waiting for waiting in batch if waiting.ip not in written]
+        if batch:
+            found_hosts |= store(batch, lookups)
+        timings[phase] = time.perf_counter() - started
+        observation['duration'] = sum(timings.values())
+        log.info('nmap', "Scan completed.")
+
+        # Version phase: one probe for the hosts that need it
+        if probe_records:
+            started = time.perf_counter()
+            port_list = ','.join(str(port) for port in sorted(probe_ports))
+            log.info('nmap', f"Starting scan on network {Fore.GREEN}{len(probe_hosts)} host(s) for versions{Fore.WHITE} with ports {Fore.GREEN}{port_list}...")
+            try:
+                version_records = list(nmap_stream.stream_scan(' '.join(probe_hosts), f'-sV -Pn -p {port_list} {timing}', timeout))
+                probe_records = merge_version_results(probe_records, version_records)
+            except nmap_stream.NmapStreamError as e:
+                log.error('nmap', f"Version detection failed on shard {shard}, keeping cached fingerprints: {e}")
+            timings['version'] = time.perf_counter() - started
+            found_hosts |= store(probe_records, lookups)
+        return found_hosts, timings, observation
+    except nmap_stream.NmapStreamError as e:
+        log.error('nmap', f"Error during scanning: {e}")
+        return None
+
+#-----------------#
+# Fills in cached fingerprints and returns the updated records with the hosts and ports that still need version detection.
+def plan_version_probe(records):
+    now = time.time()
+    ttl = SCAN_CONFIG.get('VERSION_TTL', 60) * 60       # Fingerprint lifetime in seconds
+    planned = []
+    probe_hosts = []
+    probe_ports = set()
+
+    for record in records:
+        cached = service_fingerprints.setdefault(record.ip, {})
+        open_ports = set()
+        ports = []
+        for proto, port, state, name, product, version in record.ports:
+            if state == 'open':
+                open_ports.add(port)
+                fingerprint = cached.get(port)
+                # Reuse the last known service details, even if they are about to be refreshed
+                if fingerprint:
+                    name, product, version = fingerprint[1:]
+                # Newly open ports and expired fingerprints need a version probe
+                if fingerprint is None or now - fingerprint[0] > ttl:
+                    probe_ports.add(port)
+                    if not probe_hosts or probe_hosts[-1] != record.ip:
+                        probe_hosts.append(record.ip)
+            ports.append((proto, port, state, name, product, version))
+        planned.append(record._replace(ports=tuple(ports)))
+
+        # Forget ports that are no longer open so they are probed again when they reopen
+        for port in set(cached) - open_ports:
+            del cached[port]
+
+    return planned, probe_hosts, probe_ports
+
+#-----------------#
+# Copies version detection results into the port scan records and refreshes the fingerprint cache.
+def merge_version_results(records, version_records):
+    now = time.time()
+    detected = {record.ip: {(proto, port): (name, product, version) for proto, port, state, name, product, version in record.ports if state == 'open'}
+                for record in version_records}
+    merged = []
+    for record in records:
+        services = detected.get(record.ip)
+        if not services:
+            merged.append(record)
+            continue
+        cached = service_fingerprints.setdefault(record.ip, {})
+        ports = []
+        for proto, port, state, name, product, version in record.ports:
+            # Only ports that were part of the port phase are merged
+            if (proto, port) in services:
+                name, product, version = services[(proto, port)]
+                cached[port] = (now, name, product, version)
+            ports.append((proto, port, state, name, product, version))
+        merged.append(record._replace(ports=tuple(ports)))
+    return merged
+
 #-----------------#
 # Initializes and returns an nmap PortScanner instance.
 def initialize_nmap():
@@ -132,139 +584,368 @@ def initialize_nmap():
         return nmap.PortScanner()       # Return the PortScanner instance if successful
     except Exception as e:
         # Handle the case where Nmap is not installed or another error occurs
-        print(Fore.RED + "[ERR]" + Fore.WHITE + f" nmap not installed. Please install nmap and try again.\nTracelog:\n{e}")
+        log.error('ERR', f"nmap not installed. Please install nmap and try again.\nTracelog:\n{e}")
         return None                     # Return None to indicate that initialization failed
 
 #-----------------#
 # Performs the network scan on the specified network and ports.
-def perform_scan(nm, network, ports):
+def perform_scan(nm, network, ports, options='-sV', label=None, timing=None):
     # Attempt to perform a network scan using the provided Nmap instance
     try:
-        print(Fore.YELLOW + "[nmap]" + Fore.WHITE + f" Starting scan on network {Fore.GREEN}{network}{Fore.WHITE} with ports {Fore.GREEN}{ports}...")
-        # Execute the scan with version detection, specified ports, and a fast timing template
-        nm.scan(hosts=network, arguments=f'-sV -p {ports} -T5 --unprivileged', timeout=1200)
-        print(Fore.YELLOW + "[nmap]" + Fore.WHITE + " Scan completed.")
+        log.info('nmap', f"Starting scan on network {Fore.GREEN}{label or network}{Fore.WHITE} with ports {Fore.GREEN}{ports}...")
+        # Execute the scan with the given scan options (version detection by default), specified ports, and the shard's timing options
+        nm.scan(hosts=network, arguments=f"{options} -p {ports} {timing or tuning.TUNING_CONFIG['ARGUMENTS']}", timeout=SCAN_CONFIG.get('SCAN_TIMEOUT', 1200))
+        log.info('nmap', "Scan completed.")
         return True     # Return True to indicate the scan was successful
     except Exception as e:
         # Print an error message if an exception occurs during the scan
-        print(Fore.RED + "[nmap]" + Fore.WHITE + f" Error during scanning: {e}")
+        log.error('nmap', f"Error during scanning: {e}")
         return False    # Return False to indicate the scan failed
 
+#-----------------#
+# Runs a ping sweep over the network and returns the live hosts, or None if the sweep failed.
+def discover_hosts(nm, network, timing=None):
+    try:
+        log.info('nmap', f"Discovering live hosts on {Fore.GREEN}{network}{Fore.WHITE}...")
+        nm.scan(hosts=network, arguments=f"-sn {timing or tuning.TUNING_CONFIG['ARGUMENTS']}", timeout=SCAN_CONFIG.get('SCAN_TIMEOUT', 1200))
+        return [host for host in nm.all_hosts() if nm[host].state() == 'up']
+    except Exception as e:
+        log.error('nmap', f"Error during host discovery: {e}")
+        return None
+
 #-----------------#
 # Processes scan results and updates the database with device information.
 def process_scan_results(nm, cursor):
+    reset_cycle_stats()
+    records = nmap_stream.records_from_scanner(nm)              # Compact per-host records of the PortScanner results
+    existing = load_existing_devices(cursor)                    # Preload all known devices once instead of one SELECT per host
+    found_hosts = persist_scan_results(records, cursor, existing)   # Write new and changed devices with one batched upsert
+    update_device_status(cursor, found_hosts, existing)         # Mark devices missing from this scan as down
+    cursor.connection.commit()                                  # Commit the changes to the database
+    notifications.flush()                                       # Send the committed change events to the webhooks
+    log.info('db', "Database updated successfully.")
+
+#-----------------#
+# Loads every known device from the database into a dictionary keyed by IP.
+def load_existing_devices(cursor):
+    cursor.execute("SELECT ip, status, fingerprint, domain FROM scans")
+    # Map each IP to the (status, fingerprint, domain) tuple currently stored for it
+    return {ip: (status, fingerprint, domain) for ip, status, fingerprint, domain in cursor.fetchall()}
+
+#-----------------#
+# Returns the shared device state, loading it from the database if it is not warm yet.
+def get_device_state(cursor):
+    global device_state_loaded
+    with device_state_lock:
+        if not device_state_loaded:
+            device_state.clear()
+            device_state.update(load_existing_devices(cursor))
+            device_state_loaded = True
+        return device_state
+
+#-----------------#
+# Rolls back a failed write and reloads the device state so it matches the database again.
+def recover_device_state(cursor):
+    global device_state_loaded
+    with device_state_lock:
+        device_state.clear()            # An empty state makes every host look new, which is safe until it is reloaded
+        device_state_loaded = False
+        notifications.discard()         # Events of the rolled back write are not sent
+        try:
+            cursor.connection.rollback()
+            get_device_state(cursor)
+        except Exception as e:
+            log.error('db', f"Device state will be reloaded on the next cycle: {e}")
+
+#-----------------#
+# Sets the per-cycle host counters back to zero.
+def reset_cycle_stats():
+    for name in cycle_stats:
+        cycle_stats[name] = 0
+
+#-----------------#
+# Collects new and changed devices from the scan results and writes them in a single batch.
+def persist_scan_results(records, cursor, existing, lookups=None, stats=None):
 
     # Initialize a set to keep track of found hosts
     found_hosts = set()
+    rows = []                           # Rows (ip, status, device_info, domain, fingerprint) that need to be written
+    port_rows = []                      # Rows (ip, proto, port, state, service, product, version) of the written hosts
+    stats = cycle_stats if stats is None else stats     # Host counters to update
+
+    # Start reverse DNS lookups for all hosts unless the caller already started them
+    if lookups is None:
+        lookups = get_dns_resolver().start([record.ip for record in records])
 
     # Iterate over all hosts found in the Nmap scan results
-    for host in nm.all_hosts():
-        status = nm[host].state()       # Get the current state of the host (up or down)
+    for record in records:
+        host = record.ip
+        status = record.state           # Get the current state of the host (up or down)
+        fingerprint = get_fingerprint(record)          # Hash of the normalized port/state/service tuples
+        address = lookups[host].result() or "None"     # Wait for the reverse DNS lookup started above
+        found_hosts.add(host)           # Add the host to the set of found hosts
+
+        # Unchanged devices skip JSON building and the database write entirely
+        previous = existing.get(host)
+        if previous == (status, fingerprint, address):
+            stats['unchanged'] += 1
+            continue
+        stats['new' if previous is None else 'changed'] += 1
+
         # Retrieve device information and port status as a JSON string
-        device_info_json, ports_status_str = get_device_info_json(nm, host)
-        print(Fore.YELLOW + "[nmap]" + Fore.WHITE + f" Found device: " + Fore.CYAN + f"{host} | " + Fore.WHITE + f"Ports: [{ports_status_str}" + Fore.WHITE + "]")
-        try:    
-            addr = socket.gethostbyaddr(host)
-            address = addr[0]
-            print(Fore.YELLOW + "[socket]" + Fore.WHITE + f"Found domain name {addr[0]} on host {host}")
-        except:
-            address = "None"
-            print(Fore.YELLOW + "[socket]" + Fore.WHITE + f"No domain name found on host {host}")
-        # Check if the device is already in the database
-        cursor.execute("SELECT device_info FROM scans WHERE ip = %s", (host,))
-        result = cursor.fetchone()
-
-        # If the device exists in the database, update its information
-        if result:
-            update_device_info(cursor, status, device_info_json, host, result[0], address)
-        # If the device does not exist, insert new device information
-        else:
-            insert_device_info(cursor, status, device_info_json, host, address)
+        device_info_json, ports_status_str = get_device_info_json(record)
+        log.info('nmap', f"Found device: " + Fore.CYAN + f"{host} | " + Fore.WHITE + f"Ports: [{ports_status_str}" + Fore.WHITE + "]")
+        rows.append((host, status, device_info_json, address, fingerprint))
+        port_rows.extend((host, proto, port, state, name[:64], product[:128], version[:128])     # Truncated to the column sizes
+                         for proto, port, state, name, product, version in record.ports)
 
-        found_hosts.add(host)           # Add the host to the set of found hosts
+    resolved = sum(1 for host in found_hosts if lookups[host].result())
+    log.info('socket', f"Found domain names for {resolved} of {len(found_hosts)} hosts.")
+
+    # The stored rows decide what is known, since the collector may have written hosts this process has not seen
+    stored = load_device_info(cursor, [row[0] for row in rows])
+    sync_host_ports(cursor, rows, port_rows, stored)
+    upsert_device_info(cursor, rows, existing, stored)
+    return found_hosts
 
-    update_device_status(cursor, found_hosts)   # Update the status of all found hosts in the database
-    cursor.connection.commit()                  # Commit the changes to the database
-    print(Fore.YELLOW + "[db]" + Fore.WHITE + " Database updated successfully.")
+#-----------------#
+# Returns the shared reverse DNS resolver, creating it from the scan settings on first use.
+def get_dns_resolver():
+    global dns_resolver
+    with device_state_lock:             # Concurrent scan jobs must not create two resolvers
+        if dns_resolver is None:
+            dns_resolver = DnsResolver(
+                workers=SCAN_CONFIG.get('DNS_WORKERS', 32),
+                ttl=SCAN_CONFIG.get('DNS_TTL', 60) * 60,                # Minutes to seconds
+                negative_ttl=SCAN_CONFIG.get('DNS_NEGATIVE_TTL', 10) * 60,
+                max_size=SCAN_CONFIG.get('DNS_CACHE_SIZE', 65536)
+            )
+        return dns_resolver
+
+#-----------------#
+# Returns a compact fingerprint of a host's hostname and normalized port/state/service tuples.
+def get_fingerprint(record):
+    # The list repr keeps fingerprints stored by earlier versions valid
+    return hashlib.blake2b(repr((record.hostname, list(record.ports))).encode(), digest_size=8).hexdigest()
 
 #-----------------#
 # Collects device information and returns it as a JSON string.
-def get_device_info_json(nm, host):
+def get_device_info_json(record):
 
     # Initialize a dictionary to store device information
     device_info = {
-        'hostname': nm[host].hostname(),    # Get the hostname of the device
+        'hostname': record.hostname,        # Get the hostname of the device
         'ports': []                         # Initialize an empty list to store port information
     }
 
     ports_status = []                       # Initialize a list to store the status of the ports
 
-    # Iterate over all protocols available for the host
-    for proto in nm[host].all_protocols():
-        port_list = nm[host][proto].keys()  # Get the list of ports for the current protocol
-        # Iterate over each port in the port list
-        for port in port_list:
-            # Create a dictionary to store information about the port
-            port_info = {
-                'port': port,                                           # Port number
-                'state': nm[host][proto][port]['state'],                # State of the port (open, closed, filtered)
-                'name': nm[host][proto][port]['name'],                  # Name of the service running on the port
-                'product': nm[host][proto][port].get('product', ''),    # Product name (if available)
-                'version': nm[host][proto][port].get('version', '')     # Version of the product (if available)
-            }
-            # Append the port information to the device_info dictionary
-            device_info['ports'].append(port_info)
-
-            # Append the port status to the ports_status list with color coding
-            if port_info['state'] == 'open':
-                ports_status.append(Fore.GREEN + str(port))     # Open ports in green
-            elif port_info['state'] == 'filtered':
-                ports_status.append(Fore.YELLOW + str(port))    # Open ports in green
-            elif port_info['state'] == 'closed':
-                ports_status.append(Fore.RED + str(port))       # Closed ports in red
-    
+    # One pass over the host's (proto, port, state, name, product, version) tuples
+    for proto, port, state, name, product, version in record.ports:
+        # Append the port information to the device_info dictionary; the protocol keeps UDP results apart in exports
+        device_info['ports'].append({'proto': proto, 'port': port, 'state': state, 'name': name, 'product': product, 'version': version})
+
+        # Append the port status to the ports_status list with color coding
+        if state == 'open':
+            ports_status.append(Fore.GREEN + str(port))     # Open ports in green
+        elif state == 'filtered':
+            ports_status.append(Fore.YELLOW + str(port))    # Filtered ports in yellow
+        elif state == 'closed':
+            ports_status.append(Fore.RED + str(port))       # Closed ports in red
+
     ports_status_str = ','.join(ports_status)           # Join the port status list into a single string
 
     return json.dumps(device_info), ports_status_str    # Return the device information as a JSON string and the port status string
 
 #-----------------#
-# Updates existing device information in the database if it has changed.
-def update_device_info(cursor, status, device_info_json, host, existing_info, address):
-    # Check if the existing device information is different from the new information
-    if existing_info != device_info_json:
-        # Execute an SQL UPDATE statement to update the device's status and information in the database
-        cursor.execute(
-            "UPDATE scans SET status = %s, device_info = %s, timestamp = CURRENT_TIMESTAMP, domain = %s WHERE ip = %s",
-            (status, device_info_json, host, address)    # Parameters for the SQL query
+# Inserts new devices and updates changed ones with a single batched INSERT ... ON DUPLICATE KEY UPDATE.
+def upsert_device_info(cursor, rows, existing, stored):
+    # Nothing to write if every device is unchanged
+    if not rows:
+        return
+
+    # executemany folds the rows into multi-row INSERT statements; requires the unique index on scans.ip
+    cursor.executemany(
+        "INSERT INTO scans (ip, status, device_info, domain, fingerprint) VALUES (%s, %s, %s, %s, %s) "
+        "ON DUPLICATE KEY UPDATE status = VALUES(status), device_info = VALUES(device_info), "
+        "domain = VALUES(domain), fingerprint = VALUES(fingerprint), timestamp = CURRENT_TIMESTAMP",
+        rows
+    )
+    inserted = sum(1 for row in rows if row[0] not in stored)       # Count devices that were not in the database before
+
+    # Record what changed compared to the stored state and keep the preloaded state in sync with what was written
+    events = []
+    for host, status, device_info_json, address, fingerprint in rows:
+        previous = stored.get(host)     # (status, device_info) before this write, read before it was overwritten
+        events.extend(history.diff_device_info(host, previous, status, device_info_json))
+        existing[host] = (status, fingerprint, address)
+    history.record_events(cursor, events)
+    notifications.stage(events)         # Sent to the webhooks once the write commits
+    bump_scan_generation(cursor)        # Invalidate cached API responses once this write commits
+    log.info('db', "Inserted " + Fore.GREEN + f"{inserted}" + Fore.WHITE + ", updated " + Fore.GREEN + f"{len(rows) - inserted}" + Fore.WHITE + " devices.")
+
+#-----------------#
+# Replaces the rows of the written devices in the normalized host_ports table with two batched statements.
+def sync_host_ports(cursor, rows, port_rows, stored):
+    if not rows:
+        return
+
+    # Ports of stored devices are replaced as a whole, so ports that are no longer reported disappear
+    known = [row[0] for row in rows if row[0] in stored]
+    if known:
+        placeholders = ', '.join(['%s'] * len(known))
+        cursor.execute(f"DELETE FROM host_ports WHERE ip IN ({placeholders})", known)
+    if port_rows:
+        cursor.executemany(
+            "INSERT INTO host_ports (ip, proto, port, state, service, product, version) VALUES (%s, %s, %s, %s, %s, %s, %s)",
+            port_rows
         )
-        print(Fore.YELLOW + "[db]" + Fore.WHITE + " Updated information about " + Fore.GREEN + f"{host}")
 
 #-----------------#
-# Inserts new device information into the database.
-def insert_device_info(cursor, status, device_info_json, host, address):
-    # Execute an SQL INSERT statement to add a new device's information to the database
-    cursor.execute(
-        "INSERT INTO scans (ip, status, device_info, domain) VALUES (%s, %s, %s, %s)",
-        (host, status, device_info_json, address)        # Parameters for the SQL query
-    )
-    print(Fore.YELLOW + "[db]" + Fore.WHITE + " Inserted information about " + Fore.GREEN + f"{host}")
+# Reads the stored status and device information of the given IPs with one query.
+def load_device_info(cursor, ips):
+    if not ips:
+        return {}
+    placeholders = ', '.join(['%s'] * len(ips))
+    cursor.execute(f"SELECT ip, status, device_info FROM scans WHERE ip IN ({placeholders})", ips)
+    return {ip: (status, device_info) for ip, status, device_info in cursor.fetchall()}
 
 #-----------------#
 # Updates the status of devices that were not found in the current scan.
-def update_device_status(cursor, found_hosts):
-    # Execute an SQL SELECT statement to retrieve all IP addresses from the scans table
-    cursor.execute("SELECT ip FROM scans")
-    all_hosts = cursor.fetchall()       # Fetch all results from the executed query
-    
-    # Iterate over each IP address retrieved from the database
-    for (ip,) in all_hosts:
-        # Check if the current IP address is not in the list of found hosts
-        if ip not in found_hosts:
-            # Execute an SQL UPDATE statement to set the status of the device to 'down'
-            cursor.execute(
-                "UPDATE scans SET status = 'down' WHERE ip = %s",
-                (ip,)                   # Parameter for the SQL query
-            )
+def update_device_status(cursor, found_hosts, existing, failed_shards=(), scope=None, stats=None):
+    # Devices inside shards that failed to scan keep their last known status
+    failed_networks = [parse_network(shard) for shard in failed_shards]
+    if None in failed_networks:
+        log.info('db', "A non-CIDR shard failed, device statuses were left unchanged.")
+        return
+
+    # Collect the known devices inside the scanned networks that were not found and are not already marked as down
+    # A range or hostname target cannot be matched against addresses, so then every known device is in scope as before scoping existed
+    scope_networks = None if scope is None or None in scope else scope
+    missing = [ip for ip, (status, _, _) in existing.items()
+               if ip not in found_hosts and status != 'down' and not in_networks(ip, failed_networks)
+               and (scope_networks is None or in_networks(ip, scope_networks))]
+    (cycle_stats if stats is None else stats)['gone'] += len(missing)
+    if not missing:
+        return
+
+    # Mark all missing devices as down with one set-based statement
+    placeholders = ', '.join(['%s'] * len(missing))
+    cursor.execute(f"UPDATE scans SET status = 'down' WHERE ip IN ({placeholders})", missing)
+
+    # Record the transitions and keep the preloaded state in sync with the database
+    events = [(ip, history.EVENT_TYPES['host_down'], None, None) for ip in missing]
+    history.record_events(cursor, events)
+    notifications.stage(events)
+    bump_scan_generation(cursor)
+    for ip in missing:
+        _, fingerprint, domain = existing[ip]
+        existing[ip] = ('down', fingerprint, domain)
+
+#-----------------#
+# Stores this process' metrics for the API; installations without the scan_metrics table only lose the scanner metrics.
+def publish_metrics(cursor):
+    pool_stats = db_pool.get_pool().stats()
+    metrics.POOL_CONNECTIONS.set(pool_stats['in_use'], state='in_use')
+    metrics.POOL_CONNECTIONS.set(pool_stats['idle'], state='idle')
+    try:
+        metrics.publish(cursor, 'scanner')
+        cursor.connection.commit()
+    except pymysql.err.Error as e:
+        log.warning('metrics', f"Unable to publish scanner metrics: {e}")
+
+#-----------------#
+# Advances the commit generation so the API drops cached responses built from older data.
+def bump_scan_generation(cursor):
+    cursor.execute("UPDATE scan_meta SET generation = generation + 1 WHERE id = 1")
+
+#-----------------#
+# Removes expired history events at most once per hour.
+def maybe_compact_history(cursor):
+    global last_history_compaction
+    if time.time() - last_history_compaction < 3600:
+        return
+    history.compact_history(cursor, SCAN_CONFIG.get('HISTORY_RETENTION_DAYS', 90))
+    last_history_compaction = time.time()
+
+#-----------------#
+# Parses a scan target as an IP network, returning None for hostnames and nmap ranges.
+def parse_network(target):
+    try:
+        return ipaddress.ip_network(target, strict=False)
+    except ValueError:
+        return None
+
+#-----------------#
+# Checks whether an IP address belongs to any of the given networks.
+def in_networks(ip, networks):
+    if not networks:
+        return False
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return False
+    return any(address in network for network in networks)
+
+#-----------------#
+# Loads a scans export or a saved nmap XML report into the scans table in batches of IMPORT_BATCH hosts, without rescanning.
+def import_scan_file(path):
+    batch_size = export.EXPORT_CONFIG['IMPORT_BATCH']
+    stats = {name: 0 for name in cycle_stats}
+    phase_times = {}
+    imported = 0
+    with DatabaseConnection() as cursor:
+        existing = get_device_state(cursor)
+
+        def store(batch):
+            # The names come from the file, so no reverse DNS lookups are made
+            lookups = {}
+            for record, domain in batch:
+                lookups[record.ip] = Future()
+                lookups[record.ip].set_result(domain)
+            store_shard_results([record for record, _ in batch], cursor, existing, phase_times, lookups, stats)
+
+        batch = []
+        for item in export.read_records(path):
+            batch.append(item)
+            if len(batch) == batch_size:
+                store(batch)
+                imported += len(batch)
+                batch = []
+        if batch:
+            store(batch)
+            imported += len(batch)
+    log.info('import', f"Imported {imported} hosts from {path}: " + Fore.GREEN + f"{stats['new']}" + Fore.WHITE + " new, " +
+             Fore.GREEN + f"{stats['changed']}" + Fore.WHITE + f" changed, {stats['unchanged']} unchanged in {phase_times.get('db', 0.0):.1f}s.")
+    return imported
+
+#-----------------#
+# Exports a dataset to a file or imports a file, reporting errors instead of raising them; returns 0 on success.
+def run_transfer(export_path=None, import_path=None, dataset='scans', since=None):
+    try:
+        if export_path:
+            rows = export.export_file(export_path, dataset, export.parse_since(since))
+            log.info('export', f"Exported {rows} {dataset} rows to {export_path}.")
+        if import_path:
+            import_scan_file(import_path)
+    except (export.ExportError, ValueError, OSError, pymysql.err.Error) as e:
+        log.error('export', f"{e}")
+        return 1
+    return 0
+
+#-----------------#
+# Runs the configured scan jobs headless until SIGTERM or Ctrl+C.
+def run_daemon(with_api=True):
+    if with_api:
+        start_api()             # Start the API, which shows job status and accepts run requests
+    daemon = scheduler.create_scheduler(scan_network)
+    signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())     # Stop cleanly when a service manager stops the daemon
+    try:
+        daemon.run_forever()
+    except KeyboardInterrupt:
+        print(Fore.YELLOW + "\nScheduler interrupted by user. Exiting...")
+    finally:
+        terminate_api()         # Terminate the API process if running
 
 #-----------------#
 # Configures database and other settings based on user input.
@@ -312,11 +993,13 @@ def configure_settings():
             "PATH": venv_path
         },
         "FLASK_CONFIG": {
+            **FLASK_CONFIG,                             # Keep advanced API settings that are not prompted for
             "HOST": flask_host,
             "PORT": flask_port,
             "DEBUG": flask_debug
         },
         "SCAN_CONFIG": {
+            **SCAN_CONFIG,                              # Keep advanced scan settings that are not prompted for
             "DEFAULT_NETWORK": default_network,
             "DEFAULT_PORTS": default_ports,
             "DEFAULT_INTERVAL": default_interval
@@ -332,9 +1015,15 @@ def configure_settings():
         config_file.write(json.dumps(config_data["VENV"], indent=4))            # Write VENV section
         config_file.write("\n\n")
         config_file.write("FLASK_CONFIG = ")
-        config_file.write(f"{{'HOST': '{flask_host}', 'PORT': {flask_port}, 'DEBUG': {str(flask_debug).capitalize()}}}\n")  # Write FLASK_CONFIG section
+        config_file.write(pprint.pformat(config_data["FLASK_CONFIG"], sort_dicts=False) + "\n")    # Write FLASK_CONFIG section (Python literals for booleans)
         config_file.write("\nSCAN_CONFIG = ")
-        config_file.write(json.dumps(config_data["SCAN_CONFIG"], indent=4))     # Write SCAN_CONFIG section
+        config_file.write(pprint.pformat(config_data["SCAN_CONFIG"], sort_dicts=False))           # Write SCAN_CONFIG section
+
+        # Carry over the remaining settings sections (e.g. POOL_CONFIG) unchanged
+        for name in dir(config):
+            if name.isupper() and name not in config_data:
+                config_file.write(f"\n\n{name} = ")
+                config_file.write(pprint.pformat(getattr(config, name), sort_dicts=False))
 
     print(Fore.GREEN + "[Config]" + Fore.WHITE + " Configuration saved to config.py.")
 
@@ -342,12 +1031,27 @@ def configure_settings():
 # Main execution block to handle user input and initiate scanning or configuration.
 if __name__ == "__main__":
 
+    # Headless mode runs the scan jobs from SCHEDULER_CONFIG without prompting
+    parser = argparse.ArgumentParser(description="Network monitor")
+    parser.add_argument('--daemon', action='store_true', help="run the configured scan jobs without prompts")
+    parser.add_argument('--no-api', action='store_true', help="do not start the REST API in daemon mode")
+    parser.add_argument('--export', metavar='FILE', help="export a dataset to FILE (.ndjson, .csv or .parquet, optionally .gz or .zst) and exit")
+    parser.add_argument('--dataset', choices=tuple(export.DATASETS), default='scans', help="dataset written by --export")
+    parser.add_argument('--since', help="only export rows written at or after this ISO date or time")
+    parser.add_argument('--import', dest='import_file', metavar='FILE', help="load a scans export or nmap XML report into the database and exit")
+    args = parser.parse_args()
+    if args.export or args.import_file:
+        raise SystemExit(run_transfer(args.export, args.import_file, args.dataset, args.since))
+    if args.daemon:
+        run_daemon(with_api=not args.no_api)
+        raise SystemExit(0)
+
     # Start of the main program execution
     try:
         # Infinite loop to continuously prompt the user for an action
         while True:
             # Get user input for choosing an option (configure or scan)
-            choice = get_user_input("Choose an option:\n1. Configure\n2. Scan\nEnter your choice: ", "2")
+            choice = get_user_input("Choose an option:\n1. Configure\n2. Scan\n3. Export\n4. Import\nEnter your choice: ", "2")
             if choice is None:
                 break                   # Exit the loop if no choice is made
             # If the user chooses to configure settings
@@ -364,20 +1068,33 @@ if __name__ == "__main__":
                 try:
                     # Infinite loop to perform scanning at specified intervals
                     while True:
+                        started = time.monotonic()
                         scan_network(network, ports)        # Perform the network scan
-                        wait_time = float(interval) * 60    # Calculate wait time in seconds
+                        wait_time = max(0.0, float(interval) * 60 - (time.monotonic() - started))  # Fixed rate: the scan time counts towards the interval
                         if interval < 1:
-                            print(Fore.YELLOW + "[Info]" + Fore.WHITE + f" Waiting for {wait_time} seconds before next scan...")
+                            print(Fore.YELLOW + "[Info]" + Fore.WHITE + f" Waiting for {wait_time:.0f} seconds before next scan...")
                         else:
-                            print(Fore.YELLOW + "[Info]" + Fore.WHITE + f" Waiting for {wait_time / 60} minutes before next scan...")
+                            print(Fore.YELLOW + "[Info]" + Fore.WHITE + f" Waiting for {wait_time / 60:.1f} minutes before next scan...")
                         time.sleep(wait_time)               # Wait for the specified interval before the next scan
                 except KeyboardInterrupt:
                     # Handle the case where the scan is interrupted by the user
                     print(Fore.YELLOW + "\nScan interrupted by user. Exiting...")
                     terminate_api()                         # Terminate the API process if running
+            # If the user chooses to export the inventory or its history
+            elif choice == "3":
+                dataset = get_user_input("Dataset to export (scans or events) " + Fore.CYAN + "(default: scans): " + Fore.WHITE, "scans")
+                path = get_user_input("Export file (.ndjson, .csv or .parquet, optionally .gz or .zst) " + Fore.CYAN + f"(default: {dataset}.ndjson.gz): " + Fore.WHITE, f"{dataset}.ndjson.gz")
+                since = get_user_input("Only rows written since (YYYY-MM-DD, empty for all): ", "")
+                if dataset and path:
+                    run_transfer(export_path=path, dataset=dataset, since=since)
+            # If the user chooses to load an earlier export or an nmap XML report
+            elif choice == "4":
+                path = get_user_input("File to import (scans export or nmap XML report): ")
+                if path:
+                    run_transfer(import_path=path)
             else:
                 # Handle invalid user input
-                print(Fore.RED + "[ERR]" + Fore.WHITE + " Invalid choice. Please enter 1 or 2.")
+                print(Fore.RED + "[ERR]" + Fore.WHITE + " Invalid choice. Please enter 1, 2, 3 or 4.")
     except KeyboardInterrupt:
         # Handle the case where the program is interrupted by the user
         print("\nProgram interrupted by user. Exiting...")
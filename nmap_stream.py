@@ -0,0 +1,154 @@
+#-----------------#
+# Imported modules
+import subprocess                           # Import subprocess for running nmap with its XML output on a pipe
+import shlex                                # Import shlex for splitting nmap arguments like python-nmap does
+import shutil                               # Import shutil for locating the nmap executable
+import os                                   # Import os for checking the default install locations
+import threading                            # Import threading for the scan timeout and the stderr reader
+import xml.etree.ElementTree as ET          # Import ElementTree for parsing nmap's XML incrementally
+from collections import namedtuple          # Import namedtuple for the compact per-host records
+
+#-----------------#
+# Compact result of one host: ports is a sorted tuple of (proto, port, state, name, product, version)
+HostRecord = namedtuple('HostRecord', 'ip state hostname ports')
+
+# Places nmap is installed to when it is not on the PATH
+NMAP_PATHS = ('/usr/bin/nmap', '/usr/local/bin/nmap', '/opt/local/bin/nmap', '/sw/bin/nmap',
+              'C:\\Program Files (x86)\\Nmap\\nmap.exe', 'C:\\Program Files\\Nmap\\nmap.exe')
+
+#-----------------#
+# Raised when nmap cannot be started, fails, times out or writes invalid XML.
+class NmapStreamError(Exception):
+    pass
+
+#-----------------#
+# Returns the path of the nmap executable, or None if it is not installed.
+def find_nmap():
+    return shutil.which('nmap') or next((path for path in NMAP_PATHS if os.path.isfile(path)), None)
+
+#-----------------#
+# Runs nmap with XML output on stdout and yields one HostRecord per host as nmap reports it.
+# Timeouts, unanswered probes and host durations are added to observation if one is given.
+def stream_scan(hosts, arguments, timeout=None, observation=None):
+    nmap_path = find_nmap()
+    if nmap_path is None:
+        raise NmapStreamError("nmap program was not found")
+    command = [nmap_path, '-oX', '-'] + shlex.split(arguments) + shlex.split(hosts)
+    try:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError as e:
+        raise NmapStreamError(f"Unable to start nmap: {e}")
+
+    # Drain stderr in the background so a chatty nmap cannot block on a full pipe
+    errors = []
+    stderr_reader = threading.Thread(target=lambda: errors.append(process.stderr.read().decode(errors='replace')), daemon=True)
+    stderr_reader.start()
+    timed_out = threading.Event()
+    timer = threading.Timer(timeout, lambda: (timed_out.set(), process.kill())) if timeout else None
+    if timer:
+        timer.start()
+
+    try:
+        yield from iter_hosts(process.stdout, observation)
+    except ET.ParseError as e:
+        if not timed_out.is_set():
+            process.kill()
+            raise NmapStreamError(f"Invalid nmap XML output: {e}")
+    finally:
+        if timer:
+            timer.cancel()
+        if process.poll() is None:
+            process.kill()                      # The consumer stopped early
+        process.wait()
+        process.stdout.close()
+        stderr_reader.join()
+        process.stderr.close()
+
+    if timed_out.is_set():
+        raise NmapStreamError(f"nmap timed out after {timeout} seconds")
+    if process.returncode != 0:
+        raise NmapStreamError(f"nmap exited with code {process.returncode}: {''.join(errors).strip()}")
+
+#-----------------#
+# Yields one HostRecord per <host> element of nmap XML read from a binary file object, a pipe or a saved -oX report.
+def iter_hosts(source, observation=None):
+    root = None
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = elem                     # <nmaprun>, kept only to drop finished hosts from it
+            continue
+        if elem.tag == 'host':
+            record = parse_host(elem)
+            if observation is not None:
+                observe_host(elem, observation)
+            root.clear()                        # Memory stays bounded by the host being parsed
+            if record is not None:
+                yield record
+
+#-----------------#
+# Builds a HostRecord from a finished <host> element.
+def parse_host(elem):
+    ip = None
+    for address in elem.iter('address'):
+        if address.get('addrtype') in ('ipv4', 'ipv6'):
+            ip = address.get('addr')
+            break
+    if ip is None:
+        return None
+    status = elem.find('status')
+
+    # Same choice as python-nmap: a user-supplied name first, otherwise the first one reported
+    names = [(hostname.get('type'), hostname.get('name', '')) for hostname in elem.iter('hostname')]
+    hostname = next((name for kind, name in names if kind == 'user'), names[0][1] if names else '')
+
+    ports = []
+    for port in elem.iter('port'):
+        state = port.find('state')
+        service = port.find('service')
+        service = service.attrib if service is not None else {}
+        ports.append((port.get('protocol'), int(port.get('portid')), state.get('state') if state is not None else '',
+                      service.get('name', ''), service.get('product', ''), service.get('version', '')))
+    return HostRecord(ip, status.get('state') if status is not None else 'up', hostname, tuple(sorted(ports)))
+
+#-----------------#
+# Adds what a finished <host> element says about the scan's timing to an observation.
+def observe_host(elem, observation):
+    observation['hosts'] += 1
+    if elem.get('timedout') == 'true':
+        observation['timeouts'] += 1                # nmap gave up on the host after --host-timeout
+    if elem.get('starttime') and elem.get('endtime'):
+        observation['slowest_host'] = max(observation['slowest_host'], int(elem.get('endtime')) - int(elem.get('starttime')))
+    # Probes that got no answer after every retransmission, listed per port or summarized for the ports nmap did not list
+    for state in elem.iter('state'):
+        observation['probes'] += 1
+        observation['no_response'] += state.get('reason') == 'no-response'
+    for reason in elem.iter('extrareasons'):
+        count = int(reason.get('count', 0))
+        observation['probes'] += count
+        observation['no_response'] += count if reason.get('reason') == 'no-response' else 0
+
+#-----------------#
+# Adds the timeouts and unanswered probes of a finished python-nmap PortScanner to an observation.
+def observe_scanner(nm, observation, expected_hosts=0):
+    hosts = nm.all_hosts()
+    observation['hosts'] += max(len(hosts), expected_hosts)
+    observation['timeouts'] += max(0, expected_hosts - len(hosts))     # Live hosts missing from the results timed out
+    for host in hosts:
+        for proto in nm[host].all_protocols():
+            for port_info in nm[host][proto].values():
+                observation['probes'] += 1
+                observation['no_response'] += port_info.get('reason') == 'no-response'
+
+#-----------------#
+# Converts the results of a finished python-nmap PortScanner into HostRecords.
+def records_from_scanner(nm):
+    records = []
+    for host in nm.all_hosts():
+        ports = sorted(
+            (proto, port, port_info['state'], port_info['name'], port_info.get('product', ''), port_info.get('version', ''))
+            for proto in nm[host].all_protocols()
+            for port, port_info in nm[host][proto].items()
+        )
+        records.append(HostRecord(host, nm[host].state(), nm[host].hostname(), tuple(ports)))
+    return records
@@ -0,0 +1,308 @@
+#-----------------#
+# Imported modules
+import json                                 # Import json for webhook payloads and Server-Sent Events
+import queue                                # Import queue for the webhook queue and the per-client event queues
+import random                               # Import random for the jitter of the webhook retry delays
+import threading                            # Import threading for the webhook sender and the event poller
+import time                                 # Import time for batching and backoff
+import urllib.request                       # Import urllib.request for posting webhook batches
+import ipaddress                            # Import ipaddress for the ip filter of event streams
+from datetime import datetime, timezone     # Import datetime for the timestamps of webhook events
+import config                               # Import config to read the optional NOTIFY_CONFIG section
+import db_pool                              # Import db_pool for tailing the scan_events table in the API
+import history                              # Import history for the event names
+from logger import log                      # Import log for leveled, rate-limited console output
+
+#-----------------#
+# Notification settings with defaults for installations whose config.py has no NOTIFY_CONFIG yet
+NOTIFY_CONFIG = {
+    'WEBHOOKS': [],             # URLs that receive batches of change events as POST {"events": [...]}
+    'BATCH_SIZE': 100,          # Events per webhook request
+    'BATCH_INTERVAL': 2,        # Seconds the first event of a batch waits for more events
+    'RETRIES': 5,               # Attempts per batch and URL after the first one
+    'BACKOFF': 1,               # Delay before the first retry in seconds, doubled after every failure
+    'MAX_BACKOFF': 60,
+    'QUEUE_SIZE': 10000,        # Events waiting for delivery; newer events are dropped while it is full
+    'TIMEOUT': 5,               # Seconds per webhook request
+    'POLL_INTERVAL': 1,         # Seconds between reads of new events by the API's event stream
+    'STREAM_QUEUE_SIZE': 1000,  # Events buffered per stream client; a client that falls behind is disconnected and resumes
+    'KEEPALIVE': 15,            # Seconds between keep-alive comments on idle streams
+    'MAX_STREAMS': 4            # Open event streams per API process, each one occupies a server thread
+}
+NOTIFY_CONFIG.update(getattr(config, 'NOTIFY_CONFIG', {}))
+
+#-----------------#
+# Builds the JSON form of a change event.
+def event_dict(ip, event, port, detail, event_id=None, timestamp=None):
+    return {'id': event_id, 'timestamp': timestamp, 'ip': ip, 'event': history.EVENT_NAMES.get(event, event), 'port': port, 'detail': detail}
+
+#-----------------#
+# Sends change events to the configured webhooks in batches from a background thread, retrying with exponential backoff.
+class WebhookDispatcher:
+
+    def __init__(self, urls, batch_size=100, batch_interval=2, retries=5, backoff=1, max_backoff=60, queue_size=10000, timeout=5):
+        self.urls = urls
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.transaction = threading.local()    # Events of the open transaction of each thread, published once it commits
+        self.lock = threading.Lock()
+        self.thread = None
+
+    # A transaction is written, committed or rolled back by one thread, so concurrent writers
+    # (scan shards, collector requests) only ever flush or discard their own events
+    def staged(self):
+        if not hasattr(self.transaction, 'events'):
+            self.transaction.events = []
+        return self.transaction.events
+
+    def stage(self, events):
+        self.staged().extend(events)
+
+    def discard(self):
+        # The transaction was rolled back, its events never happened
+        self.transaction.events = []
+
+    def flush(self):
+        # The transaction committed, queue its events for delivery
+        events, self.transaction.events = self.staged(), []
+        if events:
+            self.publish(events)
+
+    def publish(self, events):
+        timestamp = datetime.now(timezone.utc).isoformat()
+        for ip, event, port, detail in events:
+            try:
+                self.queue.put_nowait(event_dict(ip, event, port, detail, timestamp=timestamp))
+            except queue.Full:
+                self.dropped += 1
+        if self.dropped:
+            log.warning('webhook', f"Queue is full, {self.dropped} events dropped so far.")
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='webhooks', daemon=True)
+                self.thread.start()
+
+    def next_batch(self):
+        # Blocks for the first event, then collects more until the batch is full or BATCH_INTERVAL has passed
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.batch_interval
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get(timeout=max(0.0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            body = json.dumps({'events': batch}).encode()
+            for url in self.urls:
+                self.deliver(url, body, len(batch))
+
+    def deliver(self, url, body, count):
+        # Posts one batch, retrying failed requests with exponential backoff and jitter; returns True once delivered
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            try:
+                request = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'}, method='POST')
+                with urllib.request.urlopen(request, timeout=self.timeout):
+                    return True             # urlopen raises on error statuses
+            except OSError as e:
+                if attempt == self.retries:
+                    log.error('webhook', f"Dropping {count} events for {url} after {attempt + 1} attempts: {e}")
+                    return False
+                log.warning('webhook', f"Delivery to {url} failed ({e}), retrying in {delay:.1f}s.")
+                time.sleep(delay * random.uniform(0.5, 1.0))
+                delay = min(delay * 2, self.max_backoff)
+
+#-----------------#
+# Returns the webhook dispatcher of this process, or None if no webhooks are configured.
+dispatcher = None
+dispatcher_lock = threading.Lock()
+
+def get_dispatcher():
+    global dispatcher
+    if not NOTIFY_CONFIG['WEBHOOKS']:
+        return None
+    with dispatcher_lock:
+        if dispatcher is None:
+            dispatcher = WebhookDispatcher(NOTIFY_CONFIG['WEBHOOKS'], NOTIFY_CONFIG['BATCH_SIZE'], NOTIFY_CONFIG['BATCH_INTERVAL'],
+                                           NOTIFY_CONFIG['RETRIES'], NOTIFY_CONFIG['BACKOFF'], NOTIFY_CONFIG['MAX_BACKOFF'],
+                                           NOTIFY_CONFIG['QUEUE_SIZE'], NOTIFY_CONFIG['TIMEOUT'])
+        return dispatcher
+
+#-----------------#
+# Hooks for the scanner: events are staged with the write that records them and sent once it commits.
+def stage(events):
+    if events and get_dispatcher():
+        dispatcher.stage(events)
+
+def flush():
+    if get_dispatcher():
+        dispatcher.flush()
+
+def discard():
+    if get_dispatcher():
+        dispatcher.discard()
+
+#-----------------#
+# Per-client event filters, parsed from query parameters; raises ValueError on invalid input.
+def parse_filters(args):
+    filters = {}
+    if args.get('event'):
+        names = args['event'].split(',')
+        if not set(names) <= set(history.EVENT_TYPES):
+            raise ValueError(f"Unknown event, choose from {', '.join(history.EVENT_TYPES)}")
+        filters['event'] = set(names)
+    if args.get('ip'):
+        filters['ip'] = ipaddress.ip_network(args['ip'], strict=False)
+    if args.get('port'):
+        filters['port'] = {int(port) for port in args['port'].split(',')}
+    return filters
+
+def matches(event, filters):
+    if 'event' in filters and event['event'] not in filters['event']:
+        return False
+    if 'ip' in filters and ipaddress.ip_address(event['ip']) not in filters['ip']:
+        return False
+    if 'port' in filters and event['port'] not in filters['port']:
+        return False
+    return True
+
+#-----------------#
+# Formats an event as a Server-Sent Event; the id lets clients resume with Last-Event-ID.
+def format_sse(event):
+    return f"id: {event['id']}\nevent: {event['event']}\ndata: {json.dumps(event, default=str)}\n\n"
+
+#-----------------#
+# Reads events committed after after_id from the scan_events table in id order.
+def read_events(after_id, up_to_id=None, limit=1000):
+    query = "SELECT id, ip, timestamp, event, port, detail FROM scan_events WHERE id > %s"
+    params = [after_id]
+    if up_to_id is not None:
+        query += " AND id <= %s"
+        params.append(up_to_id)
+    with db_pool.get_pool().connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query + " ORDER BY id LIMIT %s", params + [limit])
+        rows = cursor.fetchall()
+        cursor.close()
+    return [event_dict(ip, event, port, detail, event_id, timestamp.isoformat() if timestamp else None)
+            for event_id, ip, timestamp, event, port, detail in rows]
+
+#-----------------#
+# Tails the scan_events table once per API process and fans new events out to the connected stream clients.
+class EventBroker:
+
+    def __init__(self, poll_interval=1, queue_size=1000, max_clients=4):
+        self.poll_interval = poll_interval
+        self.queue_size = queue_size
+        self.max_clients = max_clients
+        self.subscribers = set()
+        self.last_id = None                 # Newest event id handed to the subscribers
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def subscribe(self):
+        # Returns a client queue and the newest event id it will not receive, or (None, None) when all stream slots are taken
+        last_id = None
+        while True:
+            with self.lock:
+                if len(self.subscribers) >= self.max_clients:
+                    return None, None
+                if self.subscribers or last_id is not None:
+                    if not self.subscribers:
+                        # Nothing was polled while nobody listened, so start from the newest event instead of replaying the idle period
+                        self.last_id = max(last_id, self.last_id or 0)
+                    client = queue.Queue(maxsize=self.queue_size)
+                    self.subscribers.add(client)
+                    if self.thread is None:
+                        self.thread = threading.Thread(target=self.run, name='event-broker', daemon=True)
+                        self.thread.start()
+                    return client, self.last_id
+            # Read without the lock, so a slow query does not hold up the poller and the other streams
+            last_id = self.read_last_id()
+
+    def unsubscribe(self, client):
+        with self.lock:
+            self.subscribers.discard(client)
+
+    def read_last_id(self):
+        with db_pool.get_pool().connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COALESCE(MAX(id), 0) FROM scan_events")
+            (last_id,) = cursor.fetchone()
+            cursor.close()
+        return last_id
+
+    def poll(self):
+        # One query per interval for all clients; a client whose queue is full gets None and reconnects
+        read = read_events(self.last_id)
+        with self.lock:
+            events = [event for event in read if event['id'] > self.last_id]      # subscribe() may have moved on during the read
+            for event in events:
+                for client in list(self.subscribers):
+                    try:
+                        client.put_nowait(event)
+                    except queue.Full:
+                        self.subscribers.discard(client)
+                        drop_pending(client)
+            if events:
+                self.last_id = events[-1]['id']
+        return len(read)
+
+    def run(self):
+        while True:
+            with self.lock:
+                idle = not self.subscribers
+            try:
+                if idle or self.poll() < 1000:      # A full page means more events are waiting
+                    time.sleep(self.poll_interval)
+            except Exception as e:
+                log.error('events', f"Unable to read new events: {e}")
+                time.sleep(self.poll_interval)
+
+#-----------------#
+# Empties the queue of a client that fell behind and leaves the None marker that ends its stream.
+def drop_pending(client):
+    while True:
+        try:
+            client.get_nowait()
+        except queue.Empty:
+            break
+    client.put_nowait(None)
+
+#-----------------#
+# Yields the Server-Sent Events of one client: missed events after last_event_id first, then new events as they are committed.
+def event_stream(broker, client, broker_last_id, filters, last_event_id=None, keepalive=15):
+    try:
+        yield "retry: 5000\n\n"             # Reconnect delay for EventSource clients
+        # Catch up from the database up to where the broker started feeding this client
+        while last_event_id is not None and last_event_id < broker_last_id:
+            events = read_events(last_event_id, broker_last_id)
+            if not events:
+                break
+            for event in events:
+                if matches(event, filters):
+                    yield format_sse(event)
+            last_event_id = events[-1]['id']
+        while True:
+            try:
+                event = client.get(timeout=keepalive)
+            except queue.Empty:
+                yield ": keepalive\n\n"     # Keeps proxies from closing idle streams
+                continue
+            if event is None:
+                yield "event: overflow\ndata: {}\n\n"       # Fell behind; the client resumes from its Last-Event-ID
+                return
+            if matches(event, filters):
+                yield format_sse(event)
+    finally:
+        broker.unsubscribe(client)
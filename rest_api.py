@@ -1,27 +1,272 @@
 #-----------------#
 # Imported modules
-from flask import Flask, jsonify, send_from_directory   # Import Flask framework and related functions for building web applications
-import pymysql                                          # Import pymysql for connecting to and interacting with MySQL databases
-from config import DB_CONFIG, FLASK_CONFIG              # Import database and Flask configuration settings from the config module
+from flask import Flask, jsonify, send_from_directory, request, abort, Response, stream_with_context, g  # Import Flask framework and related functions for building web applications
+import pymysql                                          # Import pymysql for catching database errors while reading published metrics
+from config import FLASK_CONFIG                         # Import Flask configuration settings from the config module
+import db_pool                                          # Import db_pool for the connection pool shared with the scanner code
 import os                                               # Import os for interacting with the operating system (e.g., file paths, environment variables)
+import ipaddress                                        # Import ipaddress for validating IP addresses in request paths
+import history                                          # Import history for reading host change timelines
+import time                                             # Import time for expiring the response cache
+import hashlib                                          # Import hashlib for building ETags
+import base64                                           # Import base64 for encoding pagination cursors
+import binascii                                         # Import binascii for catching malformed cursors
+import metrics                                          # Import metrics for request latency and the /metrics endpoint
+import tuning                                           # Import tuning for the columns of the adaptive timing history
+import notifications                                    # Import notifications for streaming change events to clients
+import inventory                                        # Import inventory for answering range, port and count queries from memory
+import export                                           # Import export for streaming the inventory and history as files
+import collector                                        # Import collector for receiving host batches from scanning agents
 
 app = Flask(__name__)   # Create an instance of the Flask application
 
-def get_scan_data():
-    # Establish a connection to the MySQL database using configuration settings
-    conn = pymysql.connect(
-            host=DB_CONFIG['host'],             # Database host
-            user=DB_CONFIG['user'],             # Database user
-            password=DB_CONFIG['password'],     # Database password
-            database=DB_CONFIG['database']      # Database name
-        )
-    cursor = conn.cursor()      # Create a cursor object to interact with the database
-    cursor.execute("SELECT * FROM scans ORDER BY timestamp DESC")   # Execute a SQL query to retrieve all scan records ordered by timestamp
-    rows = cursor.fetchall()    # Fetch all results from the executed query
-    cursor.close()              # Close the cursor to free up resources
-    conn.close()                # Close the database connection
+# Columns that can be requested through the 'fields' parameter of /api/scans
+SCAN_FIELDS = ('id', 'ip', 'status', 'device_info', 'timestamp', 'domain')
+
+# Short-lived response cache for /api/scans, emptied whenever the scanner commits a new generation
+response_cache = {}                 # query string -> response body
+cache_state = {'generation': None, 'updated_at': None, 'checked_at': 0.0}
+
+# Rows fetched from the server-side cursor per streamed chunk
+STREAM_CHUNK_ROWS = 500
+
+# Reads new change events once per interval for all connected /api/events/stream clients of this process
+event_broker = notifications.EventBroker(notifications.NOTIFY_CONFIG['POLL_INTERVAL'], notifications.NOTIFY_CONFIG['STREAM_QUEUE_SIZE'],
+                                         notifications.NOTIFY_CONFIG['MAX_STREAMS'])
+
+# Columns of the scan_jobs table returned by /api/jobs
+JOB_FIELDS = ('name', 'network', 'ports', 'interval_minutes', 'priority', 'state', 'last_started',
+              'last_finished', 'last_duration', 'last_result', 'next_run', 'skipped', 'run_requested')
+
+# Columns of the host_ports table returned by /api/ports and /api/services, plus the host status from scans
+PORT_FIELDS = ('ip', 'proto', 'port', 'state', 'service', 'product', 'version', 'last_seen', 'status')
+
+def build_scan_query(where, fields):
+    # id is always selected because it is the pagination cursor
+    columns = ', '.join(dict.fromkeys(('id',) + fields))
+    query = f"SELECT {columns} FROM scans"
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    # Keyset order on the primary key: timestamp changes whenever a scan rewrites a row, which would move it across a client's cursor
+    return query + " ORDER BY id DESC"
+
+def get_scan_data(where, params, fields, limit):
+    query = build_scan_query(where, fields) + " LIMIT %s"
+    # Borrow a pooled connection instead of connecting for every request
+    with db_pool.get_pool().connection() as conn:
+        cursor = conn.cursor()      # Create a cursor object to interact with the database
+        cursor.execute(query, params + [limit])
+        rows = cursor.fetchall()    # Fetch one page of results
+        cursor.close()              # Close the cursor to free up resources
     return rows                 # Return the fetched scan data
 
+def stream_query(query, params):
+    # Yields lists of rows from an unbuffered server-side cursor so only one chunk is held in memory
+    yield from db_pool.get_pool().stream(query, params, STREAM_CHUNK_ROWS)
+
+def stream_scan_rows(where, params, fields, stream_format):
+    # Encodes the matching rows as a JSON array or as NDJSON, one chunk at a time
+    columns = list(dict.fromkeys(('id',) + fields))
+    positions = [columns.index(field) for field in fields]
+    separator = '\n' if stream_format == 'ndjson' else ','
+    if stream_format == 'json':
+        yield '['
+    first = True
+    for rows in stream_query(build_scan_query(where, fields), params):
+        chunk = separator.join(app.json.dumps({field: row[position] for field, position in zip(fields, positions)}) for row in rows)
+        if stream_format == 'ndjson':
+            yield chunk + '\n'
+        else:
+            yield chunk if first else ',' + chunk
+        first = False
+    if stream_format == 'json':
+        yield ']'
+
+def get_scan_generation():
+    # Returns the scanner's commit generation, re-read from the database at most once per CACHE_TTL seconds
+    now = time.monotonic()
+    if now - cache_state['checked_at'] < FLASK_CONFIG.get('CACHE_TTL', 2):
+        return cache_state['generation'], cache_state['updated_at']
+
+    with db_pool.get_pool().connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT generation, updated_at FROM scan_meta WHERE id = 1")
+        generation, updated_at = cursor.fetchone() or (0, None)
+        cursor.close()
+
+    # A new generation means a scan cycle committed, so every cached response is stale
+    if generation != cache_state['generation']:
+        response_cache.clear()
+    cache_state.update(generation=generation, updated_at=updated_at, checked_at=now)
+    return generation, updated_at
+
+def parse_scan_filters(args):
+    # Translates the query parameters of /api/scans into SQL conditions; raises ValueError on invalid input
+    where, params = [], []
+
+    # Filter by host status (up or down)
+    if args.get('status'):
+        where.append("status = %s")
+        params.append(args['status'])
+
+    # Filter by CIDR through the indexed ip_num column, or by a plain address prefix through the ip index
+    ip_filter = args.get('ip')
+    if ip_filter and '/' in ip_filter:
+        network = ipaddress.IPv4Network(ip_filter, strict=False)
+        where.append("ip_num BETWEEN %s AND %s")
+        params += [int(network.network_address), int(network.broadcast_address)]
+    elif ip_filter:
+        where.append("ip LIKE %s")
+        params.append(ip_filter.replace('\\', '').replace('%', '').replace('_', '') + '%')
+
+    # Filter by open port; MEMBER OF narrows the rows through the multi-valued port index
+    if args.get('port'):
+        port = int(args['port'])
+        where.append("%s MEMBER OF (device_info->'$.ports[*].port') AND JSON_CONTAINS(device_info->'$.ports', JSON_OBJECT('port', %s, 'state', 'open'))")
+        params += [port, port]
+
+    # Filter by service name on an open port, narrowed by the multi-valued service index
+    if args.get('service'):
+        where.append("%s MEMBER OF (device_info->'$.ports[*].name') AND JSON_CONTAINS(device_info->'$.ports', JSON_OBJECT('name', %s, 'state', 'open'))")
+        params += [args['service'], args['service']]
+
+    # Continue after the last row of the previous page
+    if args.get('after'):
+        where.append("id < %s")
+        params.append(decode_cursor(args['after']))
+
+    return where, params
+
+def encode_cursor(row_id):
+    # Packs the id of a row into an opaque URL-safe token
+    return base64.urlsafe_b64encode(str(row_id).encode()).decode()
+
+def decode_cursor(token):
+    # Unpacks a token created by encode_cursor; tokens of the earlier timestamp|id form continue after their id.
+    # Raises ValueError if it is malformed
+    try:
+        return int(base64.urlsafe_b64decode(token.encode()).decode().split('|')[-1])
+    except (TypeError, UnicodeDecodeError, binascii.Error) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+
+def parse_port_filters(args, where, params):
+    # Adds the state, protocol and keyset conditions shared by /api/ports and /api/services; raises ValueError on invalid input
+    where.append("p.state = %s")
+    params.append(args.get('state', 'open'))
+    if args.get('proto'):
+        where.append("p.proto = %s")
+        params.append(args['proto'])
+    # Continue after the (ip, port) of the last row of the previous page
+    if args.get('after'):
+        ip, _, port = args['after'].rpartition(':')
+        where.append("(p.ip_num, p.port) > (%s, %s)")
+        params += [int(ipaddress.IPv4Address(ip)), int(port)]
+    return where, params
+
+def get_port_data(where, params, limit):
+    # Every condition is served by one of the covering host_ports indexes; the join reads one scans row per result
+    query = (
+        "SELECT p.ip, p.proto, p.port, p.state, p.service, p.product, p.version, p.last_seen, s.status "
+        "FROM host_ports p JOIN scans s ON s.ip = p.ip WHERE " + " AND ".join(where) +
+        " ORDER BY p.ip_num, p.port LIMIT %s"
+    )
+    with db_pool.get_pool().connection() as conn:
+        cursor = conn.cursor()      # Create a cursor object to interact with the database
+        cursor.execute(query, params + [limit])
+        rows = [dict(zip(PORT_FIELDS, row)) for row in cursor.fetchall()]
+        cursor.close()              # Close the cursor to free up resources
+    return rows                 # Return the matching ports
+
+def port_page(rows, limit):
+    # Wraps one page of port rows together with the cursor for the next page
+    next_cursor = f"{rows[-1]['ip']}:{rows[-1]['port']}" if len(rows) == limit else None
+    return jsonify({'items': rows, 'next': next_cursor})
+
+def parse_inventory_filters(args):
+    # Translates the query parameters of /api/inventory into network, port and status filters; raises ValueError on invalid input
+    network = ipaddress.IPv4Network(args['ip'], strict=False) if args.get('ip') else None   # Address or CIDR
+    port = int(args['port']) if args.get('port') else None
+    if port is not None and not 0 <= port <= 65535:
+        raise ValueError("Invalid port")
+    return network, port, args.get('status') or None
+
+def get_host_inventory():
+    # Returns the in-memory inventory of this process, brought up to date when the scanner committed since the last request
+    if not inventory.INVENTORY_CONFIG['ENABLED']:
+        abort(404, description="The inventory is disabled")
+    generation, _ = get_scan_generation()
+    return inventory.get_inventory(generation)
+
+def get_timeline_data(ip, since, before_id, limit):
+    # Borrow a pooled connection instead of connecting for every request
+    with db_pool.get_pool().connection() as conn:
+        cursor = conn.cursor()      # Create a cursor object to interact with the database
+        events = history.get_host_timeline(cursor, ip, since, before_id, limit)     # Read the host's newest events through the (ip, timestamp) index
+        cursor.close()              # Close the cursor to free up resources
+    return events               # Return the host's events
+
+def get_job_data():
+    # Reads the job states stored by the scheduler daemon
+    with db_pool.get_pool().connection() as conn:
+        cursor = conn.cursor()      # Create a cursor object to interact with the database
+        cursor.execute(f"SELECT {', '.join(JOB_FIELDS)} FROM scan_jobs ORDER BY priority DESC, name")
+        jobs = [dict(zip(JOB_FIELDS, row)) for row in cursor.fetchall()]
+        cursor.close()              # Close the cursor to free up resources
+    for job in jobs:
+        job['interval_minutes'] = float(job['interval_minutes'])    # DECIMAL is not JSON serializable
+        job['run_requested'] = bool(job['run_requested'])
+    return jobs                 # Return the job states
+
+def request_job_run(name):
+    # Flags the job for an immediate run, picked up by the scheduler within POLL_INTERVAL seconds; returns False for unknown jobs
+    with db_pool.get_pool().connection() as conn:
+        cursor = conn.cursor()
+        found = cursor.execute("UPDATE scan_jobs SET run_requested = 1 WHERE name = %s", (name,))
+        if not found:
+            # An already requested run changes no row, so check that the job exists
+            cursor.execute("SELECT 1 FROM scan_jobs WHERE name = %s", (name,))
+            found = cursor.fetchone() is not None
+        cursor.close()
+        conn.commit()
+    return found
+
+def get_tuning_data(subnet, limit):
+    # Reads the newest adaptive timing runs, optionally of one subnet, through the (subnet, id) index
+    fields = ('id', 'timestamp') + tuning.TUNING_FIELDS
+    query = f"SELECT {', '.join(fields)} FROM scan_tuning"
+    params = []
+    if subnet:
+        query += " WHERE subnet = %s"
+        params.append(subnet)
+    with db_pool.get_pool().connection() as conn:
+        cursor = conn.cursor()      # Create a cursor object to interact with the database
+        cursor.execute(query + " ORDER BY id DESC LIMIT %s", params + [limit])
+        runs = [dict(zip(fields, row)) for row in cursor.fetchall()]
+        cursor.close()              # Close the cursor to free up resources
+    return runs                 # Return the runs, newest first
+
+def get_published_metrics():
+    # Reads the metrics the scanner published with its last cycle
+    try:
+        with db_pool.get_pool().connection() as conn:
+            cursor = conn.cursor()
+            families = metrics.load_published(cursor)
+            cursor.close()
+        return families
+    except pymysql.err.Error:
+        return []                   # The API keeps serving its own metrics while the database is unreachable
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def observe_request_latency(response):
+    # Streamed responses are measured until their headers are sent
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'      # Route templates keep the label set small
+    metrics.API_REQUEST_SECONDS.observe(time.perf_counter() - g.request_started, endpoint=endpoint, method=request.method, status=response.status_code)
+    return response
+
 @app.route('/')     # Define the route for the root URL of the application
 def index():
     return '''
@@ -31,7 +276,8 @@ def index():
         </head>
         <body>
             <h1>Welcome to the Network Monitor API</h1>
-            <p>Use <a href="/api/scans">/api/scans</a> to get scan data.</p>
+            <p>Use <a href="/api/scans">/api/scans</a> to get scan data (filters: status, ip, port, service; paging: limit, after; projection: fields; stream=json|ndjson for all rows).</p>
+            <p>Use /api/hosts/&lt;ip&gt;/timeline to get the change history of a host.</p>
         </body>
     </html>
     '''
@@ -46,9 +292,250 @@ def favicon():
 
 @app.route('/api/scans', methods=['GET'])   # Define the route for the API endpoint to get scan data, allowing only GET requests
 def get_scans():
-    data = get_scan_data()  # Call the function to retrieve scan data from the database
-    # Return the scan data as a JSON response
-    return jsonify(data)    # Convert the data to JSON format and send it as a response
+    # Validate the projection before doing any work
+    fields = tuple(request.args.get('fields', ','.join(SCAN_FIELDS)).split(','))
+    if not set(fields) <= set(SCAN_FIELDS):
+        abort(400, description=f"Unknown field, choose from {', '.join(SCAN_FIELDS)}")
+    limit = max(1, min(request.args.get('limit', FLASK_CONFIG.get('PAGE_SIZE', 100), type=int), FLASK_CONFIG.get('MAX_PAGE_SIZE', 1000)))
+    stream_format = request.args.get('stream')      # 'json' or 'ndjson' streams every matching row instead of one page
+    if stream_format not in (None, 'json', 'ndjson'):
+        abort(400, description="stream must be json or ndjson")
+    try:
+        where, params = parse_scan_filters(request.args)
+    except ValueError as e:
+        abort(400, description=str(e))
+
+    # Answer conditional requests from the commit generation without querying the scans table
+    generation, updated_at = get_scan_generation()
+    cache_key = request.query_string.decode()
+    etag = hashlib.sha1(f"{generation}:{cache_key}".encode()).hexdigest()
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    elif stream_format:
+        # Rows are read and encoded while the response is being sent, so memory stays flat
+        mimetype = 'application/x-ndjson' if stream_format == 'ndjson' else 'application/json'
+        response = Response(stream_with_context(stream_scan_rows(where, params, fields, stream_format)), mimetype=mimetype)
+        response.implicit_sequence_conversion = False   # Keep make_conditional from buffering the stream to compute Content-Length
+    else:
+        body = response_cache.get(cache_key)
+        if body is None:
+            rows = get_scan_data(where, params, fields, limit)  # Call the function to retrieve one page of scan data from the database
+
+            # Project the requested fields; the first column is always id
+            columns = list(dict.fromkeys(('id',) + fields))
+            items = [{field: row[columns.index(field)] for field in fields} for row in rows]
+            next_cursor = encode_cursor(rows[-1][0]) if len(rows) == limit else None
+            body = jsonify({'items': items, 'next': next_cursor}).get_data()
+            if len(response_cache) < 1024:     # Bound the cache size between generations
+                response_cache[cache_key] = body
+        response = Response(body, mimetype='application/json')
+
+    # Let clients revalidate with If-None-Match or If-Modified-Since
+    response.set_etag(etag)
+    response.last_modified = updated_at
+    return response.make_conditional(request)
+
+
+@app.route('/api/ports/<int:port>', methods=['GET'])     # Define the route for the hosts with a given port, open by default
+def get_port_hosts(port):
+    if not 0 <= port <= 65535:
+        abort(400, description="Invalid port")
+    limit = max(1, min(request.args.get('limit', FLASK_CONFIG.get('PAGE_SIZE', 100), type=int), FLASK_CONFIG.get('MAX_PAGE_SIZE', 1000)))
+    try:
+        where, params = parse_port_filters(request.args, ["p.port = %s"], [port])
+    except ValueError as e:
+        abort(400, description=str(e))
+    return port_page(get_port_data(where, params, limit), limit)
+
+
+@app.route('/api/services', methods=['GET'])    # Define the route for the hosts running a given service, product or version
+def get_service_hosts():
+    # name and product match exactly, version matches as a prefix (version=7. finds every 7.x release)
+    where, params = [], []
+    for argument, column in (('name', 'service'), ('product', 'product')):
+        if request.args.get(argument):
+            where.append(f"p.{column} = %s")
+            params.append(request.args[argument])
+    if not where:
+        abort(400, description="name or product is required")
+    if request.args.get('version'):
+        where.append("p.version LIKE %s")
+        params.append(request.args['version'].replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')     # Escape LIKE wildcards
+    limit = max(1, min(request.args.get('limit', FLASK_CONFIG.get('PAGE_SIZE', 100), type=int), FLASK_CONFIG.get('MAX_PAGE_SIZE', 1000)))
+    try:
+        where, params = parse_port_filters(request.args, where, params)
+    except ValueError as e:
+        abort(400, description=str(e))
+    return port_page(get_port_data(where, params, limit), limit)
+
+
+@app.route('/api/inventory', methods=['GET'])  # Define the route for host lookups answered from the in-memory inventory
+def get_inventory_hosts():
+    limit = max(1, min(request.args.get('limit', FLASK_CONFIG.get('PAGE_SIZE', 100), type=int), FLASK_CONFIG.get('MAX_PAGE_SIZE', 1000)))
+    try:
+        network, port, status = parse_inventory_filters(request.args)
+        after = int(ipaddress.IPv4Address(request.args['after'])) if request.args.get('after') else None  # Continue after this address
+    except ValueError as e:
+        abort(400, description=str(e))
+    hosts = get_host_inventory().select(network, port, status, after, limit)
+    return jsonify({'items': hosts, 'next': hosts[-1]['ip'] if len(hosts) == limit else None})
+
+
+@app.route('/api/inventory/count', methods=['GET'])    # Define the route for counting hosts by range, open port and status
+def count_inventory_hosts():
+    try:
+        network, port, status = parse_inventory_filters(request.args)
+    except ValueError as e:
+        abort(400, description=str(e))
+    host_inventory = get_host_inventory()
+    return jsonify({'count': host_inventory.count(network, port, status), 'generation': host_inventory.generation})
+
+
+@app.route('/api/export/<dataset>', methods=['GET'])     # Define the route for downloading the scans or events table as a file
+def export_dataset(dataset):
+    # format=ndjson|csv|parquet, compression=gzip|zstd|none, since=2024-11-08 limits the rows to those written since then
+    file_format = request.args.get('format', 'ndjson')
+    compression = request.args.get('compression', 'gzip')
+    try:
+        export.check_format(dataset, file_format, compression)
+        since = export.parse_since(request.args.get('since'))
+    except (export.ExportError, ValueError) as e:
+        abort(400, description=str(e))
+
+    # Rows are read, encoded and compressed one chunk at a time while the response is being sent
+    chunks = db_pool.get_pool().stream(*export.build_export_query(dataset, since), export.EXPORT_CONFIG['CHUNK_ROWS'])
+    body = export.export_chunks(dataset, file_format, compression, chunks)
+    mimetype = export.CONTENT_TYPES[file_format if file_format == 'parquet' or compression == 'none' else compression]
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f"attachment; filename={export.file_name(dataset, file_format, compression)}"
+    return response
+
+
+def read_agent_request():
+    # Decodes the body of an agent request, answering with the collector's status code if it is rejected
+    if not collector.COLLECTOR_CONFIG['ENABLED']:
+        abort(404, description="The collector is disabled")
+    try:
+        return collector.decode_request(request.get_data(), request.headers.get('Content-Encoding'), request.headers.get('X-Agent-Token'))
+    except collector.CollectorError as e:
+        abort(e.status, description=str(e))
+
+
+@app.route('/api/collector/hosts', methods=['POST'])     # Define the route for host batches pushed by scanning agents
+def collect_hosts():
+    payload = read_agent_request()
+    try:
+        return jsonify(collector.receive_batch(payload, request.remote_addr))
+    except collector.CollectorError as e:
+        abort(e.status, description=str(e))
+    except pymysql.err.Error:
+        abort(503, description="Database unavailable")     # The agent keeps the batch and retries
+
+
+@app.route('/api/collector/heartbeat', methods=['POST'])     # Define the route for the heartbeats of scanning agents
+def collect_heartbeat():
+    payload = read_agent_request()
+    try:
+        collector.heartbeat(payload, request.remote_addr)
+    except pymysql.err.Error:
+        abort(503, description="Database unavailable")
+    return jsonify({'status': 'ok'})
+
+
+@app.route('/api/agents', methods=['GET'])  # Define the route for the registered agents and whether they are online
+def get_agents():
+    return jsonify({'agents': collector.get_agents()})
+
+
+@app.route('/api/pool', methods=['GET'])    # Define the route for the connection pool metrics
+def get_pool_stats():
+    return jsonify(db_pool.get_pool().stats())  # In use, idle, waits and checkout latency of this API process
+
+
+@app.route('/api/hosts/<ip>/timeline', methods=['GET'])     # Define the route for the change history of a single host
+def get_host_timeline(ip):
+    # Reject anything that is not an IP address before touching the database
+    try:
+        ipaddress.ip_address(ip)
+    except ValueError:
+        abort(400, description="Invalid IP address")
+
+    since = request.args.get('since')                                   # Optional lower time bound (e.g. 2024-11-08 00:00:00)
+    before_id = request.args.get('before_id', type=int)                 # Continue below the last event id of the previous page
+    limit = max(1, min(request.args.get('limit', 100, type=int), 1000))  # Page size, capped to keep responses small
+    events = get_timeline_data(ip, since, before_id, limit)
+    # Return the events together with the cursor for the next page
+    return jsonify({'ip': ip, 'events': events, 'next_before_id': events[-1]['id'] if len(events) == limit else None})
+
+
+@app.route('/api/events/stream', methods=['GET'])    # Define the route for pushing change events to clients as Server-Sent Events
+def stream_events():
+    # Optional filters: event=port_opened,port_closed, ip=10.0.0.0/24 (address or CIDR), port=22,3389
+    try:
+        filters = notifications.parse_filters(request.args)
+        last_event_id = request.headers.get('Last-Event-ID', request.args.get('last_event_id'))
+        last_event_id = int(last_event_id) if last_event_id else None      # Resume after this event, sent by EventSource on reconnect
+    except ValueError as e:
+        abort(400, description=str(e))
+
+    try:
+        client, broker_last_id = event_broker.subscribe()
+    except pymysql.err.Error:
+        abort(503, description="Database unavailable")
+    if client is None:
+        abort(503, description="Too many open event streams")
+    stream = notifications.event_stream(event_broker, client, broker_last_id, filters, last_event_id, notifications.NOTIFY_CONFIG['KEEPALIVE'])
+    response = Response(stream_with_context(stream), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'       # Keep reverse proxies from buffering the stream
+    response.call_on_close(lambda: event_broker.unsubscribe(client))    # Also frees the slot if the stream never started
+    return response
+
+
+@app.route('/api/jobs', methods=['GET'])    # Define the route for the state of the scheduled scan jobs
+def get_jobs():
+    return jsonify({'jobs': get_job_data()})
+
+
+@app.route('/api/jobs/<name>/run', methods=['POST'])     # Define the route for requesting an immediate run of a scan job
+def run_job(name):
+    if not request_job_run(name):
+        abort(404, description="Unknown job")
+    return jsonify({'name': name, 'run_requested': True}), 202      # Accepted, the scheduler starts the run on its next poll
+
+
+@app.route('/api/tuning', methods=['GET'])  # Define the route for reviewing the adaptive nmap timing per subnet
+def get_tuning():
+    limit = max(1, min(request.args.get('limit', 100, type=int), 1000))  # Page size, capped to keep responses small
+    return jsonify({'runs': get_tuning_data(request.args.get('subnet'), limit)})
+
+
+@app.route('/health', methods=['GET'])      # Define the route for the liveness check: the server answers requests
+def get_health():
+    # The process ids let the monitor tell its own API process (or gunicorn master) from another server on the port
+    return jsonify({'status': 'ok', 'pid': os.getpid(), 'ppid': os.getppid()})
+
+
+@app.route('/ready', methods=['GET'])       # Define the route for the readiness check: the database can be queried
+def get_ready():
+    try:
+        with db_pool.get_pool().connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+    except Exception as e:
+        return jsonify({'status': 'unavailable', 'error': str(e)}), 503
+    return jsonify({'status': 'ready'})
+
+
+@app.route('/metrics', methods=['GET'])     # Define the route for Prometheus scraping
+def get_metrics():
+    pool_stats = db_pool.get_pool().stats()
+    metrics.POOL_CONNECTIONS.set(pool_stats['in_use'], state='in_use')
+    metrics.POOL_CONNECTIONS.set(pool_stats['idle'], state='idle')
+    # Metrics of this API process plus those the scanner stored in the database
+    body = metrics.render(metrics.collect({'process': 'api'}) + get_published_metrics())
+    return Response(body, mimetype='text/plain; version=0.0.4')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,247 @@
+#-----------------#
+# Imported modules
+import threading                            # Import threading for the scan threads and the scheduler lock
+import random                               # Import random for the jitter added to every scheduled run
+import time                                 # Import time for the monotonic schedule clock
+from datetime import datetime               # Import datetime for the job timestamps stored in the database
+from colorama import Fore                   # Import Fore from colorama for colored terminal text
+from config import SCAN_CONFIG              # Import the default scan settings used when no jobs are configured
+import config                               # Import config to read the optional SCHEDULER_CONFIG section
+import db_pool                              # Import db_pool for storing job state and reading run requests
+from logger import log                      # Import log for leveled, rate-limited console output
+
+#-----------------#
+# Scheduler settings with defaults for installations whose config.py has no SCHEDULER_CONFIG yet
+SCHEDULER_CONFIG = {
+    'JOBS': [],                 # [{'NAME', 'NETWORK', 'PORTS', 'INTERVAL' (minutes), 'PRIORITY'}], empty for one job with the default scan settings
+    'MAX_CONCURRENT_SCANS': 1,  # Scan cycles running at the same time
+    'MAX_NMAP_PROCESSES': 4,    # nmap processes running at the same time across all jobs
+    'JITTER': 0.05,             # Random delay added to each run, as a fraction of the job interval
+    'OVERLAP': 'skip',          # 'skip' drops a run while the previous one of the job is still going, 'queue' runs it right after
+    'POLL_INTERVAL': 5          # Seconds between checks for runs requested through the REST API
+}
+SCHEDULER_CONFIG.update(getattr(config, 'SCHEDULER_CONFIG', {}))
+
+#-----------------#
+# A network and port set scanned at a fixed rate.
+class ScanJob:
+
+    def __init__(self, name, network, ports, interval, priority=0):
+        self.name = name
+        self.network = network
+        self.ports = ports
+        self.interval = interval * 60       # Minutes to seconds
+        self.priority = priority            # Higher priorities get the free scan slots first
+        self.slot = None                    # Nominal start of the next run, without jitter
+        self.next_run = None                # Start of the next run including jitter
+        self.state = 'idle'                 # idle, waiting (for a scan slot), running or queued (running with another run pending)
+        self.pending = False                # Another run is queued behind the running one
+        self.skipped = 0                    # Runs dropped because the previous one was still running
+        self.runs = 0
+        self.last_started = None
+        self.last_finished = None
+        self.last_duration = None
+        self.last_result = None             # ok, failed or error
+
+#-----------------#
+# Builds the scan jobs from the scheduler settings, falling back to one job with the default scan settings.
+def load_jobs(jobs=None):
+    jobs = SCHEDULER_CONFIG['JOBS'] if jobs is None else jobs
+    if not jobs:
+        jobs = [{'NAME': 'default', 'NETWORK': SCAN_CONFIG['DEFAULT_NETWORK'],
+                 'PORTS': SCAN_CONFIG['DEFAULT_PORTS'], 'INTERVAL': SCAN_CONFIG['DEFAULT_INTERVAL']}]
+    return [ScanJob(job['NAME'], job['NETWORK'], job.get('PORTS', SCAN_CONFIG['DEFAULT_PORTS']),
+                    float(job.get('INTERVAL', SCAN_CONFIG['DEFAULT_INTERVAL'])), job.get('PRIORITY', 0)) for job in jobs]
+
+#-----------------#
+# Runs scan jobs at a fixed rate in background threads without blocking on user input.
+class ScanScheduler:
+
+    def __init__(self, jobs, run_scan, max_concurrent=1, jitter=0.0, overlap='skip', poll_interval=5, persist=True):
+        self.jobs = {job.name: job for job in jobs}
+        self.run_scan = run_scan                # Callable(network, ports) returning 0 on success
+        self.max_concurrent = max(1, max_concurrent)
+        self.jitter = jitter
+        self.overlap = overlap
+        self.poll_interval = poll_interval
+        self.persist = persist                  # Store job state in the scan_jobs table for the REST API
+        self.ready = []                         # Jobs waiting for a free scan slot
+        self.threads = {}                       # name -> thread of the running scan
+        self.lock = threading.Lock()            # Protects job state shared with the scan threads
+        self.stop_event = threading.Event()
+        self.last_poll = 0.0
+
+    def tick(self, now):
+        # Starts due runs, picks up runs requested through the API and fills the free scan slots
+        for job in self.jobs.values():
+            if job.slot is None:
+                job.slot = job.next_run = now           # First run right after start-up
+            if now >= job.next_run:
+                # Fixed rate: the next slot follows the schedule, not the end of the scan; slots missed entirely are dropped
+                if job.interval > 0:
+                    job.slot += (int((now - job.slot) // job.interval) + 1) * job.interval
+                else:
+                    job.slot = now
+                job.next_run = job.slot + random.uniform(0, self.jitter * job.interval)
+                self.request_run(job)
+        if self.persist and now - self.last_poll >= self.poll_interval:
+            self.last_poll = now
+            self.poll_run_requests()
+        self.dispatch()
+
+    def request_run(self, job):
+        # Adds a run of the job, skipping or queueing it when the previous one is still running
+        with self.lock:
+            if job.state in ('running', 'queued'):
+                if self.overlap == 'queue':
+                    job.pending = True
+                    job.state = 'queued'
+                else:
+                    job.skipped += 1
+                    log.info('Scheduler', f"Job {Fore.GREEN}{job.name}{Fore.WHITE} is still running, skipping this run ({job.skipped} skipped).")
+            elif job not in self.ready:
+                self.ready.append(job)
+                job.state = 'waiting'
+        self.save_job(job)
+
+    def trigger(self, name):
+        # Requests an immediate run of the job, returns False for unknown jobs
+        job = self.jobs.get(name)
+        if job is None:
+            return False
+        log.info('Scheduler', f"Run of job {Fore.GREEN}{name}{Fore.WHITE} requested.")
+        self.request_run(job)
+        return True
+
+    def dispatch(self):
+        # Starts the highest-priority waiting jobs while scan slots are free
+        started = []
+        with self.lock:
+            while self.ready and len(self.threads) < self.max_concurrent:
+                job = max(self.ready, key=lambda ready_job: ready_job.priority)    # First waiting job among those with the highest priority
+                self.ready.remove(job)
+                job.state = 'running'
+                job.last_started = time.time()
+                thread = threading.Thread(target=self.run_job, args=(job,), name=f'scan-{job.name}', daemon=True)
+                self.threads[job.name] = thread
+                started.append((job, thread))
+        for job, thread in started:
+            self.save_job(job)
+            thread.start()
+
+    def run_job(self, job):
+        # Runs one scan cycle of the job and records its outcome
+        log.info('Scheduler', f"Starting job {Fore.GREEN}{job.name}{Fore.WHITE} ({job.network}, ports {job.ports}).")
+        started = time.monotonic()
+        try:
+            result = 'ok' if self.run_scan(job.network, job.ports) == 0 else 'failed'
+        except Exception as e:
+            log.error('Scheduler', f"Job {job.name} failed: {e}")
+            result = 'error'
+        with self.lock:
+            job.runs += 1
+            job.last_finished = time.time()
+            job.last_duration = time.monotonic() - started
+            job.last_result = result
+            del self.threads[job.name]
+            # A run queued while this one was going starts as soon as a slot is free
+            if job.pending:
+                job.pending = False
+                self.ready.append(job)
+                job.state = 'waiting'
+            else:
+                job.state = 'idle'
+        log.info('Scheduler', f"Job {Fore.GREEN}{job.name}{Fore.WHITE} finished ({result}) in {job.last_duration:.1f}s.")
+        self.save_job(job)
+
+    def run_forever(self):
+        # Main loop of the daemon, returns after stop() and once the running scans have finished
+        self.register_jobs()
+        log.info('Scheduler', f"Running {len(self.jobs)} job(s), at most {self.max_concurrent} at a time.")
+        while not self.stop_event.is_set():
+            now = time.monotonic()
+            self.tick(now)
+            next_run = min(job.next_run for job in self.jobs.values())
+            self.stop_event.wait(max(0.1, min(next_run - now, 1.0)))     # Wake up at least every second to start queued runs
+        log.info('Scheduler', "Waiting for running scans to finish...")
+        for thread in list(self.threads.values()):
+            thread.join()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def status(self):
+        # Returns the state of all jobs
+        with self.lock:
+            return [{'name': job.name, 'network': job.network, 'ports': job.ports, 'interval': job.interval / 60,
+                     'priority': job.priority, 'state': job.state, 'skipped': job.skipped, 'runs': job.runs,
+                     'last_duration': job.last_duration, 'last_result': job.last_result} for job in self.jobs.values()]
+
+    def register_jobs(self):
+        # Replaces the job list in the database so the REST API only shows the configured jobs
+        if not self.persist:
+            return
+        try:
+            with db_pool.get_pool().connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("DELETE FROM scan_jobs WHERE name NOT IN (" + ", ".join(["%s"] * len(self.jobs)) + ")", list(self.jobs))
+                cursor.close()
+                conn.commit()
+        except Exception as e:
+            log.error('Scheduler', f"Unable to register jobs: {e}")
+        for job in self.jobs.values():
+            self.save_job(job)
+
+    def save_job(self, job):
+        # Stores the job's schedule and last outcome in the scan_jobs table
+        if not self.persist:
+            return
+        to_datetime = lambda seconds: datetime.fromtimestamp(seconds) if seconds is not None else None
+        next_run = time.time() + job.next_run - time.monotonic() if job.next_run is not None else None    # Monotonic schedule to wall clock
+        try:
+            with db_pool.get_pool().connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    """
+                    INSERT INTO scan_jobs (name, network, ports, interval_minutes, priority, state, last_started,
+                                           last_finished, last_duration, last_result, next_run, skipped)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    ON DUPLICATE KEY UPDATE
+                        network = VALUES(network), ports = VALUES(ports), interval_minutes = VALUES(interval_minutes),
+                        priority = VALUES(priority), state = VALUES(state), last_started = VALUES(last_started),
+                        last_finished = VALUES(last_finished), last_duration = VALUES(last_duration),
+                        last_result = VALUES(last_result), next_run = VALUES(next_run), skipped = VALUES(skipped)
+                    """,
+                    (job.name, job.network, job.ports, job.interval / 60, job.priority, job.state, to_datetime(job.last_started),
+                     to_datetime(job.last_finished), job.last_duration, job.last_result, to_datetime(next_run), job.skipped)
+                )
+                cursor.close()
+                conn.commit()
+        except Exception as e:
+            log.error('Scheduler', f"Unable to store the state of job {job.name}: {e}")
+
+    def poll_run_requests(self):
+        # Starts the runs requested through POST /api/jobs/<name>/run
+        try:
+            with db_pool.get_pool().connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT name FROM scan_jobs WHERE run_requested = 1")
+                names = [row[0] for row in cursor.fetchall()]
+                if names:
+                    cursor.execute("UPDATE scan_jobs SET run_requested = 0 WHERE name IN (" + ", ".join(["%s"] * len(names)) + ")", names)
+                cursor.close()
+                conn.commit()
+        except Exception as e:
+            log.error('Scheduler', f"Unable to read run requests: {e}")
+            return
+        for name in names:
+            self.trigger(name)
+
+#-----------------#
+# Creates a scheduler for the configured jobs.
+def create_scheduler(run_scan):
+    return ScanScheduler(load_jobs(), run_scan,
+                         max_concurrent=SCHEDULER_CONFIG['MAX_CONCURRENT_SCANS'],
+                         jitter=SCHEDULER_CONFIG['JITTER'],
+                         overlap=SCHEDULER_CONFIG['OVERLAP'],
+                         poll_interval=SCHEDULER_CONFIG['POLL_INTERVAL'])
@@ -0,0 +1,487 @@
+import rest_api
+import history
+import api_server
+from datetime import datetime
+import db_pool
+import metrics
+import notifications
+import inventory
+import gzip
+import collector
+import agent
+import network_monitor
+import nmap_stream
+import ipaddress
+import threading
+import urllib.error
+import pytest
+import werkzeug.serving
+from concurrent.futures import Future
+import json
+import re
+import subprocess
+import sys
+import time
+import urllib.request
+import base64
+import os
+import pymysql
+from unittest import mock
+
+def test_host_timeline_rejects_invalid_ip():
+    client = rest_api.app.test_client()
+    assert client.get('/api/hosts/not-an-ip/timeline').status_code == 400
+
+def test_host_timeline_reads_events_for_one_host():
+    with mock.patch('pymysql.connect') as mock_connect:
+        mock_cursor = mock_connect.return_value.cursor.return_value
+        mock_cursor.fetchall.return_value = [(7, 'Fri, 08 Nov 2024 07:07:50 GMT', 3, 443, 'https')]
+
+        response = rest_api.app.test_client().get('/api/hosts/10.0.0.1/timeline?limit=1')
+
+        assert response.status_code == 200
+        assert response.get_json() == {
+            'ip': '10.0.0.1',
+            'events': [{'id': 7, 'timestamp': 'Fri, 08 Nov 2024 07:07:50 GMT', 'event': 'port_opened', 'port': 443, 'detail': 'https'}],
+            'next_before_id': 7
+        }
+        query, params = mock_cursor.execute.call_args[0]
+        assert query.startswith("SELECT id, timestamp, event, port, detail FROM scan_events WHERE ip = %s")
+        assert params == ['10.0.0.1', 1]
+
+def make_scan_rows(count):
+    # Rows in the (id, ip, status) layout selected for fields=ip,status
+    return [(100 - i, f'10.0.0.{i}', 'up') for i in range(count)]
+
+def test_scans_are_paginated_filtered_and_projected():
+    rest_api.response_cache.clear()
+    with mock.patch('pymysql.connect') as mock_connect, \
+         mock.patch.object(rest_api, 'get_scan_generation', return_value=(1, None)):
+        mock_cursor = mock_connect.return_value.cursor.return_value
+        mock_cursor.fetchall.return_value = make_scan_rows(2)
+
+        response = rest_api.app.test_client().get('/api/scans?fields=ip,status&status=up&ip=10.0.0.0/24&limit=2')
+
+        body = response.get_json()
+        assert [item for item in body['items']] == [{'ip': '10.0.0.0', 'status': 'up'}, {'ip': '10.0.0.1', 'status': 'up'}]
+        assert rest_api.decode_cursor(body['next']) == 99
+
+        query, params = mock_cursor.execute.call_args[0]
+        assert query == ("SELECT id, ip, status FROM scans WHERE status = %s AND ip_num BETWEEN %s AND %s "
+                         "ORDER BY id DESC LIMIT %s")
+        assert params == ['up', 167772160, 167772415, 2]
+
+        # The next page continues below the last id, whatever happened to the rows' timestamps in between
+        rest_api.app.test_client().get('/api/scans?fields=ip&after=' + body['next'])
+        query, params = mock_cursor.execute.call_args[0]
+        assert query.endswith("WHERE id < %s ORDER BY id DESC LIMIT %s") and params[0] == 99
+        assert rest_api.decode_cursor(base64.urlsafe_b64encode(b'2024-11-08T07:07:50|42').decode()) == 42   # Cursors handed out before
+
+def test_scans_use_cache_and_conditional_get():
+    rest_api.response_cache.clear()
+    with mock.patch('pymysql.connect') as mock_connect, \
+         mock.patch.object(rest_api, 'get_scan_generation', return_value=(5, datetime(2024, 11, 8, 7, 7, 50))):
+        mock_connect.return_value.cursor.return_value.fetchall.return_value = []
+        client = rest_api.app.test_client()
+
+        first = client.get('/api/scans')
+        again = client.get('/api/scans')
+        revalidated = client.get('/api/scans', headers={'If-None-Match': first.headers['ETag']})
+
+        assert first.status_code == again.status_code == 200
+        assert mock_connect.call_count == 1            # The second request is served from the response cache
+        assert revalidated.status_code == 304
+        assert first.headers['Last-Modified'] == 'Fri, 08 Nov 2024 07:07:50 GMT'
+
+def test_scans_reject_unknown_fields_and_bad_cursor():
+    client = rest_api.app.test_client()
+    with mock.patch.object(rest_api, 'get_scan_generation', return_value=(1, None)):
+        assert client.get('/api/scans?fields=password').status_code == 400
+        assert client.get('/api/scans?after=garbage').status_code == 400
+
+def test_scans_stream_ndjson_from_server_side_cursor():
+    with mock.patch('pymysql.connect') as mock_connect, \
+         mock.patch.object(rest_api, 'get_scan_generation', return_value=(1, None)), \
+         mock.patch.object(rest_api, 'STREAM_CHUNK_ROWS', 2):
+        mock_cursor = mock_connect.return_value.cursor.return_value
+        rows = make_scan_rows(3)
+        mock_cursor.fetchmany.side_effect = [rows[:2], rows[2:], []]
+
+        response = rest_api.app.test_client().get('/api/scans?stream=ndjson&fields=ip,status')
+
+        assert response.mimetype == 'application/x-ndjson'
+        assert 'Content-Length' not in response.headers     # Sent incrementally, never buffered
+        lines = response.get_data(as_text=True).splitlines()
+        assert [json.loads(line) for line in lines] == [{'ip': f'10.0.0.{i}', 'status': 'up'} for i in range(3)]
+        mock_connect.return_value.cursor.assert_called_with(db_pool.InstrumentedSSCursor)
+        assert db_pool.get_pool().stats()['idle'] == 1      # The connection went back to the pool after the stream
+
+def test_scans_stream_json_array():
+    with mock.patch('pymysql.connect') as mock_connect, \
+         mock.patch.object(rest_api, 'get_scan_generation', return_value=(1, None)):
+        mock_connect.return_value.cursor.return_value.fetchmany.side_effect = [make_scan_rows(2), []]
+
+        response = rest_api.app.test_client().get('/api/scans?stream=json&fields=ip')
+
+        assert response.get_json() == [{'ip': '10.0.0.0'}, {'ip': '10.0.0.1'}]
+
+def test_jobs_list_and_run_request():
+    with mock.patch('pymysql.connect') as mock_connect:
+        mock_cursor = mock_connect.return_value.cursor.return_value
+        mock_cursor.fetchall.return_value = [('office', '10.0.0.0/24', '22', 5, 10, 'running', None, None, None, None, None, 2, 0)]
+        client = rest_api.app.test_client()
+
+        jobs = client.get('/api/jobs').get_json()['jobs']
+        assert (jobs[0]['name'], jobs[0]['state'], jobs[0]['skipped'], jobs[0]['run_requested']) == ('office', 'running', 2, False)
+
+        mock_cursor.execute.return_value = 1
+        assert client.post('/api/jobs/office/run').status_code == 202
+        assert mock_cursor.execute.call_args[0] == ("UPDATE scan_jobs SET run_requested = 1 WHERE name = %s", ('office',))
+
+        mock_cursor.execute.return_value = 0
+        mock_cursor.fetchone.return_value = None
+        assert client.post('/api/jobs/missing/run').status_code == 404
+
+def test_metrics_endpoint_exposes_api_and_scanner_metrics():
+    scanner = metrics.snapshot('scanner')
+    with mock.patch('pymysql.connect') as mock_connect:
+        mock_connect.return_value.cursor.return_value.fetchall.return_value = [(scanner,)]
+        client = rest_api.app.test_client()
+        client.get('/api/hosts/not-an-ip/timeline')
+        response = client.get('/metrics')
+
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    text = response.get_data(as_text=True)
+    assert 'networkmonitor_api_request_seconds_count{process="api",endpoint="/api/hosts/<ip>/timeline",method="GET",status="400"}' in text
+    assert text.count("# TYPE networkmonitor_api_request_seconds histogram") == 1
+
+def test_port_and_service_queries_use_host_ports():
+    with mock.patch('pymysql.connect') as mock_connect:
+        mock_cursor = mock_connect.return_value.cursor.return_value
+        seen = datetime(2024, 11, 8, 12, 0, 0)
+        mock_cursor.fetchall.return_value = [('10.0.0.5', 'tcp', 3389, 'open', 'ms-wbt-server', '', '', seen, 'up')]
+        client = rest_api.app.test_client()
+
+        body = client.get('/api/ports/3389?limit=1').get_json()
+        assert body['items'][0]['ip'] == '10.0.0.5' and body['items'][0]['status'] == 'up'
+        assert body['next'] == '10.0.0.5:3389'
+        query, params = mock_cursor.execute.call_args[0]
+        assert 'FROM host_ports p' in query and 'device_info' not in query
+        assert params == [3389, 'open', 1]
+
+        client.get('/api/services?product=OpenSSH&version=7.&after=10.0.0.5:22')
+        query, params = mock_cursor.execute.call_args[0]
+        assert "p.product = %s AND p.version LIKE %s AND p.state = %s AND (p.ip_num, p.port) > (%s, %s)" in query
+        assert params[:5] == ['OpenSSH', '7.%', 'open', 167772165, 22]
+
+    assert client.get('/api/services').status_code == 400
+    assert client.get('/api/services?name=ssh&after=bogus').status_code == 400
+    assert client.get('/api/ports/70000').status_code == 400
+
+def test_tuning_history_is_filtered_by_subnet():
+    with mock.patch('pymysql.connect') as mock_connect:
+        mock_cursor = mock_connect.return_value.cursor.return_value
+        mock_cursor.fetchall.return_value = [(7, datetime(2024, 11, 8), '10.0.0.0/24', 75, 300, 2, 300, 64, 12.5, 40, 0, 80, 2, 4.0, 'speed up')]
+        client = rest_api.app.test_client()
+
+        runs = client.get('/api/tuning?subnet=10.0.0.0/24&limit=5').get_json()['runs']
+        assert (runs[0]['subnet'], runs[0]['max_rate'], runs[0]['decision']) == ('10.0.0.0/24', 300, 'speed up')
+        query, params = mock_cursor.execute.call_args[0]
+        assert query.endswith("FROM scan_tuning WHERE subnet = %s ORDER BY id DESC LIMIT %s") and params == ['10.0.0.0/24', 5]
+
+def test_health_and_readiness():
+    client = rest_api.app.test_client()
+    assert client.get('/health').get_json() == {'status': 'ok', 'pid': os.getpid(), 'ppid': os.getppid()}
+    with mock.patch('pymysql.connect'):
+        assert client.get('/ready').status_code == 200
+    with mock.patch.object(db_pool.get_pool(), 'acquire', side_effect=pymysql.err.OperationalError(2003, "Can't connect")):
+        response = client.get('/ready')
+    assert response.status_code == 503 and response.get_json()['status'] == 'unavailable'
+
+def test_monitor_only_accepts_its_own_api_process_as_healthy():
+    server = werkzeug.serving.make_server('127.0.0.1', 0, rest_api.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with mock.patch.dict(network_monitor.FLASK_CONFIG, HOST='127.0.0.1', PORT=server.server_port):
+            own, other = mock.Mock(pid=os.getpid()), mock.Mock(pid=os.getpid() + 100000)
+            own.poll.return_value = other.poll.return_value = None
+            assert network_monitor.wait_for_api(own, 2)
+            assert not network_monitor.wait_for_api(other, 0.5)     # Something else already serves the port
+            own.poll.side_effect = [None, 1]                        # Answered, but the started process has exited since
+            assert not network_monitor.wait_for_api(own, 2)
+    finally:
+        server.shutdown()
+
+def test_api_server_exits_with_an_error_when_no_server_can_run():
+    with pytest.raises(SystemExit) as unknown:
+        api_server.serve('nginx')
+    assert unknown.value.code == 1
+    with mock.patch.object(api_server, 'run_waitress', side_effect=ImportError("No module named 'waitress'")) as waitress, \
+         mock.patch.object(api_server, 'run_flask', side_effect=ImportError("No module named 'flask'")) as flask:
+        with pytest.raises(SystemExit) as missing:
+            api_server.serve('waitress')
+    assert missing.value.code == 1 and waitress.called and flask.called
+
+WAITRESS_SCRIPT = """
+import sys, time
+sys.path.insert(0, sys.argv[1])
+import api_server
+@api_server.app.route('/slow')
+def slow():
+    time.sleep(1)
+    return 'done'
+api_server.run_waitress('127.0.0.1', 0)
+print('exited', flush=True)
+"""
+
+@pytest.mark.skipif(sys.platform == 'win32', reason="SIGTERM cannot be handled on Windows")
+def test_waitress_finishes_running_requests_on_sigterm():
+    process = subprocess.Popen([sys.executable, '-c', WAITRESS_SCRIPT, os.path.dirname(os.path.abspath(__file__))],
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    serving = None
+    try:
+        for line in process.stdout:
+            serving = re.search(r"http://127\.0\.0\.1:(\d+) with waitress", line)
+            if serving:
+                break
+        assert serving, "waitress did not start"
+        url = f"http://127.0.0.1:{serving.group(1)}"
+        responses = []
+        request = threading.Thread(target=lambda: responses.append(urllib.request.urlopen(url + '/slow', timeout=10).read()))
+        request.start()
+        time.sleep(0.3)                 # The request is being served
+        process.terminate()
+        request.join(10)
+        assert responses == [b'done']
+        assert process.wait(10) == 0 and 'exited' in process.stdout.read()
+        with pytest.raises(OSError):
+            urllib.request.urlopen(url + '/health', timeout=1)
+    finally:
+        process.kill()
+
+def test_event_stream_resumes_from_last_event_id_and_filters_per_client():
+    broker = notifications.EventBroker(max_clients=1)
+    broker.thread = mock.Mock()         # Live events are fed by hand instead of by the polling thread
+    with mock.patch.object(rest_api, 'event_broker', broker), mock.patch.dict(notifications.NOTIFY_CONFIG, KEEPALIVE=0.01), \
+         mock.patch('pymysql.connect') as mock_connect:
+        mock_cursor = mock_connect.return_value.cursor.return_value
+        mock_cursor.fetchone.return_value = (5,)
+        mock_cursor.fetchall.return_value = [(4, '10.0.0.1', datetime(2024, 11, 8), 3, 22, 'ssh'), (5, '10.0.0.2', datetime(2024, 11, 8), 3, 80, 'http')]
+        client = rest_api.app.test_client()
+
+        response = client.get('/api/events/stream?port=22', headers={'Last-Event-ID': '3'}, buffered=False)
+        assert response.mimetype == 'text/event-stream'
+        chunks = iter(response.response)
+        assert next(chunks) == b"retry: 5000\n\n"
+        # Missed events come from the database up to where the broker took over, port 80 is filtered out
+        assert next(chunks).startswith(b"id: 4\nevent: port_opened\n")
+        assert mock_cursor.execute.call_args[0][1] == [3, 5, 1000]
+
+        (subscriber,) = broker.subscribers
+        subscriber.put(notifications.event_dict('10.0.0.3', 4, 22, 'ssh', 6))
+        assert next(chunks).startswith(b"id: 6\nevent: port_closed\n")
+        assert next(chunks) == b": keepalive\n\n"
+
+        assert client.get('/api/events/stream').status_code == 503      # All stream slots are taken
+        assert client.get('/api/events/stream?event=bogus').status_code == 400
+        response.close()
+    assert not broker.subscribers
+
+def test_event_broker_skips_events_written_while_nobody_was_subscribed():
+    broker = notifications.EventBroker(queue_size=10)
+    broker.thread = mock.Mock()
+    newest = [100, 1600]
+    def read_last_id():
+        # Read without holding the lock the poller and the other streams need
+        assert broker.lock.acquire(blocking=False)
+        broker.lock.release()
+        return newest.pop(0)
+    with mock.patch.object(broker, 'read_last_id', side_effect=read_last_id), \
+         mock.patch.object(notifications, 'read_events', return_value=[notifications.event_dict('10.0.0.1', 3, 22, 'ssh', 1601)]) as read:
+        first, _ = broker.subscribe()
+        broker.unsubscribe(first)
+        # 1500 events are committed while the broker is idle; a new client starts after them instead of overflowing on a replay
+        client, last_id = broker.subscribe()
+        assert last_id == 1600
+        assert broker.poll() == 1
+        assert read.call_args[0][0] == 1600
+    assert client.get_nowait()['id'] == 1601 and client.empty()
+
+def test_inventory_answers_range_port_and_count_queries_and_applies_new_commits(tmp_path):
+    seen = datetime(2024, 11, 8, 12, 0, 0)
+    ssh = json.dumps({'ports': [{'port': 22, 'state': 'open'}, {'port': 80, 'state': 'closed'}]})
+    rows = [(167772165, 'up', 'a.lan', seen, ssh), (167772161, 'up', 'None', seen, None), (167772416, 'down', 'None', seen, ssh)]
+    snapshot = str(tmp_path / 'inventory.snapshot')
+    with mock.patch('pymysql.connect') as mock_connect, \
+         mock.patch.object(inventory, 'inventory', inventory.Inventory()), \
+         mock.patch.dict(inventory.INVENTORY_CONFIG, SNAPSHOT=snapshot), \
+         mock.patch.object(rest_api, 'get_scan_generation', return_value=(1, seen)) as generation:
+        mock_cursor = mock_connect.return_value.cursor.return_value
+        mock_cursor.fetchall.return_value = rows
+        client = rest_api.app.test_client()
+
+        body = client.get('/api/inventory?ip=10.0.0.0/24&limit=1').get_json()
+        assert body['items'] == [{'ip': '10.0.0.1', 'status': 'up', 'domain': 'None', 'timestamp': 'Fri, 08 Nov 2024 12:00:00 GMT', 'open_ports': []}]
+        assert client.get('/api/inventory?ip=10.0.0.0/24&after=' + body['next']).get_json()['items'][0]['ip'] == '10.0.0.5'
+        assert [host['ip'] for host in client.get('/api/inventory?port=22').get_json()['items']] == ['10.0.0.5', '10.0.1.0']
+        assert client.get('/api/inventory/count?port=22&status=up').get_json()['count'] == 1
+        assert client.get('/api/inventory/count?ip=10.0.0.0/16').get_json()['count'] == 3
+        assert mock_connect.call_count == 1            # Loaded once, the queries above are answered from memory
+
+        # The next commit only reads the rows written since the newest applied row
+        generation.return_value = (2, seen)
+        mock_cursor.fetchall.return_value = [(167772165, 'up', 'a.lan', seen, json.dumps({'ports': [{'port': 443, 'state': 'open'}]})),
+                                             (167772170, 'up', 'None', seen, ssh)]
+        assert [host['ip'] for host in client.get('/api/inventory?port=22').get_json()['items']] == ['10.0.0.10', '10.0.1.0']
+        query, params = mock_cursor.execute.call_args[0]
+        assert query.endswith("WHERE timestamp >= %s") and params[0] < seen
+        assert client.get('/api/inventory/count?port=443').get_json()['count'] == 1
+
+    # A restarted API process starts from the snapshot and catches up from its newest row
+    restored = inventory.Inventory()
+    assert restored.load(snapshot) and len(restored) == 3 and restored.synced_at == seen
+    assert restored.count(port=22) == 2 and restored.select(port=22)[0]['open_ports'] == [22]
+    with gzip.open(snapshot, 'rt') as saved:
+        assert json.load(saved)['rows'][0] == [167772161, 'up', 'None', seen.isoformat(), []]
+    with open(snapshot, 'wb') as tampered:
+        tampered.write(b"cos\nsystem\n(S'echo owned'\ntR.")     # A pickle payload is not loaded
+    assert not inventory.Inventory().load(snapshot)
+    assert client.get('/api/inventory?ip=bogus').status_code == 400
+    assert client.get('/api/inventory/count?port=70000').status_code == 400
+
+def test_export_streams_compressed_ndjson_and_validates_the_format():
+    rows = [(1, '10.0.0.1', 'up', 'None', datetime(2024, 11, 8, 7, 7, 50), '{"ports": []}')]
+    with mock.patch('pymysql.connect'), mock.patch.object(db_pool.get_pool(), 'stream', return_value=iter([rows, rows])) as stream:
+        response = rest_api.app.test_client().get('/api/export/scans?since=2024-11-08')
+        lines = gzip.decompress(response.get_data()).decode().splitlines()
+    assert response.headers['Content-Disposition'] == 'attachment; filename=scans.ndjson.gz'
+    assert len(lines) == 2 and json.loads(lines[0])['timestamp'] == '2024-11-08T07:07:50'
+    assert stream.call_args[0][1] == [datetime(2024, 11, 8)]
+
+    client = rest_api.app.test_client()
+    assert client.get('/api/export/users').status_code == 400
+    assert client.get('/api/export/events?format=xlsx').status_code == 400
+    assert client.get('/api/export/events?since=yesterday').status_code == 400
+
+    # Missing optional packages are reported before any row is read
+    with mock.patch.dict('sys.modules', {'zstandard': None, 'pyarrow': None, 'pyarrow.parquet': None}), \
+         mock.patch.object(db_pool.get_pool(), 'stream') as stream:
+        for url, package in (('/api/export/scans?compression=zstd', b'zstandard'), ('/api/export/scans?format=parquet', b'pyarrow')):
+            response = client.get(url)
+            assert response.status_code == 400 and b'pip install ' + package in response.get_data()
+    stream.assert_not_called()
+
+def fake_stream_shard(shard, ports, store, timing=None):
+    # Reports every address of the shard as up with ssh open, in two store calls like a streamed shard
+    records = [nmap_stream.HostRecord(str(ip), 'up', '', (('tcp', 22, 'open', 'ssh', '', ''),)) for ip in ipaddress.ip_network(shard).hosts()]
+    lookups = {record.ip: Future() for record in records}
+    for future in lookups.values():
+        future.set_result(None)
+    found = store(records[:1], lookups) | store(records[1:], lookups)
+    return found, {}, None
+
+def test_agents_push_compressed_batches_to_the_collector_on_localhost():
+    received, failures = [], [pymysql.err.OperationalError(2013, "Lost connection")]    # The first write fails and is resent
+    def receive_batch(payload, address):
+        if failures:
+            raise failures.pop()
+        received.append(payload)
+        return {'accepted': len(payload['hosts'])}
+
+    server = werkzeug.serving.make_server('127.0.0.1', 0, rest_api.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    try:
+        with mock.patch.dict(collector.COLLECTOR_CONFIG, ENABLED=True, TOKEN='secret'), \
+             mock.patch.object(collector, 'receive_batch', side_effect=receive_batch), \
+             mock.patch.object(collector, 'heartbeat') as heartbeat, \
+             mock.patch.object(network_monitor, 'stream_shard', side_effect=fake_stream_shard):
+            agents = [agent.ScanAgent(name, network, '22', agent.CollectorClient(url, 'secret', retries=2, backoff=0.01), batch_size=2)
+                      for name, network in (('site-a', '10.0.0.0/29'), ('site-b', '10.0.0.0/30'))]
+            results = []
+            threads = [threading.Thread(target=lambda a=a: results.append(a.run_cycle())) for a in agents]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(10)
+            assert results == [0, 0]
+
+            # Each agent numbers its batches, the last one carries the scanned networks
+            for name, hosts in (('site-a', 6), ('site-b', 2)):
+                batches = [payload for payload in received if payload['agent'] == name]
+                assert [payload['seq'] for payload in batches] == list(range(len(batches)))
+                assert sum(len(payload['hosts']) for payload in batches) == hosts
+                assert batches[-1]['final'] and not any(payload['final'] for payload in batches[:-1])
+            assert received[0]['hosts'][0][4] == [['tcp', 22, 'open', 'ssh', '', '']]
+
+            agents[0].client.post('/api/collector/heartbeat', agents[0].payload(state='idle'))
+            assert heartbeat.call_args[0][0]['networks'] == ['10.0.0.0/29']
+            with pytest.raises(urllib.error.HTTPError) as rejected:
+                agent.CollectorClient(url, 'wrong', retries=0).post('/api/collector/heartbeat', {'agent': 'site-c'})
+            assert rejected.value.code == 401
+    finally:
+        server.shutdown()
+
+def test_collector_sends_only_the_committed_events_of_concurrent_batches():
+    published, a_staged, b_failed = [], threading.Event(), threading.Event()
+    def persist(records, cursor, existing, lookups, stats):
+        # Agent a stages its events and waits while agent b stages its own and fails before committing
+        ip = records[0].ip
+        notifications.stage([(ip, history.EVENT_TYPES['host_up'], None, None)])
+        if ip == '10.0.0.1':
+            a_staged.set()
+            b_failed.wait(5)
+        else:
+            a_staged.wait(5)
+            raise pymysql.err.OperationalError(1213, "Deadlock found")
+        return {ip}
+
+    dispatcher = notifications.WebhookDispatcher(['http://127.0.0.1:9/hook'])
+    def receive(agent, ip):
+        try:
+            collector.receive_batch({'agent': agent, 'cycle': 7, 'seq': 1, 'hosts': [[ip, 'up', '', None, []]]}, '127.0.0.1')
+        except pymysql.err.Error:
+            b_failed.set()
+    with mock.patch('pymysql.connect') as mock_connect, \
+         mock.patch.dict(notifications.NOTIFY_CONFIG, WEBHOOKS=['http://127.0.0.1:9/hook']), \
+         mock.patch.object(notifications, 'dispatcher', dispatcher), \
+         mock.patch.object(dispatcher, 'publish', side_effect=published.extend), \
+         mock.patch.object(network_monitor, 'persist_scan_results', side_effect=persist):
+        cursor = mock_connect.return_value.cursor.return_value
+        cursor.fetchone.return_value = (7, 0, None)
+        cursor.fetchall.return_value = []
+        threads = [threading.Thread(target=receive, args=args) for args in (('site-a', '10.0.0.1'), ('site-b', '10.0.0.2'))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+
+    assert b_failed.is_set()
+    assert published == [('10.0.0.1', history.EVENT_TYPES['host_up'], None, None)]
+
+def test_collector_skips_hosts_of_other_online_agents_and_resent_batches():
+    started = datetime(2024, 11, 8, 12, 0, 0)
+    payload = {'agent': 'site-a', 'cycle': 7, 'seq': 0, 'final': True, 'scope': ['10.0.0.0/24'], 'failed': [],
+               'hosts': [['10.0.0.1', 'up', '', 'a.lan', [['tcp', 22, 'open', 'ssh', '', '']]], ['10.0.0.2', 'up', '', None, []]]}
+    with mock.patch('pymysql.connect') as mock_connect:
+        cursor = mock_connect.return_value.cursor.return_value
+        cursor.fetchone.side_effect = [(6, 3, None), (started,)]
+        # 10.0.0.2 belongs to another online agent, 10.0.0.9 was this agent's host and is gone
+        cursor.fetchall.side_effect = [[('10.0.0.2',)], [], [], [('10.0.0.9', 'up', 'fp', 'None')]]
+        result = collector.receive_batch(payload, '127.0.0.1')
+
+        assert (result['accepted'], result['skipped'], result['new'], result['gone']) == (1, 1, 1, 1)
+        statements = {call[0][0].split()[0] + ' ' + call[0][0].split()[2]: call[0][1] for call in cursor.executemany.call_args_list}
+        assert [row[0] for row in statements['INSERT scans']] == ['10.0.0.1'] and statements['INSERT scans'][0][3] == 'a.lan'
+        assert statements['INSERT host_agents'] == [('10.0.0.1', 'site-a')]
+        assert mock.call("UPDATE scans SET status = 'down' WHERE ip IN (%s)", ['10.0.0.9']) in cursor.execute.call_args_list
+
+        # The same batch sent again after a lost response is acknowledged without writing it
+        cursor.reset_mock()
+        cursor.fetchone.side_effect = [(7, 0, started)]
+        assert collector.receive_batch(payload, '127.0.0.1') == {'accepted': 0, 'duplicate': True}
+        cursor.executemany.assert_not_called()
+
+    with pytest.raises(collector.CollectorError):
+        collector.parse_hosts([['10.0.0.1', 'up']])
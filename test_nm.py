@@ -1,5 +1,26 @@
 import network_monitor
+import db_pool
+import pymysql
+import pytest
+import nmap
+import history
+import nmap_stream
+import io
+import json
+import metrics
+import logger
+import benchmark
+import scheduler
+import tuning
+import notifications
+import export
+import gzip
+import http.server
+import threading
+import socket
+import time
 from network_monitor import DatabaseConnection
+from datetime import datetime
 from config import DB_CONFIG
 from unittest import mock
 
@@ -20,7 +41,8 @@ def test_database_connection_establishes():
                 user=DB_CONFIG['user'],
                 password=DB_CONFIG['password'],
                 database=DB_CONFIG['database'],
-                charset='utf8mb4'
+                charset='utf8mb4',
+                cursorclass=db_pool.InstrumentedCursor
             )
             assert cursor == mock_cursor
 
@@ -34,8 +56,438 @@ def test_database_connection_closes():
         with DatabaseConnection() as cursor:
             pass
 
+        # The cursor is closed and the connection goes back to the pool for the next cycle
         mock_cursor.close.assert_called_once()
+        mock_connection.close.assert_not_called()
+        assert db_pool.get_pool().stats()['idle'] == 1
+
+        # A connection that lost its server is closed instead of being reused
+        with pytest.raises(pymysql.err.OperationalError):
+            with DatabaseConnection() as cursor:
+                raise pymysql.err.OperationalError(2013, 'Lost connection')
         mock_connection.close.assert_called_once()
+        assert db_pool.get_pool().stats()['size'] == 0
 
 def test_scan_network():
     assert network_monitor.scan_network("127.0.0.1","22,80,443") is not None
+
+def make_fake_scanner(hosts):
+    # Build an object that behaves like a finished nmap.PortScanner for the given {ip: {port: state}} mapping
+    scan = {}
+    for ip, ports in hosts.items():
+        scan[ip] = nmap.PortScannerHostDict({
+            'hostnames': [{'name': '', 'type': ''}],
+            'status': {'state': 'up', 'reason': 'syn-ack'},
+            'tcp': {port: {'state': state, 'name': 'svc', 'product': '', 'version': ''} for port, state in ports.items()},
+        })
+    fake = mock.Mock()
+    fake.all_hosts.return_value = sorted(scan)
+    fake.__getitem__ = lambda self, ip: scan[ip]
+    return fake
+
+def test_process_scan_results_batches_writes():
+    nm = make_fake_scanner({'10.0.0.1': {22: 'open'}, '10.0.0.3': {80: 'closed'}})
+    cursor = mock.Mock()
+    cursor.fetchall.side_effect = [[('10.0.0.2', 'up', '{}', 'None'), ('10.0.0.4', 'down', '{}', 'None')], []]
+
+    with mock.patch('socket.gethostbyaddr', side_effect=socket.herror):
+        network_monitor.process_scan_results(nm, cursor)
+
+    # One preload, one batched upsert for both hosts and one statement marking the missing host down
+    ports, upsert, new_events, down_events = cursor.executemany.call_args_list
+    assert [row[0] for row in upsert[0][1]] == ['10.0.0.1', '10.0.0.3']
+    assert ports[0][1] == [('10.0.0.1', 'tcp', 22, 'open', 'svc', '', ''), ('10.0.0.3', 'tcp', 80, 'closed', 'svc', '', '')]
+    assert mock.call("UPDATE scans SET status = 'down' WHERE ip IN (%s)", ['10.0.0.2']) in cursor.execute.call_args_list
+    assert cursor.execute.call_count == 5      # Preload, stored rows of the written hosts, down update and one generation bump per write
+
+    # Both batches of history events are written with one statement each
+    assert [event[:3] for event in new_events[0][1]] == [('10.0.0.1', 1, None), ('10.0.0.1', 3, 22), ('10.0.0.3', 1, None)]
+    assert down_events[0][1] == [('10.0.0.2', 2, None, None)]
+    cursor.connection.commit.assert_called_once()
+
+def test_split_targets_into_shards():
+    shards = network_monitor.split_targets("10.0.0.0/22 192.168.1.5 10.1.0.1-20", 24)
+    assert shards == ['10.0.0.0/24', '10.0.1.0/24', '10.0.2.0/24', '10.0.3.0/24', '192.168.1.5', '10.1.0.1-20']
+
+def test_update_device_status_skips_failed_shards():
+    cursor = mock.Mock()
+    existing = {'10.0.0.5': ('up', '{}', 'None'), '10.0.1.5': ('up', '{}', 'None')}
+
+    network_monitor.update_device_status(cursor, set(), existing, ['10.0.1.0/24'])
+
+    # Only the device outside the failed shard is marked down
+    assert cursor.execute.call_args_list[0] == mock.call("UPDATE scans SET status = 'down' WHERE ip IN (%s)", ['10.0.0.5'])
+    assert existing['10.0.1.5'][0] == 'up'
+
+def test_update_device_status_only_inside_scanned_networks():
+    cursor = mock.Mock()
+    existing = {'10.0.0.5': ('up', '{}', 'None'), '10.0.1.5': ('up', '{}', 'None')}
+    scope = [network_monitor.parse_network('10.0.0.0/24')]
+
+    network_monitor.update_device_status(cursor, set(), existing, [], scope)
+
+    # The device scanned by another job keeps its status
+    assert cursor.execute.call_args_list[0] == mock.call("UPDATE scans SET status = 'down' WHERE ip IN (%s)", ['10.0.0.5'])
+    assert existing['10.0.1.5'][0] == 'up'
+
+def test_update_device_status_without_a_cidr_scope_marks_every_missing_device_down():
+    cursor = mock.Mock()
+    existing = {'192.168.1.20': ('up', '{}', 'None'), '10.0.1.5': ('up', '{}', 'None')}
+    scope = [network_monitor.parse_network('192.168.1.1-50')]      # nmap range, cannot be matched against addresses
+
+    network_monitor.update_device_status(cursor, set(), existing, [], scope)
+
+    assert cursor.execute.call_args_list[0] == mock.call("UPDATE scans SET status = 'down' WHERE ip IN (%s, %s)", ['192.168.1.20', '10.0.1.5'])
+
+def test_version_probe_only_for_new_or_expired_fingerprints():
+    records = nmap_stream.records_from_scanner(make_fake_scanner({'10.0.0.1': {22: 'open', 80: 'open', 443: 'closed'}}))
+    fresh = (time.time(), 'ssh', 'OpenSSH', '9.6')
+    with mock.patch.dict(network_monitor.service_fingerprints, {'10.0.0.1': {22: fresh, 443: fresh}}, clear=True):
+        records, hosts, ports = network_monitor.plan_version_probe(records)
+
+        # Port 22 reuses its cached fingerprint, port 80 is newly open and 443 is forgotten once closed
+        assert hosts == ['10.0.0.1'] and ports == {80}
+        assert records[0].ports[0] == ('tcp', 22, 'open', 'ssh', 'OpenSSH', '9.6')
+        assert 443 not in network_monitor.service_fingerprints['10.0.0.1']
+
+        version_nm = make_fake_scanner({'10.0.0.1': {80: 'open'}})
+        version_nm['10.0.0.1']['tcp'][80].update(name='http', product='nginx', version='1.25')
+        records = network_monitor.merge_version_results(records, nmap_stream.records_from_scanner(version_nm))
+        assert records[0].ports[1] == ('tcp', 80, 'open', 'http', 'nginx', '1.25')
+        assert network_monitor.plan_version_probe(records)[1:] == ([], set())
+
+def test_dns_resolver_caches_found_and_missing_names():
+    resolver = network_monitor.DnsResolver(workers=2, ttl=60, negative_ttl=60, max_size=2)
+    names = {'10.0.0.1': ('host1.lan', [], ['10.0.0.1'])}
+
+    def fake_lookup(ip):
+        if ip not in names:
+            raise socket.herror(1, 'Unknown host')
+        return names[ip]
+
+    with mock.patch('socket.gethostbyaddr', side_effect=fake_lookup) as lookup:
+        first = {host: future.result() for host, future in resolver.start(['10.0.0.1', '10.0.0.2']).items()}
+        second = {host: future.result() for host, future in resolver.start(['10.0.0.1', '10.0.0.2']).items()}
+        assert first == second == {'10.0.0.1': 'host1.lan', '10.0.0.2': None}
+        assert lookup.call_count == 2       # The second round is served from the cache
+
+        resolver.start(['10.0.0.3'])['10.0.0.3'].result()
+        assert list(resolver.cache) == ['10.0.0.2', '10.0.0.3']    # Least recently used address was evicted
+
+def test_history_events_are_diffs_between_port_sets():
+    old = ('up', '{"hostname": "", "ports": [{"port": 22, "state": "open", "name": "ssh", "product": "OpenSSH", "version": "8.9"}, {"port": 80, "state": "open", "name": "http", "product": "", "version": ""}]}', 'None')
+    new = '{"hostname": "", "ports": [{"port": 22, "state": "open", "name": "ssh", "product": "OpenSSH", "version": "9.6"}, {"port": 80, "state": "closed", "name": "http", "product": "", "version": ""}, {"port": 443, "state": "open", "name": "https", "product": "", "version": ""}]}'
+
+    events = history.diff_device_info('10.0.0.1', old, 'up', new)
+
+    assert events == [
+        ('10.0.0.1', history.EVENT_TYPES['port_opened'], 443, 'https'),
+        ('10.0.0.1', history.EVENT_TYPES['port_closed'], 80, 'http'),
+        ('10.0.0.1', history.EVENT_TYPES['version_changed'], 22, 'ssh OpenSSH 9.6'),
+    ]
+    assert history.diff_device_info('10.0.0.1', old, 'up', old[1]) == []
+
+def test_connection_pool_limits_size_and_reports_waits():
+    with mock.patch('pymysql.connect') as mock_connect:
+        mock_connect.side_effect = lambda **kwargs: mock.Mock()
+        pool = db_pool.ConnectionPool(min_size=1, max_size=2, timeout=0.05, health_check_idle=0)
+
+        first = pool.acquire()
+        second = pool.acquire()
+        with pytest.raises(db_pool.PoolTimeoutError):
+            pool.acquire()                  # Both connections are in use
+
+        pool.release(first)
+        assert pool.acquire() is first     # Reused after a health check instead of reconnecting
+        first.ping.assert_called_with(reconnect=False)
+
+        stats = pool.stats()
+        assert mock_connect.call_count == 2
+        assert (stats['size'], stats['in_use'], stats['waits'], stats['timeouts']) == (2, 2, 1, 1)
+
+def test_unchanged_hosts_skip_serialization_and_writes():
+    records = nmap_stream.records_from_scanner(make_fake_scanner({'10.0.0.1': {22: 'open'}, '10.0.0.2': {80: 'open'}}))
+    cursor = mock.Mock()
+    cursor.fetchall.return_value = []
+    existing = {}
+
+    with mock.patch('socket.gethostbyaddr', side_effect=socket.herror):
+        network_monitor.reset_cycle_stats()
+        network_monitor.persist_scan_results(records, cursor, existing)
+        assert network_monitor.cycle_stats == {'unchanged': 0, 'changed': 0, 'new': 2, 'gone': 0}
+
+        # Second cycle: one port changes state, the other host is identical
+        records = nmap_stream.records_from_scanner(make_fake_scanner({'10.0.0.1': {22: 'open'}, '10.0.0.2': {80: 'closed'}}))
+        cursor.reset_mock()
+        cursor.fetchall.return_value = [('10.0.0.2', 'up', network_monitor.get_device_info_json(records[1]._replace(ports=(('tcp', 80, 'open', 'svc', '', ''),)))[0])]
+        network_monitor.reset_cycle_stats()
+        with mock.patch.object(network_monitor, 'get_device_info_json', wraps=network_monitor.get_device_info_json) as build_json:
+            network_monitor.persist_scan_results(records, cursor, existing)
+
+    assert network_monitor.cycle_stats == {'unchanged': 1, 'changed': 1, 'new': 0, 'gone': 0}
+    build_json.assert_called_once_with(records[1])          # No JSON is built for the unchanged host
+    ports, upserted, events = [call[0][1] for call in cursor.executemany.call_args_list]
+    assert [row[0] for row in upserted] == ['10.0.0.2']
+    assert upserted[0][4] == existing['10.0.0.2'][1]        # The stored fingerprint follows the write
+    assert events == [('10.0.0.2', history.EVENT_TYPES['port_closed'], 80, 'svc')]
+
+    # The normalized ports of the changed host are replaced, those of the unchanged host are left alone
+    assert mock.call("DELETE FROM host_ports WHERE ip IN (%s)", ['10.0.0.2']) in cursor.execute.call_args_list
+    assert ports == [('10.0.0.2', 'tcp', 80, 'closed', 'svc', '', '')]
+
+def test_hosts_written_by_the_collector_are_updated_in_place():
+    records = nmap_stream.records_from_scanner(make_fake_scanner({'10.0.0.7': {22: 'open'}}))
+    cursor = mock.Mock()
+    # The collector stored the host after this process preloaded its device state
+    cursor.fetchall.return_value = [('10.0.0.7', 'up', network_monitor.get_device_info_json(records[0])[0])]
+
+    with mock.patch('socket.gethostbyaddr', side_effect=socket.herror):
+        network_monitor.persist_scan_results(records, cursor, {})
+
+    # Its ports are replaced instead of inserted next to the collector's rows, and no host_up event is recorded again
+    assert mock.call("DELETE FROM host_ports WHERE ip IN (%s)", ['10.0.0.7']) in cursor.execute.call_args_list
+    ports, upserted = [call[0][1] for call in cursor.executemany.call_args_list]
+    assert [row[0] for row in upserted] == ['10.0.0.7']
+
+def test_store_waits_for_reverse_dns_without_holding_the_write_lock():
+    records = nmap_stream.records_from_scanner(make_fake_scanner({'10.0.0.1': {22: 'open'}}))
+    lookup = network_monitor.Future()                       # A PTR lookup waiting for the resolver timeout
+    cursor = mock.Mock()
+    cursor.fetchall.return_value = []
+    writer = threading.Thread(target=network_monitor.store_shard_results, args=(records, cursor, {}, {}, {'10.0.0.1': lookup}, dict(network_monitor.cycle_stats)))
+    writer.start()
+    time.sleep(0.1)
+
+    # Other shards can still write while this one waits for its names
+    acquired = []
+    def write_other_shard():
+        acquired.append(network_monitor.device_state_lock.acquire(timeout=1))
+        network_monitor.device_state_lock.release()
+    other = threading.Thread(target=write_other_shard)
+    other.start()
+    other.join(2)
+    assert acquired == [True] and writer.is_alive()
+    cursor.executemany.assert_not_called()
+
+    lookup.set_result('a.lan')
+    writer.join(2)
+    assert cursor.executemany.call_args_list[1][0][1][0][3] == 'a.lan'
+
+def make_blocking_scan():
+    # Scan function that blocks until released and records the networks it was started for
+    started, release = [], threading.Event()
+    def run_scan(network, ports):
+        started.append(network)
+        release.wait(5)
+        return 0
+    return run_scan, started, release
+
+def wait_for_idle(sched):
+    for thread in list(sched.threads.values()):
+        thread.join(5)
+
+def test_scheduler_runs_at_fixed_rate_and_skips_overlapping_runs():
+    run_scan, started, release = make_blocking_scan()
+    job = scheduler.ScanJob('office', '10.0.0.0/24', '22', 1)
+    sched = scheduler.ScanScheduler([job], run_scan, persist=False)
+
+    sched.tick(0)
+    assert job.state == 'running' and job.next_run == 60
+    sched.tick(130)                 # Still running two slots later: the run is skipped, the missed slot is dropped
+    assert (job.skipped, job.next_run) == (1, 180)
+
+    release.set()
+    wait_for_idle(sched)
+    assert (job.state, job.runs, job.last_result) == ('idle', 1, 'ok')
+    assert started == ['10.0.0.0/24']
+
+def test_scheduler_queues_overlapping_runs_and_starts_higher_priority_first():
+    run_scan, started, release = make_blocking_scan()
+    low = scheduler.ScanJob('low', '10.0.1.0/24', '22', 1, priority=0)
+    high = scheduler.ScanJob('high', '10.0.2.0/24', '22', 1, priority=5)
+    sched = scheduler.ScanScheduler([low, high], run_scan, max_concurrent=1, overlap='queue', persist=False)
+
+    sched.tick(0)
+    assert (high.state, low.state) == ('running', 'waiting')
+    assert sched.trigger('high') and high.state == 'queued'
+    assert not sched.trigger('unknown')
+
+    release.set()
+    wait_for_idle(sched)
+    sched.dispatch()                # The queued run of the high-priority job goes before the waiting low one
+    wait_for_idle(sched)
+    sched.dispatch()
+    wait_for_idle(sched)
+    assert started == ['10.0.2.0/24', '10.0.2.0/24', '10.0.1.0/24']
+
+NMAP_XML = b"""<?xml version="1.0"?>
+<nmaprun scanner="nmap">
+<host><status state="up" reason="syn-ack"/><address addr="10.0.0.1" addrtype="ipv4"/><address addr="AA:BB:CC:DD:EE:FF" addrtype="mac"/>
+<hostnames><hostname name="router.lan" type="PTR"/></hostnames>
+<ports><port protocol="tcp" portid="443"><state state="open"/><service name="https" product="nginx" version="1.25"/></port>
+<port protocol="tcp" portid="22"><state state="closed"/></port></ports></host>
+<host><status state="up" reason="syn-ack"/><address addr="10.0.0.2" addrtype="ipv4"/><hostnames/></host>
+</nmaprun>
+"""
+
+def test_stream_scan_yields_compact_host_records():
+    process = mock.Mock(returncode=0)
+    process.stdout = io.BytesIO(NMAP_XML)
+    process.stderr = io.BytesIO(b'')
+    process.poll.return_value = 0
+    with mock.patch.object(nmap_stream, 'find_nmap', return_value='nmap'), \
+         mock.patch('subprocess.Popen', return_value=process) as popen:
+        records = list(nmap_stream.stream_scan('10.0.0.0/30', '-Pn -p 22,443'))
+
+    assert popen.call_args[0][0] == ['nmap', '-oX', '-', '-Pn', '-p', '22,443', '10.0.0.0/30']
+    assert records == [
+        nmap_stream.HostRecord('10.0.0.1', 'up', 'router.lan', (('tcp', 22, 'closed', '', '', ''), ('tcp', 443, 'open', 'https', 'nginx', '1.25'))),
+        nmap_stream.HostRecord('10.0.0.2', 'up', '', ()),
+    ]
+    # Fingerprints match the ones built from python-nmap results
+    assert network_monitor.get_fingerprint(records[1]) == network_monitor.get_fingerprint(nmap_stream.records_from_scanner(make_fake_scanner({'10.0.0.2': {}}))[0])
+
+def test_import_loads_nmap_xml_and_exports_in_batches(tmp_path):
+    report = tmp_path / 'report.xml.gz'
+    report.write_bytes(gzip.compress(NMAP_XML))
+    with mock.patch('pymysql.connect') as mock_connect, \
+         mock.patch.object(network_monitor, 'get_device_state', return_value={}), \
+         mock.patch.dict(export.EXPORT_CONFIG, IMPORT_BATCH=1), \
+         mock.patch('socket.gethostbyaddr') as lookup:
+        cursor = mock_connect.return_value.cursor.return_value
+        assert network_monitor.import_scan_file(str(report)) == 2
+
+        # One transaction per batch, names taken from the report instead of reverse DNS
+        upserts = [call[0][1] for call in cursor.executemany.call_args_list if call[0][0].startswith('INSERT INTO scans')]
+        assert [[row[0] for row in rows] for rows in upserts] == [['10.0.0.1'], ['10.0.0.2']]
+        assert upserts[0][0][3] == 'router.lan' and upserts[1][0][3] == 'None'
+        assert cursor.connection.commit.call_count == 2
+        lookup.assert_not_called()
+
+        # A scans export is read back into the same host records
+        rows = [(1, '10.0.0.1', 'up', 'router.lan', datetime(2024, 11, 8), upserts[0][0][2])]
+        with mock.patch.object(db_pool.get_pool(), 'stream', return_value=iter([rows])) as stream:
+            assert export.export_file(str(tmp_path / 'scans.csv.gz'), 'scans', datetime(2024, 11, 1)) == 1
+        assert stream.call_args[0][:2] == ("SELECT id, ip, status, domain, timestamp, device_info FROM scans WHERE timestamp >= %s ORDER BY id", [datetime(2024, 11, 1)])
+        record, domain = next(export.read_records(str(tmp_path / 'scans.csv.gz')))
+        assert record == nmap_stream.HostRecord('10.0.0.1', 'up', 'router.lan', (('tcp', 22, 'closed', '', '', ''), ('tcp', 443, 'open', 'https', 'nginx', '1.25')))
+        assert domain == 'router.lan'
+
+    # UDP ports keep their protocol, ports stored before the protocol was recorded are read as TCP
+    udp = network_monitor.get_device_info_json(nmap_stream.HostRecord('10.0.0.3', 'up', '', (('udp', 53, 'open', 'domain', '', ''),)))[0]
+    assert export.record_from_row({'ip': '10.0.0.3', 'status': 'up', 'device_info': udp}).ports == (('udp', 53, 'open', 'domain', '', ''),)
+    legacy = json.dumps({'ports': [{'port': 22, 'state': 'open', 'name': 'ssh'}]})
+    assert export.record_from_row({'ip': '10.0.0.4', 'device_info': legacy}).ports == (('tcp', 22, 'open', 'ssh', '', ''),)
+
+    with pytest.raises(export.ExportError):
+        export.detect_format('scans.txt')
+
+def test_import_reports_malformed_rows_instead_of_crashing(tmp_path):
+    with pytest.raises(export.ExportError, match='10.0.0.7'):
+        export.record_from_row({'ip': '10.0.0.7', 'device_info': json.dumps({'ports': [{'state': 'open'}]})})   # Port entry without port
+    with pytest.raises(export.ExportError, match='10.0.0.8'):
+        export.record_from_row({'ip': '10.0.0.8', 'device_info': '{"ports": [{"port": 22, "sta'})              # Cut off mid-document
+
+    truncated = tmp_path / 'scans.ndjson'
+    truncated.write_text(json.dumps({'id': 1, 'ip': '10.0.0.7', 'status': 'up', 'device_info': '{"ports": [{"name": "ssh"}]}'}) + '\n')
+    with mock.patch('pymysql.connect'), mock.patch.object(network_monitor, 'get_device_state', return_value={}):
+        assert network_monitor.run_transfer(import_path=str(truncated)) == 1
+
+def test_adaptive_timing_backs_off_on_loss_and_speeds_up_on_clean_scans():
+    # Observation of a host that timed out after 40 seconds and of 1000 filtered ports that never answered
+    observation = tuning.new_observation()
+    host = nmap_stream.ET.fromstring('<host starttime="100" endtime="140" timedout="true"><ports>'
+                                     '<extraports state="filtered" count="1000"><extrareasons reason="no-response" count="1000"/></extraports>'
+                                     '<port protocol="tcp" portid="22"><state state="open" reason="syn-ack"/></port></ports></host>')
+    nmap_stream.observe_host(host, observation)
+    assert observation == {'hosts': 1, 'timeouts': 1, 'probes': 1001, 'no_response': 1000, 'slowest_host': 40, 'duration': 0.0}
+
+    tuner = tuning.TimingTuner(adaptive=True, persist=False)
+    assert '--max-rate 300 --max-retries 2' in tuner.arguments('10.0.0.0/24')
+    tuner.record('10.0.0.0/24', observation)
+    assert tuner.get_state('10.0.0.0/24')[0] == tuning.Timing(150, 3, 450, 32)      # Timeouts: half the rate, one more retry
+
+    # Filtered ports alone are the subnet's usual level of unanswered probes, not loss
+    tuner.record('10.0.0.0/24', dict(observation, timeouts=0))
+    assert tuner.get_state('10.0.0.0/24')[0] == tuning.Timing(225, 2, 121, 64)
+    tuner.record('10.0.0.0/24', None)                                               # A failed scan backs off as well
+    assert tuner.get_state('10.0.0.0/24')[0].max_rate == 112
+    assert tuning.TimingTuner(adaptive=False).arguments('10.0.0.0/24') == tuning.TUNING_CONFIG['ARGUMENTS']
+
+def test_webhooks_send_committed_events_in_batches_with_retry():
+    received, statuses = [], [500, 200]      # The first delivery fails and is retried
+    class Receiver(http.server.BaseHTTPRequestHandler):
+        def do_POST(self):
+            received.append(json.loads(self.rfile.read(int(self.headers['Content-Length']))))
+            self.send_response(statuses.pop(0))
+            self.end_headers()
+        def log_message(self, *args):
+            pass
+    server = http.server.HTTPServer(('127.0.0.1', 0), Receiver)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    url = f"http://127.0.0.1:{server.server_address[1]}/hook"
+    dispatcher = notifications.WebhookDispatcher([url], batch_size=10, batch_interval=0.05, retries=2, backoff=0.01)
+    dispatcher.stage([('10.0.0.9', history.EVENT_TYPES['host_up'], None, None)])
+    dispatcher.discard()                # Rolled back, never sent
+    dispatcher.stage([('10.0.0.1', history.EVENT_TYPES['host_up'], None, None), ('10.0.0.1', history.EVENT_TYPES['port_opened'], 22, 'ssh')])
+    dispatcher.flush()
+    for _ in range(100):
+        if len(received) == 2:
+            break
+        time.sleep(0.02)
+    server.shutdown()
+
+    assert received[0] == received[1]   # The same batch again after the failure
+    assert [(event['ip'], event['event'], event['port']) for event in received[1]['events']] == [('10.0.0.1', 'host_up', None), ('10.0.0.1', 'port_opened', 22)]
+
+def test_benchmark_harness_runs_against_stand_in_database():
+    with mock.patch('builtins.print', lambda *args, **kwargs: None):
+        results = benchmark.run_benchmark(50, clients=2, requests_per_client=5)
+
+    # Initial cycle: preload, stored rows, ports, upsert, events and generation bump; an unchanged cycle with the warm device state sends nothing
+    assert results['cycles']['initial']['queries'] == 6
+    assert results['cycles']['unchanged']['queries'] == 0
+    assert results['cycles']['unchanged']['hosts']['unchanged'] == 50
+    assert results['api_uncached']['requests'] == 10
+    metrics = benchmark.flatten(results)
+    assert benchmark.find_regressions(metrics, metrics, 0.5) == []
+    assert benchmark.find_regressions(metrics, {'initial.queries': 4}, 0.5) == [('initial.queries', 4, 6)]
+    queries, local = benchmark.split_metrics(metrics)
+    assert set(queries) == {'initial.queries', 'unchanged.queries', 'changed.queries'} and 'initial.seconds' in local
+
+def test_metrics_render_prometheus_text_and_merge_processes():
+    with mock.patch.object(metrics, 'registry', []):
+        requests = metrics.Counter('demo_requests', "Requests.", ('method',))
+        latency = metrics.Histogram('demo_seconds', "Latency.", buckets=(0.1, 1))
+        requests.inc(method='GET')
+        requests.inc(2, method='GET')
+        latency.observe(0.05)
+        latency.observe(5)
+        scanner = json.loads(metrics.snapshot('scanner'))
+
+        text = metrics.render(metrics.collect({'process': 'api'}) + scanner)
+
+    # One HELP/TYPE block per family, samples of both processes below it
+    assert text.count("# TYPE demo_requests_total counter") == 1 and "# HELP demo_requests_total Requests." in text
+    assert "# TYPE demo_seconds histogram" in text
+    assert 'demo_requests_total{process="api",method="GET"} 3' in text
+    assert 'demo_requests_total{process="scanner",method="GET"} 3' in text
+    assert 'demo_seconds_bucket{process="api",le="0.1"} 1' in text
+    assert 'demo_seconds_bucket{process="api",le="1"} 1' in text
+    assert 'demo_seconds_bucket{process="api",le="+Inf"} 2' in text
+    assert 'demo_seconds_sum{process="api"} 5.05' in text
+
+def test_logger_levels_and_rate_limit():
+    log = logger.RateLimitedLogger('INFO', rate=1, burst=2)
+    with mock.patch('builtins.print') as mock_print:
+        log.debug('nmap', "hidden")
+        for _ in range(5):
+            log.info('nmap', "Found device")
+        log.error('nmap', "errors are never dropped")
+    lines = [call[0][0] for call in mock_print.call_args_list]
+    assert len(lines) == 3 and lines[-1].endswith("errors are never dropped")
+
+    with mock.patch('builtins.print') as mock_print, mock.patch('time.monotonic', return_value=time.monotonic() + 10):
+        log.info('nmap', "after a pause")
+    assert "3 lines suppressed" in mock_print.call_args_list[0][0][0]
@@ -0,0 +1,162 @@
+#-----------------#
+# Imported modules
+import threading                            # Import threading for the lock guarding the per-subnet state
+from collections import namedtuple, deque   # Import namedtuple for timing profiles and deque for the recent loss history
+from colorama import Fore                   # Import Fore from colorama for colored terminal text
+import config                               # Import config to read the optional TUNING_CONFIG section
+import db_pool                              # Import db_pool for storing and reloading the tuning history
+from logger import log                      # Import log for leveled, rate-limited console output
+
+#-----------------#
+# Tuning settings with defaults for installations whose config.py has no TUNING_CONFIG yet
+TUNING_CONFIG = {
+    'ADAPTIVE': False,                      # Pick nmap timing per subnet from past cycles instead of the fixed ARGUMENTS
+    'ARGUMENTS': '-T5 --unprivileged',      # Timing arguments of every scan while ADAPTIVE is off
+    'BASE_ARGUMENTS': '-T4 --unprivileged', # Template in adaptive mode, the tuned options override its values
+    'INITIAL_RATE': 300,                    # --max-rate (packets per second) of a subnet without history
+    'RATE_BOUNDS': [10, 5000],
+    'RETRY_BOUNDS': [1, 6],                 # --max-retries
+    'HOST_TIMEOUT_BOUNDS': [30, 1200],      # --host-timeout in seconds
+    'PARALLELISM_BOUNDS': [8, 256],         # --max-parallelism (probes in flight)
+    'TIMEOUT_THRESHOLD': 0.02,              # Share of timed out hosts above which a subnet is backed off
+    'LOSS_THRESHOLD': 0.05,                 # Share of unanswered probes above the subnet's usual level above which it is backed off
+    'HISTORY': 10                           # Past cycles per subnet used for the usual level of unanswered probes
+}
+TUNING_CONFIG.update(getattr(config, 'TUNING_CONFIG', {}))
+
+# nmap timing options chosen for a subnet; --min-rate is derived from max_rate
+Timing = namedtuple('Timing', 'max_rate max_retries host_timeout parallelism')
+
+# Columns of the scan_tuning table, in insert order
+TUNING_FIELDS = ('subnet', 'min_rate', 'max_rate', 'max_retries', 'host_timeout', 'parallelism',
+                 'duration', 'hosts', 'timeouts', 'probes', 'no_response', 'slowest_host', 'decision')
+
+#-----------------#
+# Returns a fresh observation of one shard scan, filled in by nmap_stream while nmap reports hosts.
+def new_observation():
+    return {'hosts': 0, 'timeouts': 0, 'probes': 0, 'no_response': 0, 'slowest_host': 0.0, 'duration': 0.0}
+
+#-----------------#
+# Returns the nmap timing arguments for a profile.
+def timing_arguments(timing):
+    return (f"{TUNING_CONFIG['BASE_ARGUMENTS']} --min-rate {max(1, timing.max_rate // 4)} --max-rate {timing.max_rate} "
+            f"--max-retries {timing.max_retries} --host-timeout {timing.host_timeout}s --max-parallelism {timing.parallelism}")
+
+#-----------------#
+# Returns the profile for the next run from the profile of the last run and what it observed, with the decision taken.
+def adapt(timing, observation, loss_floor=0.0):
+    clamp = lambda value, bounds: max(bounds[0], min(bounds[1], value))
+    rates, retries, host_timeouts, parallelism = (TUNING_CONFIG['RATE_BOUNDS'], TUNING_CONFIG['RETRY_BOUNDS'],
+                                                  TUNING_CONFIG['HOST_TIMEOUT_BOUNDS'], TUNING_CONFIG['PARALLELISM_BOUNDS'])
+    if observation is None:
+        congested, clean = True, False                      # The whole shard failed or hit the scan timeout
+    else:
+        timeout_rate = observation['timeouts'] / max(1, observation['hosts'])
+        # Filtered ports never answer; only unanswered probes above the subnet's usual level count as loss
+        loss = observation['no_response'] / max(1, observation['probes']) - loss_floor
+        congested = timeout_rate > TUNING_CONFIG['TIMEOUT_THRESHOLD'] or loss > TUNING_CONFIG['LOSS_THRESHOLD']
+        clean = observation['timeouts'] == 0 and loss <= TUNING_CONFIG['LOSS_THRESHOLD'] / 2
+
+    # Back off quickly when probes get lost, speed up gradually while the subnet keeps up
+    if congested:
+        return Timing(clamp(timing.max_rate // 2, rates), clamp(timing.max_retries + 1, retries),
+                      clamp(int(timing.host_timeout * 1.5), host_timeouts), clamp(timing.parallelism // 2, parallelism)), 'back off'
+    if clean:
+        host_timeout = clamp(int(observation['slowest_host'] * 3) + 1, host_timeouts) if observation['slowest_host'] else timing.host_timeout
+        return Timing(clamp(int(timing.max_rate * 1.5), rates), clamp(timing.max_retries - 1, retries),
+                      host_timeout, clamp(timing.parallelism * 2, parallelism)), 'speed up'
+    return timing, 'keep'
+
+#-----------------#
+# Hands out nmap timing arguments per subnet and adapts them after every scan of the subnet.
+class TimingTuner:
+
+    def __init__(self, adaptive=False, persist=True):
+        self.adaptive = adaptive
+        self.persist = persist                  # Store every run in the scan_tuning table and reload the history from it
+        self.subnets = {}                       # subnet -> [timing of the next run, recent shares of unanswered probes]
+        self.lock = threading.RLock()           # Reentrant, record() loads unseen subnets while holding it
+
+    def arguments(self, subnet):
+        # Returns the timing arguments of the next scan of the subnet
+        if not self.adaptive:
+            return TUNING_CONFIG['ARGUMENTS']
+        return timing_arguments(self.get_state(subnet)[0])
+
+    def record(self, subnet, observation):
+        # Adapts the subnet's timing to what its last scan observed (None if it failed) and stores the run
+        if not self.adaptive:
+            return
+        with self.lock:
+            state = self.get_state(subnet)
+            timing, losses = state
+            if observation is not None and observation['probes']:
+                losses.append(observation['no_response'] / observation['probes'])
+            state[0], decision = adapt(timing, observation, min(losses, default=0.0))
+            decision = decision if observation is not None else 'failed'
+        if state[0] != timing:
+            log.info('tuning', f"{Fore.GREEN}{subnet}{Fore.WHITE}: {decision}, max rate {timing.max_rate} -> {state[0].max_rate}/s, "
+                               f"retries {state[0].max_retries}, host timeout {state[0].host_timeout}s, parallelism {state[0].parallelism}.")
+        self.save_run(subnet, timing, observation, decision)
+
+    def get_state(self, subnet):
+        # Returns the subnet's state, replaying its stored history the first time the subnet is scanned by this process
+        with self.lock:
+            state = self.subnets.get(subnet)
+            if state is None:
+                state = self.subnets[subnet] = self.load_state(subnet)
+            return state
+
+    def load_state(self, subnet):
+        timing = Timing(TUNING_CONFIG['INITIAL_RATE'], 2, 300, 64)
+        losses = deque(maxlen=TUNING_CONFIG['HISTORY'])
+        rows = self.load_history(subnet)
+        for row in rows:
+            if row['probes']:
+                losses.append(row['no_response'] / row['probes'])
+        if rows:
+            # The newest run decides the next timing exactly like it did when it was recorded
+            last = rows[-1]
+            observation = None if last['decision'] == 'failed' else {name: last[name] for name in new_observation()}
+            timing, _ = adapt(Timing(last['max_rate'], last['max_retries'], last['host_timeout'], last['parallelism']),
+                              observation, min(losses, default=0.0))
+        return [timing, losses]
+
+    def load_history(self, subnet):
+        # Reads the newest HISTORY runs of the subnet, oldest first
+        if not self.persist:
+            return []
+        try:
+            with db_pool.get_pool().connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f"SELECT {', '.join(TUNING_FIELDS)} FROM scan_tuning WHERE subnet = %s ORDER BY id DESC LIMIT %s",
+                               (subnet, TUNING_CONFIG['HISTORY']))
+                rows = [dict(zip(TUNING_FIELDS, row)) for row in cursor.fetchall()]
+                cursor.close()
+        except Exception as e:
+            log.error('tuning', f"Unable to load the tuning history of {subnet}: {e}")
+            return []
+        return rows[::-1]
+
+    def save_run(self, subnet, timing, observation, decision):
+        # Stores the timing a run used, what it observed and the decision for the next run
+        if not self.persist:
+            return
+        observation = observation or dict(new_observation(), duration=None)
+        try:
+            with db_pool.get_pool().connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    f"INSERT INTO scan_tuning ({', '.join(TUNING_FIELDS)}) VALUES ({', '.join(['%s'] * len(TUNING_FIELDS))})",
+                    (subnet, max(1, timing.max_rate // 4), timing.max_rate, timing.max_retries, timing.host_timeout, timing.parallelism,
+                     observation['duration'], observation['hosts'], observation['timeouts'], observation['probes'],
+                     observation['no_response'], observation['slowest_host'], decision)
+                )
+                cursor.close()
+                conn.commit()
+        except Exception as e:
+            log.error('tuning', f"Unable to store the tuning run of {subnet}: {e}")
+
+#-----------------#
+# Shared tuner of this process
+tuner = TimingTuner(TUNING_CONFIG['ADAPTIVE'])